@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Discordに接続しない監視(コマンドライン).
+Botと同じ監視エンジンで判定し、サーバ毎の状態と警告を1行1件のjson(NDJSON)で標準出力またはファイルに出力する.
+指定しなかった値は settings.ini の値を使う. 敵プレイヤーは settings.ini の enemy_list と --enemy の指定.
+ログは標準エラー出力に出す.
+実行例:
+  python atlas-watch-cli.py --world 2 --grids A1 B7 --interval 60
+  python atlas-watch-cli.py --world 2 --grids B7 --replay all --output result.ndjson
+  python -m cProfile -o cli.pstats atlas-watch-cli.py --grids B7 --replay all
+出力:
+  {"type": "grid", "tick": 回数, "server": サーバ名, "player_count": 人数, "delta": 増減, "enemies": [...], ...}
+  {"type": "alert", "tick": 回数, "server": サーバ名, "message": 警告メッセージ}
+  {"type": "tick", "tick": 回数, "elapsed": 処理時間(秒), "stage_times": 段階毎の処理時間(秒), ...}
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import traceback
+from functools import partial
+
+from awsdb import consts
+from awsdb.fetcher import AtlasFetcher
+from awsdb.headless import HeadlessClient, HeadlessPipeline, HeadlessServer, NdjsonOutput, run_headless
+from awsdb.recorder import ReplayFetcher, archive_paths
+from awsdb.utils import ASWDConfig, Utils
+from awsdb.watcher import WatchEngine
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Discordに接続せずに監視し、結果をNDJSONで出力する")
+    parser.add_argument("--grids", nargs="+", required=True, help="監視サーバ名(A1-O15)")
+    parser.add_argument("--world", type=int, default=None, help="監視ワールド(クラスターID). 省略時は settings.ini")
+    parser.add_argument("--interval", type=int, default=None, help="監視間隔(秒). 省略時は settings.ini")
+    parser.add_argument("--sbn", type=int, default=None, help="通知人数. 省略時は settings.ini")
+    parser.add_argument("--company-count", type=int, default=None, help="カンパニー集結人数. 省略時は settings.ini")
+    parser.add_argument("--enemy", action="append", default=[], metavar="NAME[=COMPANY]", help="敵プレイヤー(複数指定可)")
+    parser.add_argument("--ticks", type=int, default=0, help="監視回数. 0 の場合は終了しない(再生時は最後まで)")
+    parser.add_argument("--replay", nargs="+", default=None, metavar="FILE",
+                        help="APIの代わりに記録ファイルを再生する(all で {} の全ファイル)".format(consts.RECORD_FOLDER))
+    parser.add_argument("--output", default=None, help="出力ファイル. 省略時は標準出力")
+    args = parser.parse_args()
+    for grid in args.grids:
+        if not Utils.exists_server_name(grid.upper()):
+            parser.error("サーバ名はA1-O15の値を指定してください. {}".format(grid))
+    return args
+
+
+def main():
+    args = parse_args()
+    stream = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    # 監視エンジンのログで出力が崩れないよう、ログは標準エラー出力に出す
+    sys.stdout = sys.stderr
+    os.makedirs(consts.LOG_FOLDER, exist_ok=True)
+
+    server = HeadlessServer(args.grids)
+    config = ASWDConfig(HeadlessClient([server]), guild_db_path=":memory:", load_state=False)
+    guild = config.guild(server)
+    guild.watch_world = args.world if args.world is not None else config.watch_world
+    guild.watch_interval = args.interval if args.interval is not None else config.watch_interval
+    if args.sbn is not None:
+        guild.player_sbn_count = args.sbn
+    if args.company_count is not None:
+        guild.company_alert_count = args.company_count
+    for enemy in args.enemy:
+        name, sep, company = enemy.partition("=")
+        guild.add_enemy(name, company)
+
+    frames = None
+    if args.replay is not None:
+        paths = archive_paths() if [path.lower() for path in args.replay] == ["all"] else args.replay
+        fetcher = ReplayFetcher(paths)
+        frames = fetcher.frames()
+    else:
+        fetcher = AtlasFetcher()
+    output = NdjsonOutput(stream)
+    engine = WatchEngine(config, fetcher, pipeline_factory=partial(HeadlessPipeline, output=output))
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run_headless(engine, guild, output, args.ticks, guild.watch_interval, frames))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print("【エラー】監視が異常終了.")
+        with open(consts.LOG_FILE, 'a') as f:
+            traceback.print_exc(file=f)
+        traceback.print_exc()
+        exit(1)
+    finally:
+        engine.match_service.shutdown()
+        if stream is not sys.__stdout__:
+            stream.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+監視プロセス.
+Discordには接続せず、Atlas API の取得とプレイヤー情報のデコードだけを行い、
+settings.ini の feed_address で待ち受けて接続してきた通知プロセス(feed_address を指定して起動した Bot)に配信する.
+"""
+import asyncio
+import multiprocessing
+import os
+import traceback
+
+from awsdb import consts
+from awsdb.feed import FeedServer
+from awsdb.fetcher import AtlasFetcher
+from awsdb.matcher import MatchService
+from awsdb.recorder import ResponseRecorder
+from awsdb.utils import ASWDConfig
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    os.makedirs(consts.LOG_FOLDER, exist_ok=True)
+    # Botのギルド設定DBや監視状態スナップショットには触れないよう、settings.ini の値だけを読み込む
+    settings = ASWDConfig.load_settings()
+    feed_address = settings[consts.KEY_FEED_ADDRESS]
+    if not feed_address:
+        print("【エラー】settings.ini の feed_address に待ち受けるアドレスを指定してください. 例: 127.0.0.1:8765")
+        exit(1)
+    recorder = ResponseRecorder(max_bytes=settings[consts.KEY_RECORD_MAX_MB] * 1024 * 1024) \
+        if settings[consts.KEY_RECORD] else None
+    match_workers = settings[consts.KEY_MATCH_WORKERS]
+    match_service = MatchService(settings[consts.KEY_MATCH_MODE], match_workers if match_workers > 0 else None)
+    server = FeedServer(feed_address, settings[consts.KEY_WATCH_INTERVAL], AtlasFetcher(recorder=recorder),
+                        match_service)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(server.serve())
+    except KeyboardInterrupt:
+        print("監視プロセス終了.")
+    except Exception as e:
+        print("【エラー】監視プロセスが異常終了.")
+        with open(consts.LOG_FILE, 'a') as f:
+            traceback.print_exc(file=f)
+        exit(1)
+    finally:
+        match_service.shutdown()
+        if recorder:
+            recorder.close()
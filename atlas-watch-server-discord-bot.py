@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import multiprocessing
 import os
 import discord
-from discord import ChannelType, Client, Message
+from discord import Client, Message
 from awsdb import commands, consts
+from awsdb.feed import FeedFetcher
+from awsdb.fetcher import AtlasFetcher
+from awsdb.lagmonitor import LoopLagMonitor
+from awsdb.recorder import ResponseRecorder
+from awsdb.sweep import BlacklistSweeper
 from awsdb.utils import ASWDConfig, Utils
+from awsdb.watcher import WatchEngine, WatchSupervisor
 import traceback
 
 
 # global var
 client: Client = discord.Client()
 config: ASWDConfig = ASWDConfig(client)
-cmd_manager: commands.CommandManager = commands.CommandManager(config)
+# feed_address を指定した場合は取得を監視プロセス(atlas-watch-feed.py)に任せ、このプロセスは判定と通知のみ行う
+recorder: ResponseRecorder = ResponseRecorder(max_bytes=config.record_max_mb * 1024 * 1024) \
+    if config.record and not config.feed_address else None
+feed: FeedFetcher = FeedFetcher(config.feed_address) if config.feed_address else None
+engine: WatchEngine = WatchEngine(config, feed if feed else AtlasFetcher(recorder=recorder))
+# 巡回と /peek も監視プロセスから取得し、このプロセスからは Atlas API にアクセスしない
+on_demand_fetcher = feed.on_demand() if feed else None
+supervisor: WatchSupervisor = WatchSupervisor(config, engine, BlacklistSweeper(config, engine, on_demand_fetcher))
+lag_monitor: LoopLagMonitor = LoopLagMonitor(config.lag_threshold_ms / 1000)
+cmd_manager: commands.CommandManager = commands.CommandManager(config, supervisor, lag_monitor, on_demand_fetcher)
+guild_flusher = None
+config_reloader = None
 
 
 @client.event
@@ -29,17 +48,39 @@ async def on_ready():
         print("ログ出力フォルダ作成.")
         os.makedirs(consts.LOG_FOLDER, exist_ok=True)
 
+        global guild_flusher, config_reloader
+        if not guild_flusher:
+            guild_flusher = client.loop.create_task(config.guilds.run_flusher())
+        if not config_reloader:
+            config_reloader = client.loop.create_task(config.run_reloader(supervisor.apply_settings))
+        if not lag_monitor.is_running:
+            lag_monitor.start(client.loop)
+
+        # チャンネル作成と起動メッセージの送信はギルド毎に並列で行う(同時実行数は Utils.outbound で制限)
+        channels = Utils.get_cmd_channels(client)
         servers = Utils.get_none_cmd_channel_servers(client)
         if servers:
             print("Bot用コマンドチャンネル追加...")
-            for server in servers:
-                await client.create_channel(server, consts.CMD_CHANNEL_NAME, type=ChannelType.text)
+            created = await asyncio.gather(*[Utils.create_channel(client, server, consts.CMD_CHANNEL_NAME)
+                                             for server in servers])
+            channel_ids = set(channel.id for channel in channels)
+            channels.extend(channel for channel in created if channel is not None and channel.id not in channel_ids)
             print("Bot用コマンドチャンネル追加完了.")
 
+        resumed = False
+        if config.auto_start and config.is_watch_started and not supervisor.is_running:
+            print("前回の監視状態から監視を自動再開.")
+            supervisor.start()
+            resumed = True
+
         msg = "起動.\nこのチャンネルでコマンドを実行します.\n/? を入力すると使い方を表示します."
-        channels = Utils.get_cmd_channels(client)
-        for channel in channels:
-            await client.send_message(channel, msg)
+
+        async def announce(channel):
+            await Utils.send_message(client, channel, msg)
+            if resumed and config.guild(channel.server).is_watch_started:
+                await Utils.send_message(client, channel, "前回の監視状態から監視を自動再開.")
+
+        await asyncio.gather(*[announce(channel) for channel in channels])
     except Exception as e:
         print("【エラー】on_ready. 処理終了.")
         with open(consts.LOG_FILE, 'a') as f:
@@ -67,4 +108,10 @@ async def on_message(message):
 
 
 if __name__ == "__main__":
-    client.run(config.token)
+    multiprocessing.freeze_support()
+    try:
+        client.run(config.token)
+    finally:
+        config.guilds.flush()
+        if recorder:
+            recorder.close()
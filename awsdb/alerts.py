@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import time
+
+from awsdb import consts
+
+# 警告の種別
+ALERT_ENEMY = "enemy"  # ブラックリストの侵入(メンバーは敵プレイヤー)
+ALERT_COMPANY = "company"  # カンパニー集結(メンバーはカンパニー名)
+ALERT_SURGE = "surge"  # 人数急増
+ALERT_MOVEMENT = "movement"  # 隣接サーバからの移動
+ALERT_APPROACH = "approach"  # 隣接サーバへの接近
+
+
+class AlertState:
+    """
+    (サーバ名, 警告の種別) 毎の警告状態.
+    """
+
+    __slots__ = ("members", "misses", "hits", "last_sent")
+
+    def __init__(self, members=None, misses=None, last_sent=0.0):
+        """
+        コンストラクタ.
+        :param members: 通知済みのメンバーの集合
+        :type members: set of str
+        :param misses: メンバー: 続けて確認できなかった回数
+        :type misses: dict
+        :param last_sent: 最後に通知した時刻(UNIX時間)
+        :type last_sent: float
+        """
+        self.members = members if members is not None else set()
+        self.misses = misses if misses is not None else {}
+        # 未通知のメンバー: 続けて確認できた回数
+        self.hits = {}
+        self.last_sent = last_sent
+
+
+class AlertTracker:
+    """
+    ギルドの警告状態管理クラス.
+    サーバと警告の種別毎に状態を持ち、意味のある変化があった時だけ通知するよう判定する.
+      - 侵入・集結(メンバーを持つ警告): メンバーは enter_ticks 回続けて確認できたら通知済みにし、
+        exit_ticks 回続けて確認できなかったら外す.
+        1回だけの誤った取得結果で通知したり、取得の度に出入りを繰り返すプレイヤーで
+        「やってきた」「どこかへ行った」が交互に通知されたりしないようにする.
+      - 急増・移動(1回限りの警告): 最後に通知してから cooldown 秒間は同じサーバに通知しない.
+    """
+
+    def __init__(self, enter_ticks=consts.ALERT_ENTER_TICKS, exit_ticks=consts.ALERT_EXIT_TICKS,
+                 cooldown=consts.ALERT_COOLDOWN):
+        """
+        コンストラクタ.
+        :param enter_ticks: メンバーが現れたとみなす、続けて確認できた回数
+        :type enter_ticks: int
+        :param exit_ticks: メンバーがいなくなったとみなす、続けて確認できなかった回数
+        :type exit_ticks: int
+        :param cooldown: 1回限りの警告を同じサーバに再通知しない秒数
+        :type cooldown: float
+        """
+        self.__enter_ticks = max(1, enter_ticks)
+        self.__exit_ticks = max(1, exit_ticks)
+        self.__cooldown = cooldown
+        # (サーバ名, 警告の種別): 警告状態
+        self.__states = {}
+
+    def __len__(self):
+        return len(self.__states)
+
+    def observe(self, server_name, kind, present, now=None):
+        """
+        今回確認したメンバーで警告状態を更新する.
+        :param server_name: サーバ名
+        :type server_name: str
+        :param kind: 警告の種別
+        :type kind: str
+        :param present: 今回確認したメンバー
+        :type present: collections.abc.Iterable of str
+        :param now: 現在時刻(UNIX時間). 省略時は現在時刻.
+        :type now: float
+        :return: (新たに現れたメンバーのリスト, いなくなったメンバーのリスト, 新たに現れる前のメンバーの有無)
+        :rtype: tuple
+        """
+        key = (server_name, kind)
+        present = set(present)
+        state = self.__states.get(key)
+        if state is None:
+            if not present:
+                return [], [], False
+            state = AlertState()
+            self.__states[key] = state
+        was_active = len(state.members) > 0
+
+        entered = []
+        for member in present - state.members:
+            hits = state.hits.get(member, 0) + 1
+            if hits < self.__enter_ticks:
+                state.hits[member] = hits
+                continue
+            entered.append(member)
+            state.members.add(member)
+            state.hits.pop(member, None)
+        # 続けて確認できなかった未通知のメンバーは数え直す
+        for member in [member for member in state.hits if member not in present]:
+            del state.hits[member]
+        exited = []
+        for member in state.members - present:
+            misses = state.misses.get(member, 0) + 1
+            if misses < self.__exit_ticks:
+                state.misses[member] = misses
+                continue
+            exited.append(member)
+            state.members.discard(member)
+            state.misses.pop(member, None)
+        for member in present:
+            state.misses.pop(member, None)
+
+        if entered:
+            state.last_sent = now if now is not None else time.time()
+        if not state.members and not state.hits:
+            del self.__states[key]
+        return sorted(entered), sorted(exited), was_active
+
+    def pulse(self, server_name, kind, now=None):
+        """
+        1回限りの警告を通知してよいか判定し、通知する場合は通知時刻を記録する.
+        :param server_name: サーバ名
+        :type server_name: str
+        :param kind: 警告の種別
+        :type kind: str
+        :param now: 現在時刻(UNIX時間). 省略時は現在時刻.
+        :type now: float
+        :return: 判定結果(True: 通知する, False: 再通知しない期間中)
+        :rtype: bool
+        """
+        now = now if now is not None else time.time()
+        key = (server_name, kind)
+        state = self.__states.get(key)
+        if state is not None and now - state.last_sent < self.__cooldown:
+            return False
+        self.__states[key] = AlertState(last_sent=now)
+        self.expire(now)
+        return True
+
+    def expire(self, now=None):
+        """
+        再通知しない期間が過ぎた1回限りの警告の状態を削除する.
+        :param now: 現在時刻(UNIX時間). 省略時は現在時刻.
+        :type now: float
+        :return: None
+        :rtype: None
+        """
+        now = now if now is not None else time.time()
+        expired = [key for key, state in self.__states.items()
+                   if not state.members and not state.hits and self.__cooldown <= now - state.last_sent]
+        for key in expired:
+            del self.__states[key]
+
+    def members(self, server_name, kind):
+        """
+        通知済みのメンバーを取得する.
+        :rtype: set of str
+        """
+        state = self.__states.get((server_name, kind))
+        return state.members if state is not None else set()
+
+    def active_server_names(self, kind):
+        """
+        通知済みのメンバーがいるサーバ名を取得する.
+        :param kind: 警告の種別
+        :type kind: str
+        :return: サーバ名のリスト(昇順)
+        :rtype: list of str
+        """
+        return sorted(key[0] for key, state in self.__states.items() if key[1] == kind and state.members)
+
+    def clear(self):
+        self.__states = {}
+
+    def to_records(self):
+        """
+        保存用に警告状態を変換する. 未通知のメンバーの確認回数は保存しない.
+        :return: (サーバ名, 警告の種別, 最後に通知した時刻, [(メンバー, 続けて確認できなかった回数)]) のリスト
+        :rtype: list of tuple
+        """
+        return [(key[0], key[1], state.last_sent,
+                 [(member, state.misses.get(member, 0)) for member in sorted(state.members)])
+                for key, state in self.__states.items() if state.members or not state.hits]
+
+    def load_records(self, records):
+        """
+        保存した警告状態を復元する.
+        :param records: to_records() で変換した警告状態
+        :type records: list of tuple
+        :return: None
+        :rtype: None
+        """
+        self.__states = {}
+        for server_name, kind, last_sent, members in records:
+            self.__states[(server_name, kind)] = AlertState(
+                set(member for member, misses in members),
+                dict((member, misses) for member, misses in members if misses), last_sent)
@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import os
 import traceback
+from datetime import datetime
+from functools import partial
 
-import jsons
-import requests
 from discord import ChannelType, Client, Channel, Server, Message
-from datetime import datetime
 
 from awsdb import consts
+from awsdb.store import GuildConfig
+from awsdb.headless import HeadlessClient, HeadlessPipeline, HeadlessServer, NdjsonOutput
+from awsdb.lagmonitor import LoopLagMonitor
+from awsdb.peek import PeekService
 from awsdb.utils import ASWDConfig
 from awsdb.utils import Utils
+from awsdb.playerindex import PlayerIndex
+from awsdb.recorder import ReplayFetcher, archive_paths, replay
+from awsdb.watcher import WatchEngine, WatchSupervisor
 
 
 class Command:
@@ -145,6 +152,16 @@ class Command:
         """
         raise NotImplementedError('コマンドサブクラスでexecute_cmdを実装してください.')
 
+    def guild(self, message):
+        """
+        メッセージが書き込まれたギルドの設定を取得する.
+        :param message: Discordメッセージインスタンス
+        :type message: Message
+        :return: ギルド設定
+        :rtype: GuildConfig
+        """
+        return self.config.guild(message.server)
+
     async def send_message(self, channel, msg):
         """
         メッセージを送信する.
@@ -184,30 +201,45 @@ class CommandManager:
     __cmd_list: list
     __help_cmd: Command
 
-    def __init__(self, config):
+    def __init__(self, config, supervisor, lag_monitor, fetcher=None):
         """
         コンストラクタ.
         コマンドクラス追加時は __cmd_list にコマンドインスタンスを追加すること.
         :param config: コンフィグ管理インスタンス
         :type config: ASWDConfig
+        :param supervisor: 監視タスク管理インスタンス
+        :type supervisor: WatchSupervisor
+        :param lag_monitor: イベントループ遅延監視インスタンス
+        :type lag_monitor: LoopLagMonitor
+        :param fetcher: /peek で使う取得インスタンス. 省略時は Atlas API から取得する.
+        :type fetcher: AtlasFetcher
         """
 
         self.__config = config
         self.__cmd_list = [
-            StartCommand(config),
-            StopCommand(config),
+            StartCommand(config, supervisor),
+            StopCommand(config, supervisor),
             AddEnemyCommand(config),
             DelEnemyCommand(config),
             ListEnemyCommand(config),
             AddBlackListCommand(config),
             DelBlackListCommand(config),
             ListBlackListCommand(config),
+            ImportBlackListCommand(config),
+            ExportBlackListCommand(config),
             AddServerCommand(config),
             DelServerCommand(config),
             StatusCommand(config),
             SetWatchWorldCommand(config),
             SetWatchIntervalCommand(config),
             SetPlayerSbnCountCommand(config),
+            SetCompanyAlertCountCommand(config),
+            WhereIsCommand(config, supervisor.engine.player_index),
+            MapCommand(config, supervisor.engine),
+            PeekCommand(config, PeekService(supervisor.engine, fetcher)),
+            HealthCommand(config, lag_monitor),
+            ProfileCommand(config, supervisor),
+            ReplayCommand(config, supervisor),
             FuckYeahCommand(config)
         ]
         self.__help_cmd = HelpCommand(config, self.__cmd_list)
@@ -260,12 +292,14 @@ class HelpCommand(AllCommand):
         return msg
 
     async def execute_cmd(self, message, args):
-        ret = []
-        ret.append(self.usage() + "\n")
-        for cmd in self.cmd_list:
-            ret.append(cmd.usage() + "\n")
-        msg = "\n".join(ret)
-        await self.send_message(message.channel, msg)
+        # コマンドが増えて1メッセージの上限を超えるため、コマンドの区切りで分割して送信する
+        chunks = [""]
+        for usage in [self.usage()] + [cmd.usage() for cmd in self.cmd_list]:
+            if chunks[-1] and consts.MESSAGE_MAX_LENGTH < len(chunks[-1]) + len(usage) + 2:
+                chunks.append("")
+            chunks[-1] += usage + "\n\n"
+        for msg in chunks:
+            await self.send_message(message.channel, msg)
         return True
 
 
@@ -274,8 +308,11 @@ class StartCommand(Command):
     サーバ監視開始コマンド.
     """
 
-    def __init__(self, config):
+    __supervisor: WatchSupervisor
+
+    def __init__(self, config, supervisor):
         super().__init__(config, "/start", False)
+        self.__supervisor = supervisor
 
     def usage(self):
         msg = "`/start`" \
@@ -285,153 +322,17 @@ class StartCommand(Command):
         return msg
 
     def valid_custom(self, message, args):
-        if self.config.is_watch_started:
+        if self.guild(message).is_watch_started:
             return "監視継続します."
 
     async def execute_cmd(self, message, args):
+        guild = self.guild(message)
+        guild.is_watch_started = True
+        guild.next_due = 0
+        await self.config.save_state_async()
+        self.__supervisor.start()
         msg = "監視開始."
         await self.send_message(message.channel, msg)
-
-        self.config.is_watch_started = True
-        self.config.last_servers_info = {}
-        self.config.enemy_notice_server_names.clear()
-        while self.config.is_watch_started:
-            try:
-                watch_server_names = Utils.get_watch_server_names(self.config.client)
-
-                # サーバ情報取得
-                try:
-                    print('ClusterServer情報取得開始.')
-                    cluster_servers_info_json = requests.get(
-                        consts.URL_CLUSTER_SERVER.format(self.config.watch_world)).text
-                    print("ClusterServer情報取得完了.")
-                    if not cluster_servers_info_json:
-                        msg = '【エラー】サーバ情報jsonが空. 再度実行.'
-                        print(msg)
-                        await self.send_message(message.channel, msg)
-                        await asyncio.sleep(self.config.watch_interval)
-                        continue
-                except Exception as e:
-                    with open(consts.LOG_FILE, 'a') as f:
-                        traceback.print_exc(file=f)
-                    msg = '【エラー】サーバ情報取得失敗. サーバダウンかも. 再度実行.'
-                    print(msg)
-                    await self.send_message(message.channel, msg)
-                    await asyncio.sleep(self.config.watch_interval)
-                    continue
-                print("ClusterServer情報取得成功.")
-
-                # サーバ情報を監視サーバ毎に格納
-                cluster_servers_info_dict = jsons.loads(cluster_servers_info_json)
-                servers_info = {}
-
-                for server_name in watch_server_names:
-                    server_id = Utils.get_server_id(self.config.watch_world, server_name)
-                    cluster_server_info = Utils.get_object("id", server_id, cluster_servers_info_dict)
-                    if not cluster_server_info:
-                        continue
-                    player_count = cluster_server_info["player_count"]
-
-                    # 監視サーバ毎プレイヤー情報取得
-                    try:
-                        print('ServerPlayer情報取得開始.')
-                        server_player_info_json = requests.get(
-                            consts.URL_SERVER_PLAYER.format(server_id)).text
-                        print("ServerPlayer情報取得完了.")
-                        if not server_player_info_json:
-                            msg = '【エラー】プレイヤー情報jsonが空. 再度実行.'
-                            print(msg)
-                            await self.send_message(message.channel, msg)
-                            await asyncio.sleep(self.config.watch_interval)
-                            continue
-                    except Exception as e:
-                        with open(consts.LOG_FILE, 'a') as f:
-                            traceback.print_exc(file=f)
-                        msg = '【エラー】プレイヤー情報取得失敗. サーバダウンかも. 再度実行.'
-                        print(msg)
-                        await self.send_message(message.channel, msg)
-                        await asyncio.sleep(self.config.watch_interval)
-                        continue
-                    print("ServerPlayer情報取得成功.")
-
-                    players = jsons.loads(server_player_info_json)
-                    player_sbn_count = 0
-                    last_server_info = None
-                    if len(self.config.last_servers_info) != 0 and server_name in self.config.last_servers_info:
-                        last_server_info = self.config.last_servers_info[server_name]
-                    if last_server_info is not None:
-                        last_player_count = last_server_info["player_count"]
-                        player_sbn_count = player_count - last_player_count if last_player_count is not None and 0 < last_player_count else -1
-                    enemy_players = []
-                    if not players or "data" in players:
-                        print("【WARN 】プレイヤー情報なし.")
-                    else:
-                        for enemy in self.config.enemy_list:
-                            for player in players:
-                                player_name = str(player["name"])
-                                if not player_name or player_name.upper().find(enemy.upper()) == -1:
-                                    continue
-                                enemy_players.append("{}({})".format(player["name"], self.config.enemy_list[enemy]))
-
-                    servers_info[server_name] = {
-                        "server_name": server_name,
-                        'player_count': player_count,
-                        "player_sbn_count": player_sbn_count,
-                        "enemy_players": enemy_players
-                    }
-
-                # サーバ情報を元に通知
-                timestr = datetime.now().strftime("%m/%d %H:%M")
-                tgt_channels = Utils.get_channels(self.config.client)
-                print("get_channels end. tgt_channels.len=", len(tgt_channels) > 0)
-                if len(tgt_channels) > 0:
-                    for tgt_channel in tgt_channels:
-                        if tgt_channel.name.upper() not in servers_info:
-                            msg = "{}　{}　データ取得エラー.".format(timestr, tgt_channel.name.upper())
-                            await self.send_message(tgt_channel, msg)
-                            continue
-                        server_info = servers_info[tgt_channel.name.upper()]
-                        if server_info is None:
-                            continue
-
-                        server_name = server_info["server_name"]
-                        player_count = server_info["player_count"]
-                        player_sbn_count = server_info["player_sbn_count"]
-                        enemy_players = server_info["enemy_players"]
-
-                        # 定例メッセージ送信
-                        msg = "{}　{}　人数:{}　敵:{}人 {}".format(timestr, server_name, player_count, len(enemy_players),
-                                                            enemy_players)
-                        await self.send_message(tgt_channel, msg)
-
-                        # 警告メッセージ(人数急増)
-                        if self.config.player_sbn_count <= player_sbn_count:
-                            msg = "@everyone サーバが {}人増えて {}人に急増. 敵襲か？".format(player_sbn_count, player_count)
-                            await self.send_message(tgt_channel, msg)
-
-                        # 警告メッセージ(ブラックリスト対象の侵入)
-                        if len(enemy_players) > 0:
-                            if server_name not in self.config.enemy_notice_server_names:
-                                msg = "@everyone ブラックリストの {} がやってきたぞ.".format(', '.join(enemy_players))
-                                await self.send_message(tgt_channel, msg)
-                                self.config.enemy_notice_server_names.append(server_name)
-
-                        # 通常メッセージ(ブラックリスト対象者0になった)
-                        if len(enemy_players) == 0 and server_name in self.config.enemy_notice_server_names:
-                            msg = "ブラックリストのやつらはどこかへ行ったようだ."
-                            await self.send_message(tgt_channel, msg)
-                            self.config.enemy_notice_server_names.remove(server_name)
-
-                # 今回取得したサーバ情報を保持
-                self.config.last_servers_info = servers_info
-            except Exception as e:
-                with open(consts.LOG_FILE, 'a') as f:
-                    traceback.print_exc(file=f)
-                msg = '【エラー】処理続行. 複数回発生したら/stopして.'
-                print(msg)
-                await self.send_message(message.channel, msg)
-
-            await asyncio.sleep(self.config.watch_interval)
         return True
 
 
@@ -440,8 +341,11 @@ class StopCommand(Command):
     サーバ監視終了コマンド.
     """
 
-    def __init__(self, config):
+    __supervisor: WatchSupervisor
+
+    def __init__(self, config, supervisor):
         super().__init__(config, "/stop", False)
+        self.__supervisor = supervisor
 
     def usage(self):
         msg = "`/stop`" \
@@ -449,7 +353,12 @@ class StopCommand(Command):
         return msg
 
     async def execute_cmd(self, message, args):
-        self.config.is_watch_started = False
+        guild = self.guild(message)
+        guild.is_watch_started = False
+        guild.clear_state()
+        if not self.config.is_watch_started:
+            await self.__supervisor.stop()
+        await self.config.save_state_async()
         await self.send_message(message.channel, "監視終了.")
         return True
 
@@ -479,7 +388,7 @@ class AddEnemyCommand(Command):
         arg_list = self.split_args(args)
         pname = arg_list[0] if len(arg_list) >= 1 else ""
         cname = arg_list[1] if len(arg_list) >= 2 else ""
-        self.config.add_enemy(pname, cname)
+        self.guild(message).add_enemy(pname, cname)
         msg = "敵プレイヤーに追加しました."
         await self.send_message(message.channel, msg)
         return True
@@ -546,11 +455,14 @@ class DelEnemyCommand(Command):
     def valid_custom(self, message, args):
         if not args:
             return "プレイヤー名を正しく入力してください."
-        if args not in self.config.enemy_list:
+        guild = self.guild(message)
+        if args not in guild.enemy_list:
+            if args in guild.shared_enemy_list:
+                return "共通の敵プレイヤーは settings.ini で編集してください."
             return "敵プレイヤーは存在しません."
 
     async def execute_cmd(self, message, args):
-        self.config.del_enemy(args)
+        self.guild(message).del_enemy(args)
         msg = "敵プレイヤーを削除しました."
         await self.send_message(message.channel, msg)
         return True
@@ -586,7 +498,9 @@ class ListEnemyCommand(Command):
         return msg
 
     async def execute_cmd(self, message, args):
-        msg = "敵プレイヤー: {}".format(self.config.list_enemy())
+        guild = self.guild(message)
+        msg = "敵プレイヤー({}人):\n{}".format(len(guild.enemies), guild.list_enemy())
+        msg = Utils.truncate(msg, suffix="...\n(全件は /export bl で出力してください)")
         await self.send_message(message.channel, msg)
         return True
 
@@ -606,6 +520,63 @@ class ListBlackListCommand(ListEnemyCommand):
         return msg
 
 
+class ImportBlackListCommand(Command):
+    """
+    敵プレイヤー一括登録コマンド.
+    """
+
+    def __init__(self, config):
+        super().__init__(config, "/import bl", False)
+
+    def usage(self):
+        msg = "`/import bl` + 添付ファイル" \
+              "\n添付したCSV/テキストファイルの敵プレイヤーを一括で追加します." \
+              "\n1行に1人、`プレイヤー名,カンパニー名` の形式で記載してください.(カンパニー名は省略可能)" \
+              "\n既に登録済みのプレイヤー名はカンパニー名を上書きします."
+        return msg
+
+    def valid_custom(self, message, args):
+        if not message.attachments:
+            return "敵プレイヤーを記載したファイルを添付してください."
+
+    async def execute_cmd(self, message, args):
+        try:
+            text = await Utils.download_text(message.attachments[0]["url"])
+            entries = Utils.parse_enemy_csv(text)
+        except Exception as e:
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            await self.send_message(message.channel, "【エラー】添付ファイルを読み込めませんでした.")
+            return False
+        count = await self.config.guilds.import_enemies(self.guild(message), entries)
+        msg = "敵プレイヤーを{}人追加しました.(ファイル内 {}行)".format(count, len(entries))
+        await self.send_message(message.channel, msg)
+        return True
+
+
+class ExportBlackListCommand(Command):
+    """
+    敵プレイヤー一括出力コマンド.
+    """
+
+    def __init__(self, config):
+        super().__init__(config, "/export bl", False)
+
+    def usage(self):
+        msg = "`/export bl`" \
+              "\n敵プレイヤーをCSVファイルで出力します." \
+              "\n出力したファイルはそのまま /import bl で取り込めます." \
+              "\nsettings.ini の共通の敵プレイヤーは含みません."
+        return msg
+
+    async def execute_cmd(self, message, args):
+        enemy_list = self.guild(message).enemy_list
+        data = Utils.format_enemy_csv(enemy_list).encode('utf-8')
+        msg = "敵プレイヤー {}人.".format(len(enemy_list))
+        await Utils.send_file(self.config.client, message.channel, data, "blacklist.csv", msg)
+        return True
+
+
 class AddServerCommand(Command):
     """
     監視対象サーバ追加コマンド.
@@ -628,7 +599,7 @@ class AddServerCommand(Command):
 
     async def execute_cmd(self, message, args):
         print("サーバ監視報告チャンネル作成. name={}".format(args.upper()))
-        await self.config.client.create_channel(message.server, args.upper(), type=ChannelType.text)
+        await Utils.create_channel(self.config.client, message.server, args.upper())
         print("サーバ監視報告チャンネル作成完了.")
         msg = "{}チャンネル追加. 監視情報はそこに出力します.".format(args.upper())
         await self.send_message(message.channel, msg)
@@ -679,18 +650,18 @@ class StatusCommand(Command):
         return msg
 
     async def execute_cmd(self, message, args):
-        msg_started = "監視中" if self.config.is_watch_started else "監視していません"
-        msg = "監視状態:{}\n監視ワールド:{} {}\n監視間隔(秒):{}\n通知対象プレイヤー増加数:{}\n敵プレイヤー:{}\n敵侵入中サーバ:{}".format(msg_started,
-                                                                                                 self.config.watch_world,
-                                                                                                 Utils.get_value(
-                                                                                                     "id",
-                                                                                                     self.config.watch_world,
-                                                                                                     "name",
-                                                                                                     consts.CLUSTERS),
-                                                                                                 self.config.watch_interval,
-                                                                                                 self.config.player_sbn_count,
-                                                                                                 self.config.list_enemy(),
-                                                                                                 self.config.enemy_notice_server_names)
+        guild = self.guild(message)
+        msg_started = "監視中" if guild.is_watch_started else "監視していません"
+        msg = "監視状態:{}\n監視ワールド:{} {}\n監視間隔(秒):{}\n通知対象プレイヤー増加数:{}\n通知対象カンパニー集結人数:{}\n敵侵入中サーバ:{}\n敵プレイヤー:\n{}".format(
+            msg_started,
+            guild.watch_world,
+            Utils.get_value("id", guild.watch_world, "name", consts.CLUSTERS),
+            guild.watch_interval,
+            guild.player_sbn_count,
+            guild.company_alert_count if 0 < guild.company_alert_count else "通知しない",
+            guild.enemy_notice_server_names,
+            guild.list_enemy())
+        msg = Utils.truncate(msg)
         await self.send_message(message.channel, msg)
         return True
 
@@ -719,7 +690,9 @@ class SetWatchWorldCommand(Command):
 
     async def execute_cmd(self, message, args):
         int_val = int(args)
-        self.config.watch_world = int_val
+        guild = self.guild(message)
+        guild.watch_world = int_val
+        guild.clear_state()
         msg = "監視ワールドを {} に設定しました.".format(Utils.get_value("id", int_val, "name", consts.CLUSTERS))
         await self.send_message(message.channel, msg)
         return True
@@ -749,7 +722,7 @@ class SetWatchIntervalCommand(Command):
             msg = "指定した数値が30秒未満のため、30秒を設定します."
             await self.send_message(message.channel, msg)
             int_val = 30
-        self.config.watch_interval = int_val
+        self.guild(message).watch_interval = int_val
 
         msg = "監視間隔を{}秒に設定しました.".format(int_val)
         await self.send_message(message.channel, msg)
@@ -780,13 +753,407 @@ class SetPlayerSbnCountCommand(Command):
             msg = "指定した数値が3人未満のため、3人を設定します."
             await self.send_message(message.channel, msg)
             int_val = 3
-        self.config.player_sbn_count = int_val
+        self.guild(message).player_sbn_count = int_val
 
         msg = "通知対象プレイヤー増加数を{}人に設定しました.".format(int_val)
         await self.send_message(message.channel, msg)
         return True
 
 
+class SetCompanyAlertCountCommand(Command):
+    """
+    通知対象カンパニー集結人数設定コマンド.
+    """
+
+    def __init__(self, config):
+        super().__init__(config, "/set company_count", True)
+
+    def usage(self):
+        msg = "`/set company_count [人数]`" \
+              "\n同じカンパニーの敵プレイヤーが集結した場合に通知を行う際の閾値を設定します." \
+              "\n1つのサーバに同じカンパニーの敵プレイヤーがこの設定値以上いる場合にサーバ監視報告チャンネルに通知します." \
+              "\n0を設定すると通知しません."
+        return msg
+
+    def valid_custom(self, message, args):
+        if not args or not args.isdecimal():
+            return "カンパニー集結人数を数値で設定してください."
+
+    async def execute_cmd(self, message, args):
+        int_val = int(args)
+        if 0 < int_val < 2:
+            msg = "指定した数値が2人未満のため、2人を設定します."
+            await self.send_message(message.channel, msg)
+            int_val = 2
+        self.guild(message).company_alert_count = int_val
+
+        if int_val == 0:
+            msg = "カンパニー集結の通知を行わないように設定しました."
+        else:
+            msg = "通知対象カンパニー集結人数を{}人に設定しました.".format(int_val)
+        await self.send_message(message.channel, msg)
+        return True
+
+
+class WhereIsCommand(Command):
+    """
+    プレイヤー所在検索コマンド.
+    """
+
+    __player_index: PlayerIndex
+
+    def __init__(self, config, player_index):
+        super().__init__(config, "/whereis", True)
+        self.__player_index = player_index
+
+    def usage(self):
+        msg = "`/whereis [プレイヤー名]`" \
+              "\n監視ワールドでプレイヤーを最後に確認したサーバを表示します." \
+              "\nプレイヤー名は大文字小文字を区別せず部分一致で検索します." \
+              "\n監視で取得したプレイヤー情報から検索するため、監視していないサーバのプレイヤーは表示されません."
+        return msg
+
+    def valid_custom(self, message, args):
+        if not args:
+            return "プレイヤー名を設定してください."
+
+    async def execute_cmd(self, message, args):
+        guild = self.guild(message)
+        results = self.__player_index.search(args, guild.watch_world)
+        if not results:
+            msg = "{} は見つかりませんでした.".format(args)
+            await self.send_message(message.channel, msg)
+            return True
+
+        ret = ["{} の検索結果({}件):".format(args, len(results))]
+        for name, server_name, seen_at, is_present in results:
+            if is_present:
+                ret.append("{}　{}　(現在)".format(name, server_name))
+            else:
+                ret.append("{}　{}　(最終確認 {})".format(
+                    name, server_name, datetime.fromtimestamp(seen_at).strftime("%m/%d %H:%M")))
+        msg = Utils.truncate("\n".join(ret))
+        await self.send_message(message.channel, msg)
+        return True
+
+
+class MapCommand(Command):
+    """
+    クラスター人数ヒートマップ表示コマンド.
+    画像作成に使う Pillow は読み込みに時間がかかるため、起動時ではなく初回の実行時に読み込む.
+    """
+
+    __engine: WatchEngine
+
+    def __init__(self, config, engine):
+        super().__init__(config, "/map", False)
+        self.__engine = engine
+        self.__renderer = None
+
+    def usage(self):
+        msg = "`/map`" \
+              "\n監視ワールドの全サーバの人数をヒートマップ画像で表示します." \
+              "\n青枠は監視サーバ、赤枠はブラックリストの敵プレイヤーがいるサーバです." \
+              "\n直近の監視で取得した情報を使うため、監視中のみ表示できます."
+        return msg
+
+    async def execute_cmd(self, message, args):
+        guild = self.guild(message)
+        cluster_grid = self.__engine.cluster_grid(guild.watch_world)
+        if cluster_grid.generation == 0:
+            msg = "サーバ情報を取得していません. 監視開始後に実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+
+        watched_server_names = [channel.name.upper() for channel in message.server.channels
+                                if channel and ChannelType.text == channel.type
+                                and Utils.exists_server_name(channel.name.upper())]
+        if self.__renderer is None:
+            from awsdb.heatmap import HeatmapRenderer
+            self.__renderer = HeatmapRenderer()
+        data = await self.__renderer.render_async(cluster_grid, watched_server_names,
+                                                  guild.enemy_notice_server_names)
+        msg = "{} 人数ヒートマップ".format(Utils.get_value("id", guild.watch_world, "name", consts.CLUSTERS))
+        await Utils.send_file(self.config.client, message.channel, data, "map.png", msg)
+        return True
+
+
+class PeekCommand(Command):
+    """
+    サーバ状況確認コマンド.
+    """
+
+    __peek_service: PeekService
+
+    def __init__(self, config, peek_service):
+        super().__init__(config, "/peek", True)
+        self.__peek_service = peek_service
+
+    def usage(self):
+        msg = "`/peek [サーバ名(A1-O15)]`" \
+              "\n監視ワールドのサーバの人数、プレイヤー数、ブラックリストの敵プレイヤーをすぐに表示します." \
+              "\n監視報告チャンネルのないサーバも表示できます." \
+              "\n直近{}秒以内の監視情報があればそれを使い、なければAPIから取得します.".format(consts.PEEK_FRESH_AGE)
+        return msg
+
+    def valid_custom(self, message, args):
+        if not Utils.exists_server_name(args.upper()):
+            return "サーバ名はA1-O15の値を設定してください."
+
+    async def execute_cmd(self, message, args):
+        guild = self.guild(message)
+        server_name = args.upper()
+        try:
+            result = await self.__peek_service.peek(guild, server_name)
+        except Exception as e:
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            msg = "{} の情報取得失敗. サーバダウンかも.".format(server_name)
+            await self.send_message(message.channel, msg)
+            return True
+
+        ret = ["{} {}".format(Utils.get_value("id", guild.watch_world, "name", consts.CLUSTERS), server_name)]
+        if result["player_count"] is None:
+            ret.append("人数: 取得できませんでした")
+        else:
+            ret.append("人数: {}人".format(result["player_count"]))
+            if result["roster_size"] < 0:
+                ret.append("プレイヤー情報: 取得できませんでした")
+            else:
+                ret.append("プレイヤー情報: {}人".format(result["roster_size"]))
+                ret.append("敵プレイヤー: {}".format(
+                    ", ".join(result["enemy_players"]) if result["enemy_players"] else "なし"))
+        if result["age"] is None:
+            ret.append("(APIから取得)")
+        else:
+            ret.append("(監視情報 {:.0f}秒前)".format(result["age"]))
+        msg = Utils.truncate("\n".join(ret))
+        await self.send_message(message.channel, msg)
+        return True
+
+
+class HealthCommand(Command):
+    """
+    Bot稼働状態表示コマンド.
+    """
+
+    __lag_monitor: LoopLagMonitor
+
+    def __init__(self, config, lag_monitor):
+        super().__init__(config, "/health", False)
+        self.__lag_monitor = lag_monitor
+
+    def usage(self):
+        msg = "`/health`" \
+              "\nイベントループの遅延(処理の詰まり具合)を表示します." \
+              "\n遅延が大きいとDiscordとの接続が切れることがあります. 停止時の処理内容は {} に記録します.".format(
+                  consts.LAG_LOG_FILE)
+        return msg
+
+    async def execute_cmd(self, message, args):
+        monitor = self.__lag_monitor
+        percentiles = monitor.percentiles()
+        if not percentiles:
+            msg = "イベントループ遅延を計測していません. しばらく待ってから実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+
+        msg = "イベントループ遅延(直近{}回)\np50:{:.1f}ms　p90:{:.1f}ms　p99:{:.1f}ms　最大:{:.1f}ms" \
+              "\n{}ms以上の停止:{}回".format(
+                  monitor.sample_count,
+                  percentiles[50] * 1000, percentiles[90] * 1000, percentiles[99] * 1000, monitor.max_lag * 1000,
+                  self.config.lag_threshold_ms, monitor.stall_count)
+        await self.send_message(message.channel, msg)
+        return True
+
+
+class ProfileCommand(Command):
+    """
+    監視処理プロファイル取得コマンド.
+    """
+
+    __supervisor: WatchSupervisor
+
+    def __init__(self, config, supervisor):
+        super().__init__(config, "/profile", True)
+        self.__supervisor = supervisor
+
+    def usage(self):
+        msg = "`/profile [回数(1-{})]`" \
+              "\n次の監視処理から指定回数分の処理時間を計測し、時間のかかった処理の上位{}件を表示します." \
+              "\n計測結果は {} フォルダに pstats 形式で出力します.".format(
+                  consts.PROFILE_MAX_TICKS, consts.PROFILE_TOP_COUNT, consts.LOG_FOLDER)
+        return msg
+
+    def valid_custom(self, message, args):
+        if not args or not args.isdecimal() or not 1 <= int(args) <= consts.PROFILE_MAX_TICKS:
+            return "回数に1～{}の数値を設定してください.".format(consts.PROFILE_MAX_TICKS)
+
+    async def execute_cmd(self, message, args):
+        if not self.__supervisor.is_running:
+            msg = "監視していないため計測できません. 監視開始後に実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+        profiler = self.__supervisor.profile(int(args))
+        if profiler is None:
+            msg = "計測中です. 完了後に実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+
+        msg = "次の監視処理から{}回分の処理時間を計測します.".format(profiler.ticks)
+        await self.send_message(message.channel, msg)
+        # 計測完了まで数回分の監視間隔がかかるため、コマンド処理は待たずに完了時に結果を送信する
+        self.config.client.loop.create_task(self.__report(message.channel, profiler))
+        return True
+
+    async def __report(self, channel, profiler):
+        """
+        計測完了を待って結果を送信する.
+        :param channel: 結果を送信するチャンネル
+        :type channel: Channel
+        :param profiler: プロファイル取得インスタンス
+        :type profiler: TickProfiler
+        :return: None
+        :rtype: None
+        """
+        try:
+            path, summary = await profiler.wait()
+        except asyncio.CancelledError:
+            await self.send_message(channel, "監視が停止したため計測を中止しました.")
+            return
+        except Exception as e:
+            print("【エラー】プロファイル出力失敗.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            await self.send_message(channel, "【エラー】計測結果の出力に失敗しました.")
+            return
+        msg = Utils.truncate("計測完了. {}\n```\n{}\n```".format(path, summary), suffix="...\n```")
+        await self.send_message(channel, msg)
+
+
+class ReplayCommand(Command):
+    """
+    Atlas API 記録再生コマンド.
+    """
+
+    __supervisor: WatchSupervisor
+
+    def __init__(self, config, supervisor):
+        super().__init__(config, "/replay", True)
+        self.__supervisor = supervisor
+        self.__task = None
+
+    def usage(self):
+        msg = "`/replay [ファイル名 または all] [倍速]`" \
+              "\n記録した Atlas API のレスポンス({} フォルダ)を再生し、監視と同じ判定を行います." \
+              "\n監視報告チャンネルには送信せず、完了時に警告の一覧をこのチャンネルに送信します(判定結果は log フォルダに NDJSON で保存)." \
+              "\nAPIにはアクセスしません. 誤検知の再現等に使います. 倍速は省略時 {} 倍です." \
+              "\n監視中は再生できません. 記録は settings.ini の record = True で行います.".format(
+                  consts.RECORD_FOLDER, consts.REPLAY_SPEED)
+        return msg
+
+    def valid_custom(self, message, args):
+        values = args.split()
+        if len(values) > 2:
+            return "引数が多すぎます."
+        if len(values) == 2:
+            try:
+                if float(values[1]) <= 0:
+                    return "倍速に0より大きい数値を設定してください."
+            except ValueError:
+                return "倍速に数値を設定してください."
+
+    async def execute_cmd(self, message, args):
+        guild = self.guild(message)
+        if guild.is_watch_started:
+            msg = "監視中のため再生できません. /stop 後に実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+        if self.__task is not None and not self.__task.done():
+            msg = "再生中です. 完了後に実行してください."
+            await self.send_message(message.channel, msg)
+            return True
+
+        values = args.split()
+        paths = archive_paths()
+        if values[0].lower() != "all":
+            paths = [path for path in paths if os.path.basename(path) == os.path.basename(values[0])]
+        if not paths:
+            msg = "記録ファイルがありません. 記録ファイル:\n{}".format(
+                "\n".join(os.path.basename(path) for path in archive_paths()) or "なし")
+            await self.send_message(message.channel, Utils.truncate(msg))
+            return True
+        speed = float(values[1]) if len(values) == 2 else consts.REPLAY_SPEED
+
+        msg = "記録ファイル{}件を{}倍速で再生します.".format(len(paths), speed)
+        await self.send_message(message.channel, msg)
+        server_names = [channel.name.upper() for channel in message.server.channels
+                        if channel and ChannelType.text == channel.type
+                        and Utils.exists_server_name(channel.name.upper())]
+        self.__task = self.config.client.loop.create_task(
+            self.__replay(message.channel, guild, server_names, paths, speed))
+        return True
+
+    async def __replay(self, channel, guild, server_names, paths, speed):
+        """
+        再生用の監視エンジンで記録を再生し、結果をまとめてコマンドチャンネルに送信する.
+        再生はギルドの設定を写した再生用のギルドで行い、監視状態や監視報告チャンネル、ステータスメッセージには触れない.
+        判定結果と警告は HeadlessPipeline で log フォルダの NDJSON ファイルに上限サイズまで出力し、
+        完了時に警告の件数と先頭の数件だけを1回送信する.
+        :param channel: 結果を送信するチャンネル
+        :type channel: Channel
+        :param guild: 対象ギルドの設定
+        :type guild: GuildConfig
+        :param server_names: 監視サーバ名のリスト
+        :type server_names: list of str
+        :param paths: 記録ファイルのパスのリスト
+        :type paths: list of str
+        :param speed: 再生速度(倍速)
+        :type speed: float
+        :return: None
+        :rtype: None
+        """
+        try:
+            server = HeadlessServer(server_names, guild_id="replay-{}".format(guild.guild_id))
+            config = ASWDConfig(HeadlessClient([server]), guild_db_path=":memory:", load_state=False)
+            replay_guild = config.guild(server)
+            replay_guild.watch_world = guild.watch_world
+            replay_guild.watch_interval = guild.watch_interval
+            replay_guild.player_sbn_count = guild.player_sbn_count
+            replay_guild.company_alert_count = guild.company_alert_count
+            for name, company in guild.enemy_list.items():
+                replay_guild.add_enemy(name, company)
+
+            os.makedirs(consts.LOG_FOLDER, exist_ok=True)
+            path = consts.REPLAY_OUTPUT_FILE.format(guild.guild_id)
+            with open(path, "w", encoding="utf-8") as stream:
+                output = NdjsonOutput(stream, max_bytes=consts.REPLAY_OUTPUT_MAX_MB * 1024 * 1024,
+                                      keep_alerts=consts.REPLAY_SUMMARY_ALERTS)
+                fetcher = ReplayFetcher(paths)
+                engine = WatchEngine(config, fetcher, match_service=self.__supervisor.engine.match_service,
+                                     pipeline_factory=partial(HeadlessPipeline, output=output))
+                count = await replay(engine, replay_guild, fetcher, speed,
+                                     on_frame=lambda index, started_at: setattr(output, "tick", index))
+            ret = ["再生完了. {}回分の監視を再生しました. 警告{}件.".format(count, output.alert_count)]
+            ret.extend(output.alerts)
+            if output.alert_count > len(output.alerts):
+                ret.append("ほか{}件".format(output.alert_count - len(output.alerts)))
+            ret.append("判定結果: {}{}".format(
+                path, "(上限{}MBで打ち切り)".format(consts.REPLAY_OUTPUT_MAX_MB) if output.truncated else ""))
+            msg = Utils.truncate("\n".join(ret))
+        except Exception as e:
+            print("【エラー】記録の再生失敗.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            msg = "【エラー】記録の再生に失敗しました."
+        try:
+            await self.send_message(channel, msg)
+        except Exception as e:
+            print("【エラー】記録の再生結果の送信失敗.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+
+
 class FuckYeahCommand(Command):
     """
     Fuck YEAH !!
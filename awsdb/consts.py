@@ -3,16 +3,93 @@ from typing import Dict, List, Union
 
 LOG_FOLDER = "log"
 LOG_FILE = LOG_FOLDER + "/error.log"
+LAG_LOG_FILE = LOG_FOLDER + "/loop_lag.log"
+RECORD_FOLDER = LOG_FOLDER + "/records"
 CMD_CHANNEL_NAME = "CMD_ASWDB"
 CONFIG_FILE_NAME = "settings.ini"
+SNAPSHOT_FILE_NAME = "watch_state.dat"
+SNAPSHOT_MAX_AGE_INTERVALS = 3
+GUILD_DB_FILE_NAME = "guilds.db"
+GUILD_FLUSH_INTERVAL = 10
+CONFIG_RELOAD_INTERVAL = 5
+COMPANY_ALERT_COUNT = 3
+PLAYER_INDEX_GRAM_SIZE = 3
+PLAYER_INDEX_TTL = 24 * 60 * 60
+PLAYER_INDEX_SEARCH_LIMIT = 10
+SWEEP_BUDGET = 20
+GRID_STATS_ALPHA = 0.1
+MOVEMENT_MIN_PLAYERS = 4
+ALERT_ENTER_TICKS = 2
+ALERT_EXIT_TICKS = 2
+ALERT_COOLDOWN = 10 * 60
+HEATMAP_CELL_SIZE = 40
+HEATMAP_MARGIN = 20
+HEATMAP_COLOR_STEPS = 32
+HEATMAP_TILE_CACHE_SIZE = 2048
+DASHBOARD_HEADER = "監視ダッシュボード　{}　サーバ:{}件　敵侵入中:{}件"
+DASHBOARD_ROW = "{}　人数:{}({})　敵:{}人"
+DASHBOARD_STALE_ROW = "{}　人数:{}(-)　敵:-　※未更新"
 SECTION_NAME = "Settings"
 KEY_WATCH_WORLD = "WATCH_WORLD"
 KEY_WATCH_INTERVAL = "WATCH_INTERVAL"
 KEY_PLAYER_SBN_COUNT = "SEND_MESSAGE_PLAYER_COUNT_SBN"
 KEY_ENEMY_LIST = "ENEMY_LIST"
+KEY_COMPANY_ALERT_COUNT = "COMPANY_ALERT_COUNT"
 KEY_TOKEN = "BOT_TOKEN"
+KEY_AUTO_START = "AUTO_START"
+KEY_MATCH_MODE = "MATCH_MODE"
+KEY_MATCH_WORKERS = "MATCH_WORKERS"
+KEY_SWEEP_ENABLED = "SWEEP_ENABLED"
+KEY_SWEEP_BUDGET = "SWEEP_BUDGET"
+KEY_LIVE_STATUS = "LIVE_STATUS"
+KEY_DASHBOARD = "DASHBOARD"
+KEY_LAG_THRESHOLD_MS = "LAG_THRESHOLD_MS"
+KEY_RECORD = "RECORD"
+KEY_RECORD_MAX_MB = "RECORD_MAX_MB"
+KEY_FEED_ADDRESS = "FEED_ADDRESS"
+# 起動時に作成したインスタンスで使うため、settings.ini を書き換えても再起動まで反映されない設定
+RESTART_REQUIRED_KEYS = [KEY_TOKEN, KEY_MATCH_MODE, KEY_MATCH_WORKERS, KEY_LAG_THRESHOLD_MS, KEY_RECORD,
+                         KEY_RECORD_MAX_MB, KEY_FEED_ADDRESS]
 URL_CLUSTER_SERVER = "https://atlas.hgn.hu/api/cluster/{}/servers"
 URL_SERVER_PLAYER = "https://atlas.hgn.hu/api/server/{}/players"
+API_TIMEOUT = 30
+IMPORT_MAX_BYTES = 8 * 1024 * 1024
+IMPORT_CHUNK_BYTES = 64 * 1024
+MESSAGE_MAX_LENGTH = 1900
+OUTBOUND_CONCURRENCY = 10
+OUTBOUND_RATE = 40
+LAG_THRESHOLD_MS = 250
+LAG_PROBE_INTERVAL = 0.5
+LAG_SAMPLE_SIZE = 1000
+PROFILE_MAX_TICKS = 10
+PROFILE_TOP_COUNT = 10
+RECORD_MAX_MB = 64
+RECORD_KEEP_FILES = 20
+REPLAY_SPEED = 60
+REPLAY_SUMMARY_ALERTS = 10
+REPLAY_OUTPUT_FILE = LOG_FOLDER + "/replay-{}.ndjson"
+REPLAY_OUTPUT_MAX_MB = 16
+FEED_LINE_LIMIT = 16 * 1024 * 1024
+FEED_WAIT_TIMEOUT = 30
+FEED_SEND_TIMEOUT = 10
+FEED_SUBSCRIPTION_TTL = 30 * 60
+FEED_ON_DEMAND_TTL = 10
+FEED_STALE_INTERVALS = 1.5
+FEED_RECONNECT_BACKOFF_MIN = 1
+FEED_RECONNECT_BACKOFF_MAX = 60
+PEEK_FRESH_AGE = 60
+PEEK_CACHE_TTL = 15
+MATCH_MODE_INLINE = "inline"
+MATCH_MODE_THREAD = "thread"
+MATCH_MODE_PROCESS = "process"
+MATCH_MODES = [MATCH_MODE_INLINE, MATCH_MODE_THREAD, MATCH_MODE_PROCESS]
+MATCH_WORKER_CACHE_SIZE = 64
+ENEMY_MATCHER_CACHE_SIZE = 64
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_DISPATCH_WORKERS = 10
+PIPELINE_STAGES = ["fetch", "decode", "detect", "render", "dispatch"]
+WATCH_RESTART_BACKOFF_MIN = 5
+WATCH_RESTART_BACKOFF_MAX = 300
 
 CLUSTERS: List[Dict[str, Union[int, str]]] = [
     {"id": 1, "name": "NA - PvE"},
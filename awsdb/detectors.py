@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from awsdb.alerts import ALERT_APPROACH, ALERT_COMPANY, ALERT_ENEMY, ALERT_MOVEMENT, ALERT_SURGE
+from awsdb.utils import Utils
+
+
+class DetectContext:
+    """
+    1つのギルドの1つの監視サーバについて、警告判定に使う今回の監視結果.
+    """
+
+    __slots__ = ("guild", "server_name", "server_info", "surge", "arrival", "approaches", "now")
+
+    def __init__(self, guild, server_name, server_info, surge, arrival, approaches, now):
+        """
+        コンストラクタ.
+        :param guild: ギルド設定
+        :type guild: awsdb.store.GuildConfig
+        :param server_name: サーバ名
+        :type server_name: str
+        :param server_info: 今回のサーバ情報
+        :type server_info: dict
+        :param surge: 人数が通知人数以上増えたか
+        :type surge: bool
+        :param arrival: 隣接サーバからこのサーバへの移動. ない場合は None.
+        :type arrival: dict
+        :param approaches: 隣接サーバを経由してこのサーバへ向かっている移動のリスト
+        :type approaches: list of dict
+        :param now: 判定時刻(UNIX時間)
+        :type now: float
+        """
+        self.guild = guild
+        self.server_name = server_name
+        self.server_info = server_info
+        self.surge = surge
+        self.arrival = arrival
+        self.approaches = approaches
+        self.now = now
+
+
+class Detector:
+    """
+    警告判定クラス.
+    監視サーバ毎に呼び出され、ギルドの警告状態を更新して送信する警告メッセージを返す.
+    """
+    __name: str
+
+    @property
+    def name(self):
+        return self.__name
+
+    def __init__(self, name):
+        """
+        コンストラクタ.
+        :param name: 判定名. 登録済みの判定を置き換える時の識別子.
+        :type name: str
+        """
+        self.__name = name
+
+    def detect(self, context):
+        """
+        警告を判定する.
+        各判定で実装してください.
+        :param context: 今回の監視結果
+        :type context: DetectContext
+        :return: 送信する警告メッセージのリスト
+        :rtype: list of str
+        """
+        raise NotImplementedError('判定サブクラスでdetectを実装してください.')
+
+
+class SurgeDetector(Detector):
+    """
+    人数急増. 同じサーバへの再通知は一定時間空ける.
+    """
+
+    def __init__(self):
+        super().__init__(ALERT_SURGE)
+
+    def detect(self, context):
+        if not context.surge or not context.guild.alerts.pulse(context.server_name, ALERT_SURGE, context.now):
+            return []
+        return ["@everyone サーバが {}人増えて {}人に急増. 敵襲か？".format(
+            context.server_info["player_sbn_count"], context.server_info["player_count"])]
+
+
+class MovementDetector(Detector):
+    """
+    隣接サーバからの移動.
+    """
+
+    def __init__(self):
+        super().__init__(ALERT_MOVEMENT)
+
+    def detect(self, context):
+        movement = context.arrival
+        if not movement or not context.guild.alerts.pulse(context.server_name, ALERT_MOVEMENT, context.now):
+            return []
+        return ["@everyone {} から{}人が移動してきた. 進行方向:{}".format(
+            movement["from_server_name"], movement["players"], movement["heading"])]
+
+
+class ApproachDetector(Detector):
+    """
+    隣接サーバへの接近(このままだとこのサーバに来る移動).
+    """
+
+    def __init__(self):
+        super().__init__(ALERT_APPROACH)
+
+    def detect(self, context):
+        if not context.approaches or not context.guild.alerts.pulse(context.server_name, ALERT_APPROACH, context.now):
+            return []
+        return ["@everyone {} から {} へ{}人が移動中. 進行方向:{} このままだとこちらに来るぞ.".format(
+            movement["from_server_name"], movement["server_name"], movement["players"], movement["heading"])
+            for movement in context.approaches]
+
+
+class BlacklistDetector(Detector):
+    """
+    ブラックリスト対象の侵入と、対象者が全員いなくなったこと.
+    プレイヤー名毎に追跡し、新たに現れたプレイヤーのみ通知する(カンパニー名が変わっても別人として扱わない).
+    """
+
+    def __init__(self):
+        super().__init__(ALERT_ENEMY)
+
+    def detect(self, context):
+        alerts = context.guild.alerts
+        enemy_names = context.server_info["enemy_names"]
+        entered, exited, was_active = alerts.observe(context.server_name, ALERT_ENEMY, enemy_names, context.now)
+        if entered:
+            return [Utils.truncate("@everyone ブラックリストの {} {}やってきたぞ.".format(
+                ', '.join(enemy_names[player_name] for player_name in entered), "も" if was_active else "が"))]
+        if exited and not alerts.members(context.server_name, ALERT_ENEMY):
+            return ["ブラックリストのやつらはどこかへ行ったようだ."]
+        return []
+
+
+class CompanyDetector(Detector):
+    """
+    カンパニー集結と、集結が解けたこと.
+    """
+
+    def __init__(self):
+        super().__init__(ALERT_COMPANY)
+
+    def detect(self, context):
+        company_players = context.server_info["company_players"]
+        entered, exited, was_active = context.guild.alerts.observe(
+            context.server_name, ALERT_COMPANY, company_players, context.now)
+        ret = []
+        for company in entered:
+            ret.append(Utils.truncate("@everyone カンパニー {} のメンバーが{}人集結している. {}".format(
+                company, len(company_players[company]), ', '.join(company_players[company]))))
+        for company in exited:
+            ret.append("カンパニー {} は散っていったようだ.".format(company))
+        return ret
+
+
+class DetectorRegistry:
+    """
+    警告判定の登録先.
+    登録順に判定し、警告メッセージもその順に送信する.
+    """
+
+    def __init__(self, detectors=None):
+        """
+        コンストラクタ.
+        :param detectors: 判定のリスト. 省略時は標準の判定(急増・移動・接近・ブラックリスト・カンパニー集結).
+        :type detectors: list of Detector
+        """
+        if detectors is None:
+            detectors = [SurgeDetector(), MovementDetector(), ApproachDetector(), BlacklistDetector(),
+                         CompanyDetector()]
+        self.__detectors = list(detectors)
+
+    def __iter__(self):
+        return iter(self.__detectors)
+
+    def __len__(self):
+        return len(self.__detectors)
+
+    @property
+    def names(self):
+        return [detector.name for detector in self.__detectors]
+
+    def register(self, detector):
+        """
+        判定を登録する. 同じ判定名の判定がある場合は置き換える.
+        :param detector: 判定
+        :type detector: Detector
+        :return: None
+        :rtype: None
+        """
+        for i, registered in enumerate(self.__detectors):
+            if registered.name == detector.name:
+                self.__detectors[i] = detector
+                return
+        self.__detectors.append(detector)
+
+    def unregister(self, name):
+        """
+        判定を登録解除する.
+        :param name: 判定名
+        :type name: str
+        :return: 処理結果(True: 解除, False: 登録されていない)
+        :rtype: bool
+        """
+        for i, registered in enumerate(self.__detectors):
+            if registered.name == name:
+                del self.__detectors[i]
+                return True
+        return False
+
+    def detect(self, context):
+        """
+        登録されている全ての判定を行う.
+        :param context: 今回の監視結果
+        :type context: DetectContext
+        :return: 送信する警告メッセージのリスト
+        :rtype: list of str
+        """
+        ret = []
+        for detector in self.__detectors:
+            ret.extend(detector.detect(context))
+        return ret
@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import sys
+import time
+import traceback
+
+from awsdb import consts
+from awsdb.fetcher import AtlasFetcher
+from awsdb.matcher import MatchService
+
+# 監視プロセス(FeedServer)と通知プロセス(FeedFetcher)の間は1行1メッセージのjson(NDJSON)でやり取りする.
+#   通知→監視: {"type": "subscribe", "clusters": [クラスターID], "servers": [サーバID]}
+#   監視→通知: {"type": "tick", "t": 取得時刻, "interval": 監視間隔(秒),
+#              "clusters": {クラスターID: [[サーバID, 人数]] or null},
+#              "servers": {サーバID: [プレイヤー数, [プレイヤー名]] or null}}
+#   null は取得失敗.
+MSG_SUBSCRIBE = "subscribe"
+MSG_TICK = "tick"
+_KIND_CLUSTERS = "clusters"
+_KIND_SERVERS = "servers"
+
+
+def _split_address(address):
+    """
+    接続先を分解する.
+    :param address: "ホスト:ポート" または "unix:ソケットのパス"
+    :type address: str
+    :return: (ホスト or ソケットのパス, ポート or None)
+    :rtype: tuple
+    """
+    if address.startswith("unix:"):
+        return address[len("unix:"):], None
+    host, port = address.rsplit(":", 1)
+    return host or "127.0.0.1", int(port)
+
+
+async def start_feed_server(handler, address):
+    """
+    接続を待ち受ける.
+    :param handler: 接続毎に呼び出すコルーチン関数. 引数は (StreamReader, StreamWriter).
+    :type handler: function
+    :param address: 待ち受けるアドレス
+    :type address: str
+    :return: サーバ
+    :rtype: asyncio.AbstractServer
+    """
+    host, port = _split_address(address)
+    if port is None:
+        if os.path.exists(host):
+            os.remove(host)
+        return await asyncio.start_unix_server(handler, path=host, limit=consts.FEED_LINE_LIMIT)
+    return await asyncio.start_server(handler, host, port, limit=consts.FEED_LINE_LIMIT)
+
+
+async def open_feed_connection(address):
+    """
+    監視プロセスに接続する.
+    :param address: 接続先のアドレス
+    :type address: str
+    :return: (StreamReader, StreamWriter)
+    :rtype: tuple
+    """
+    host, port = _split_address(address)
+    if port is None:
+        return await asyncio.open_unix_connection(path=host, limit=consts.FEED_LINE_LIMIT)
+    return await asyncio.open_connection(host, port, limit=consts.FEED_LINE_LIMIT)
+
+
+def _encode(msg):
+    return (json.dumps(msg, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class FeedServer:
+    """
+    監視プロセス(Discordに接続しない取得専用プロセス)のサーバ.
+    通知プロセスから購読された (クラスター, サーバ) を監視間隔毎に取得・デコードし、
+    人数とプレイヤー名だけにした結果を接続中の各通知プロセスへ、それぞれが購読している分だけ配信する.
+    新たに購読された分は次の監視を待たずにすぐ取得して配信する.
+    """
+
+    def __init__(self, address, interval, fetcher=None, match_service=None):
+        """
+        コンストラクタ.
+        :param address: 待ち受けるアドレス("ホスト:ポート" または "unix:ソケットのパス")
+        :type address: str
+        :param interval: 監視間隔(秒)
+        :type interval: float
+        :param fetcher: Atlas API 取得インスタンス. 省略時は新規作成.
+        :type fetcher: AtlasFetcher
+        :param match_service: プレイヤー情報のデコードを実行するインスタンス. 省略時は新規作成.
+        :type match_service: MatchService
+        """
+        self.__address = address
+        self.__interval = interval
+        self.__fetcher = fetcher if fetcher else AtlasFetcher()
+        self.__match_service = match_service if match_service else MatchService()
+        # 接続中の通知プロセス(StreamWriter): (購読クラスターIDの集合, 購読サーバIDの集合)
+        self.__subscribers = {}
+        # 今回の監視間隔で取得済みの (クラスターIDの集合, サーバIDの集合)
+        self.__fetched = (set(), set())
+        self.__wake = None
+
+    @property
+    def address(self):
+        return self.__address
+
+    @property
+    def subscriber_count(self):
+        return len(self.__subscribers)
+
+    def subscribed(self):
+        """
+        全通知プロセスの購読をまとめる.
+        :return: (クラスターIDの集合, サーバIDの集合)
+        :rtype: tuple
+        """
+        clusters = set()
+        servers = set()
+        for subscription in self.__subscribers.values():
+            clusters |= subscription[0]
+            servers |= subscription[1]
+        return clusters, servers
+
+    async def serve(self):
+        """
+        接続の待ち受けと監視を開始し、キャンセルされるまで続ける.
+        :return: None
+        :rtype: None
+        """
+        self.__wake = asyncio.Event()
+        server = await start_feed_server(self.__handle, self.__address)
+        print("監視プロセス起動. address={} interval={}秒".format(self.__address, self.__interval))
+        next_at = 0
+        try:
+            while True:
+                self.__wake.clear()
+                clusters, servers = self.subscribed()
+                if next_at <= time.monotonic():
+                    next_at = time.monotonic() + self.__interval
+                    self.__fetched = (clusters, servers)
+                    await self.publish(clusters, servers)
+                elif not (clusters <= self.__fetched[0] and servers <= self.__fetched[1]):
+                    pending = (clusters - self.__fetched[0], servers - self.__fetched[1])
+                    self.__fetched = (self.__fetched[0] | clusters, self.__fetched[1] | servers)
+                    await self.publish(*pending)
+                try:
+                    await asyncio.wait_for(self.__wake.wait(), max(0, next_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            server.close()
+            for writer in list(self.__subscribers):
+                writer.close()
+
+    async def publish(self, clusters, servers):
+        """
+        指定したクラスターとサーバの情報を取得し、購読している通知プロセスへ配信する.
+        :param clusters: クラスターIDの集合
+        :type clusters: set of int
+        :param servers: サーバIDの集合
+        :type servers: set of int
+        :return: 取得結果のメッセージ
+        :rtype: dict
+        """
+        msg = {"type": MSG_TICK, "t": time.time(), "interval": self.__interval, _KIND_CLUSTERS: {}, _KIND_SERVERS: {}}
+        for cluster_id in sorted(clusters):
+            msg[_KIND_CLUSTERS][cluster_id] = await self.fetch_cluster(cluster_id)
+        for server_id in sorted(servers):
+            msg[_KIND_SERVERS][server_id] = await self.fetch_roster(server_id)
+        if not msg[_KIND_CLUSTERS] and not msg[_KIND_SERVERS]:
+            return msg
+
+        # 購読内容が同じ通知プロセスには同じ行を送る
+        lines = {}
+        sends = []
+        for writer, subscription in list(self.__subscribers.items()):
+            key = (frozenset(subscription[0] & clusters), frozenset(subscription[1] & servers))
+            if not key[0] and not key[1]:
+                continue
+            if key not in lines:
+                lines[key] = _encode({
+                    "type": MSG_TICK, "t": msg["t"], "interval": self.__interval,
+                    _KIND_CLUSTERS: dict((cluster_id, msg[_KIND_CLUSTERS][cluster_id]) for cluster_id in key[0]),
+                    _KIND_SERVERS: dict((server_id, msg[_KIND_SERVERS][server_id]) for server_id in key[1])
+                })
+            sends.append(self.__send(writer, lines[key]))
+        await asyncio.gather(*sends)
+        return msg
+
+    async def fetch_cluster(self, cluster_id):
+        """
+        クラスター内の全サーバの人数を取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :return: [サーバID, 人数] のリスト. 取得できなかった場合は None.
+        :rtype: list of list
+        """
+        try:
+            cluster_servers_info = await self.__fetcher.fetch_cluster(cluster_id)
+        except Exception as e:
+            print("【WARN 】ClusterServer情報取得失敗. cluster_id={}".format(cluster_id))
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            return None
+        if not cluster_servers_info:
+            return None
+        return [[server["id"], server["player_count"]] for server in cluster_servers_info
+                if server and "id" in server and server.get("player_count") is not None]
+
+    async def fetch_roster(self, server_id):
+        """
+        サーバのプレイヤー名を取得する.
+        :param server_id: サーバID
+        :type server_id: int
+        :return: [プレイヤー数, プレイヤー名のリスト]. 取得できなかった場合は None.
+        :rtype: list
+        """
+        try:
+            players_json = await self.__fetcher.fetch_players_text(server_id)
+            if not players_json:
+                return None
+            grid = await self.__match_service.match(players_json, [])
+        except Exception as e:
+            print("【WARN 】ServerPlayer情報取得失敗. server_id={}".format(server_id))
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            return None
+        if grid["roster_size"] < 0:
+            return None
+        return [grid["roster_size"], list(grid["names"])]
+
+    async def __send(self, writer, line):
+        """
+        通知プロセスに1行送信する. 受信が追いつかない通知プロセスは切断する.
+        :param writer: 送信先
+        :type writer: asyncio.StreamWriter
+        :param line: 送信する行
+        :type line: bytes
+        :return: None
+        :rtype: None
+        """
+        try:
+            writer.write(line)
+            await asyncio.wait_for(writer.drain(), consts.FEED_SEND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            print("【WARN 】通知プロセスへの送信失敗のため切断. {}".format(repr(e)))
+            self.__subscribers.pop(writer, None)
+            writer.close()
+
+    async def __handle(self, reader, writer):
+        """
+        通知プロセスとの接続毎の処理. 購読メッセージを受け取る度に購読内容を置き換える.
+        :param reader: 受信ストリーム
+        :type reader: asyncio.StreamReader
+        :param writer: 送信ストリーム
+        :type writer: asyncio.StreamWriter
+        :return: None
+        :rtype: None
+        """
+        self.__subscribers[writer] = (set(), set())
+        print("通知プロセス接続. 接続数={}".format(self.subscriber_count))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line.decode("utf-8"))
+                if msg.get("type") != MSG_SUBSCRIBE or writer not in self.__subscribers:
+                    continue
+                self.__subscribers[writer] = (set(int(cluster_id) for cluster_id in msg.get(_KIND_CLUSTERS, [])),
+                                              set(int(server_id) for server_id in msg.get(_KIND_SERVERS, [])))
+                self.__wake.set()
+        except (ConnectionError, ValueError) as e:
+            print("【WARN 】通知プロセスからの受信失敗. {}".format(repr(e)))
+        finally:
+            self.__subscribers.pop(writer, None)
+            writer.close()
+            print("通知プロセス切断. 接続数={}".format(self.subscriber_count))
+
+
+class FeedFetcher:
+    """
+    監視プロセスから配信された取得結果を返す取得クラス(通知プロセス用).
+    AtlasFetcher と同じインタフェースで、通信の代わりに監視プロセスから受信した最新の取得結果を返す.
+    取得を要求された (クラスター, サーバ) を監視プロセスに購読し、まだ受信していない場合は配信を待つ.
+    一定時間要求されなくなった分は購読をやめる.
+    受信から監視プロセスの監視間隔の FEED_STALE_INTERVALS 倍以上経った取得結果は、監視プロセスが止まっているとみなして使わない.
+    プレイヤー情報は監視プロセスでデコード済みのため、fetch_roster でプレイヤー名をそのまま返す.
+    """
+
+    def __init__(self, address):
+        """
+        コンストラクタ.
+        :param address: 監視プロセスのアドレス("ホスト:ポート" または "unix:ソケットのパス")
+        :type address: str
+        """
+        self.__address = address
+        # 種別: {ID: (受信時刻(time.monotonic()), 受信した最新の取得結果(取得失敗は None))}
+        self.__latest = {_KIND_CLUSTERS: {}, _KIND_SERVERS: {}}
+        # (種別, ID): 購読の期限(time.monotonic())
+        self.__requested = {}
+        # 取得結果を使う受信からの経過秒数の上限. 監視プロセスの監視間隔を受信するまでは None.
+        self.__max_age = None
+        self.__subscription = None
+        self.__writer = None
+        self.__task = None
+        self.__attempted = None
+        self.__received = None
+
+    @property
+    def address(self):
+        return self.__address
+
+    @property
+    def is_connected(self):
+        return self.__writer is not None
+
+    def start(self):
+        """
+        監視プロセスへの接続タスクを起動する. 切断された場合は再接続し続ける.
+        :return: 処理結果(True: 起動, False: 既に起動済み)
+        :rtype: bool
+        """
+        if self.__task is not None and not self.__task.done():
+            return False
+        self.__attempted = asyncio.Event()
+        self.__received = asyncio.Event()
+        self.__task = asyncio.get_event_loop().create_task(self.__run())
+        return True
+
+    def stop(self):
+        """
+        監視プロセスとの接続を終了する.
+        :return: None
+        :rtype: None
+        """
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def __run(self):
+        """
+        接続タスク本体.
+        :return: None
+        :rtype: None
+        """
+        backoff = consts.FEED_RECONNECT_BACKOFF_MIN
+        while True:
+            try:
+                reader, writer = await open_feed_connection(self.__address)
+            except OSError as e:
+                print("【WARN 】監視プロセスに接続できません. {}秒後に再接続. address={}".format(backoff, self.__address))
+                self.__attempted.set()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, consts.FEED_RECONNECT_BACKOFF_MAX)
+                continue
+            print("監視プロセスに接続. address={}".format(self.__address))
+            backoff = consts.FEED_RECONNECT_BACKOFF_MIN
+            self.__writer = writer
+            self.__subscription = None
+            self.__attempted.set()
+            try:
+                self.__subscribe()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.__receive(json.loads(line.decode("utf-8")))
+            except (ConnectionError, ValueError) as e:
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+            finally:
+                self.__writer = None
+                writer.close()
+                # 切断中は古い取得結果を返さない
+                self.__latest = {_KIND_CLUSTERS: {}, _KIND_SERVERS: {}}
+            print("【WARN 】監視プロセスとの接続が切断. {}秒後に再接続.".format(backoff))
+            await asyncio.sleep(backoff)
+
+    def __receive(self, msg):
+        """
+        監視プロセスからの取得結果を反映し、配信待ちの取得を起こす.
+        :param msg: 受信したメッセージ
+        :type msg: dict
+        :return: None
+        :rtype: None
+        """
+        if msg.get("type") != MSG_TICK:
+            return
+        if msg.get("interval"):
+            self.__max_age = msg["interval"] * consts.FEED_STALE_INTERVALS
+        received_at = time.monotonic()
+        clusters = self.__latest[_KIND_CLUSTERS]
+        for cluster_id, servers in msg.get(_KIND_CLUSTERS, {}).items():
+            clusters[int(cluster_id)] = (received_at, None if servers is None else
+                                         [{"id": server_id, "player_count": player_count}
+                                          for server_id, player_count in servers])
+        rosters = self.__latest[_KIND_SERVERS]
+        for server_id, roster in msg.get(_KIND_SERVERS, {}).items():
+            rosters[int(server_id)] = (received_at, None if roster is None else
+                                       (roster[0], tuple(sys.intern(player_name) for player_name in roster[1])))
+        received = self.__received
+        self.__received = asyncio.Event()
+        received.set()
+
+    def __subscribe(self):
+        """
+        一定時間内に要求された分を購読する. 購読内容が変わった場合のみ送信する.
+        :return: None
+        :rtype: None
+        """
+        now = time.monotonic()
+        for key in [key for key, expires_at in self.__requested.items() if expires_at < now]:
+            del self.__requested[key]
+        subscription = (sorted(ident for kind, ident in self.__requested if kind == _KIND_CLUSTERS),
+                        sorted(ident for kind, ident in self.__requested if kind == _KIND_SERVERS))
+        if self.__writer is None or subscription == self.__subscription:
+            return
+        # 購読メッセージは小さいため drain は待たない
+        self.__writer.write(_encode({"type": MSG_SUBSCRIBE, _KIND_CLUSTERS: subscription[0],
+                                     _KIND_SERVERS: subscription[1]}))
+        self.__subscription = subscription
+
+    def __is_fresh(self, kind, ident):
+        """
+        受信した取得結果が使える新しさか.
+        :param kind: 種別(clusters or servers)
+        :type kind: str
+        :param ident: クラスターID or サーバID
+        :type ident: int
+        :rtype: bool
+        """
+        entry = self.__latest[kind].get(ident)
+        if entry is None:
+            return False
+        return self.__max_age is None or time.monotonic() - entry[0] <= self.__max_age
+
+    async def __get(self, kind, ident, ttl):
+        """
+        受信した最新の取得結果を取得する. まだ受信していないか古い場合は配信を待つ.
+        :param kind: 種別(clusters or servers)
+        :type kind: str
+        :param ident: クラスターID or サーバID
+        :type ident: int
+        :param ttl: 購読を続ける秒数
+        :type ttl: float
+        :return: 取得結果. 取得できなかった場合と、配信が止まっていて古い取得結果しかない場合は None.
+        """
+        self.start()
+        key = (kind, ident)
+        self.__requested[key] = max(self.__requested.get(key, 0), time.monotonic() + ttl)
+        await self.__attempted.wait()
+        self.__subscribe()
+        deadline = time.monotonic() + consts.FEED_WAIT_TIMEOUT
+        while self.is_connected and not self.__is_fresh(kind, ident):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print("【WARN 】監視プロセスからの配信待ちがタイムアウト. {}={}".format(kind, ident))
+                break
+            try:
+                await asyncio.wait_for(self.__received.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        entry = self.__latest[kind].get(ident)
+        if entry is None:
+            return None
+        if not self.__is_fresh(kind, ident):
+            print("【WARN 】監視プロセスからの配信が止まっているため古い取得結果を使いません. {}={} {:.0f}秒前".format(
+                kind, ident, time.monotonic() - entry[0]))
+            return None
+        return entry[1]
+
+    async def fetch_cluster(self, cluster_id, ttl=consts.FEED_SUBSCRIPTION_TTL):
+        """
+        クラスター内の全サーバ情報を取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :param ttl: 購読を続ける秒数
+        :type ttl: float
+        :return: {"id": サーバID, "player_count": 人数} のリスト. 取得できなかった場合は None.
+        :rtype: list of dict
+        """
+        return await self.__get(_KIND_CLUSTERS, cluster_id, ttl)
+
+    async def fetch_roster(self, server_id, ttl=consts.FEED_SUBSCRIPTION_TTL):
+        """
+        サーバのプレイヤー名を取得する.
+        :param server_id: サーバID
+        :type server_id: int
+        :param ttl: 購読を続ける秒数
+        :type ttl: float
+        :return: (プレイヤー数, プレイヤー名のタプル). 取得できなかった場合は None.
+        :rtype: tuple
+        """
+        return await self.__get(_KIND_SERVERS, server_id, ttl)
+
+    async def fetch_players(self, server_id, ttl=consts.FEED_SUBSCRIPTION_TTL):
+        roster = await self.fetch_roster(server_id, ttl)
+        if roster is None:
+            return None
+        return [{"name": player_name} for player_name in roster[1]]
+
+    async def fetch_players_text(self, server_id, ttl=consts.FEED_SUBSCRIPTION_TTL):
+        players = await self.fetch_players(server_id, ttl)
+        return json.dumps(players) if players is not None else ""
+
+    def on_demand(self):
+        """
+        巡回やサーバ状況確認等、その時だけ必要な取得に使う取得インスタンスを作成する.
+        監視プロセスへの接続はこのインスタンスと共有し、購読は FEED_ON_DEMAND_TTL 秒だけ続ける.
+        :return: 取得インスタンス
+        :rtype: OnDemandFeedFetcher
+        """
+        return OnDemandFeedFetcher(self)
+
+
+class OnDemandFeedFetcher:
+    """
+    監視プロセスから一時的に取得する取得クラス(通知プロセス用).
+    FeedFetcher と同じインタフェースで、購読を短時間で終わらせ、監視プロセスに取得し続けさせない.
+    """
+
+    def __init__(self, feed, ttl=consts.FEED_ON_DEMAND_TTL):
+        """
+        コンストラクタ.
+        :param feed: 監視プロセスとの接続を持つ取得インスタンス
+        :type feed: FeedFetcher
+        :param ttl: 購読を続ける秒数
+        :type ttl: float
+        """
+        self.__feed = feed
+        self.__ttl = ttl
+
+    async def fetch_cluster(self, cluster_id):
+        return await self.__feed.fetch_cluster(cluster_id, self.__ttl)
+
+    async def fetch_roster(self, server_id):
+        return await self.__feed.fetch_roster(server_id, self.__ttl)
+
+    async def fetch_players(self, server_id):
+        return await self.__feed.fetch_players(server_id, self.__ttl)
+
+    async def fetch_players_text(self, server_id):
+        return await self.__feed.fetch_players_text(server_id, self.__ttl)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from awsdb import consts
+
+
+class AtlasFetcher:
+    """
+    Atlas API 取得クラス.
+    requests はブロッキングのため、取得はイベントループのスレッドプールで実行する.
+    requests と jsons は読み込みに時間がかかるため、起動時ではなく初回の取得時に読み込む.
+    """
+
+    def __init__(self, loop=None, executor=None, recorder=None):
+        """
+        コンストラクタ.
+        :param loop: イベントループ. 省略時は実行中のイベントループ.
+        :type loop: asyncio.AbstractEventLoop
+        :param executor: 取得を実行するスレッドプール. 省略時はイベントループの既定のスレッドプール.
+        :type executor: concurrent.futures.Executor
+        :param recorder: レスポンス記録インスタンス. 省略時は記録しない.
+        :type recorder: awsdb.recorder.ResponseRecorder
+        """
+        self.__loop = loop
+        self.__executor = executor
+        self.__recorder = recorder
+
+    @property
+    def loop(self):
+        return self.__loop if self.__loop else asyncio.get_event_loop()
+
+    async def get_text(self, url):
+        """
+        指定URLの本文を取得する.
+        :param url: URL
+        :type url: str
+        :return: レスポンス本文
+        :rtype: str
+        """
+        return await self.loop.run_in_executor(self.__executor, self.__get_text, url)
+
+    def __get_text(self, url):
+        """
+        指定URLの本文を取得する(スレッドプールで実行). 記録する場合は取得したスレッドでそのまま記録する.
+        :param url: URL
+        :type url: str
+        :return: レスポンス本文
+        :rtype: str
+        """
+        import requests
+        text = requests.get(url, timeout=consts.API_TIMEOUT).text
+        if self.__recorder is not None:
+            self.__recorder.write(url, text)
+        return text
+
+    async def fetch_cluster(self, cluster_id):
+        """
+        クラスター内の全サーバ情報を取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :return: サーバ情報のリスト. レスポンスが空の場合は None.
+        :rtype: list of dict
+        """
+        text = await self.get_text(consts.URL_CLUSTER_SERVER.format(cluster_id))
+        if not text:
+            return None
+        import jsons
+        return jsons.loads(text)
+
+    async def fetch_players_text(self, server_id):
+        """
+        サーバのプレイヤー情報をデコードせずに取得する.
+        デコードは敵プレイヤー判定と合わせて MatchService で行う.
+        :param server_id: サーバID
+        :type server_id: int
+        :return: プレイヤー情報json
+        :rtype: str
+        """
+        return await self.get_text(consts.URL_SERVER_PLAYER.format(server_id))
+
+    async def fetch_players(self, server_id):
+        """
+        サーバのプレイヤー情報を取得する.
+        :param server_id: サーバID
+        :type server_id: int
+        :return: プレイヤー情報のリスト. レスポンスが空の場合は None.
+        :rtype: list of dict
+        """
+        text = await self.get_text(consts.URL_SERVER_PLAYER.format(server_id))
+        if not text:
+            return None
+        import jsons
+        return jsons.loads(text)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+from awsdb import consts
+
+# グリッドの1辺のサーバ数(A～O × 1～15)
+GRID_SIZE = 15
+# 人数の特殊値
+UNKNOWN_COUNT = -1  # 取得できなかった
+NO_INFO_COUNT = -2  # 前回の情報がない
+
+# サーバ名: (y, x). y は数字-1(北→南)、x はアルファベット(西→東).
+GRID_INDEX = dict((server["name"], divmod(server["id"] - 1, GRID_SIZE)[::-1]) for server in consts.SERVER_NAMES)
+# (y, x): サーバ名
+GRID_NAMES = np.empty((GRID_SIZE, GRID_SIZE), dtype=object)
+for _name, (_y, _x) in GRID_INDEX.items():
+    GRID_NAMES[_y, _x] = _name
+
+
+def empty_counts(fill=UNKNOWN_COUNT):
+    """
+    全サーバが指定値の人数配列を作成する.
+    :param fill: 初期値
+    :type fill: int
+    :return: 15×15 の人数配列
+    :rtype: numpy.ndarray
+    """
+    return np.full((GRID_SIZE, GRID_SIZE), fill, dtype=np.int32)
+
+
+def counts_of(servers_info):
+    """
+    サーバ情報から人数配列を取得する.
+    ServersInfo であれば保持している配列をそのまま返し、辞書(スナップショットから復元した前回のサーバ情報等)であれば変換する.
+    :param servers_info: サーバ名をキーとしたサーバ情報
+    :type servers_info: Mapping
+    :return: 15×15 の人数配列. 情報のないサーバは NO_INFO_COUNT.
+    :rtype: numpy.ndarray
+    """
+    if isinstance(servers_info, ServersInfo):
+        return servers_info.counts
+    counts = empty_counts(NO_INFO_COUNT)
+    for server_name, server_info in servers_info.items():
+        index = GRID_INDEX.get(server_name)
+        if index is None:
+            continue
+        player_count = server_info["player_count"]
+        counts[index] = player_count if player_count is not None else UNKNOWN_COUNT
+    return counts
+
+
+class ClusterGrid:
+    """
+    クラスター全体(15×15)の人数モデル.
+    クラスター情報の取得結果を (y, x) で引ける NumPy 配列で保持し、
+    人数の増減や移動平均をサーバ毎のループを使わずに全サーバまとめて計算する.
+    """
+
+    def __init__(self, cluster_id, alpha=consts.GRID_STATS_ALPHA):
+        """
+        コンストラクタ.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :param alpha: 指数移動平均の平滑化係数
+        :type alpha: float
+        """
+        self.__cluster_id = cluster_id
+        self.__alpha = alpha
+        self.__current = empty_counts()
+        self.__previous = empty_counts()
+        self.__mean = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.float64)
+        self.__var = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.float64)
+        self.__samples = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int32)
+        self.__generation = 0
+        self.__updated_at = None
+
+    @property
+    def cluster_id(self):
+        return self.__cluster_id
+
+    @property
+    def current(self):
+        """
+        今回の人数. 取得できなかったサーバは UNKNOWN_COUNT.
+        :rtype: numpy.ndarray
+        """
+        return self.__current
+
+    @property
+    def previous(self):
+        """
+        前回取得時の人数.
+        :rtype: numpy.ndarray
+        """
+        return self.__previous
+
+    @property
+    def mean(self):
+        """
+        人数の指数移動平均.
+        :rtype: numpy.ndarray
+        """
+        return self.__mean
+
+    @property
+    def std(self):
+        """
+        人数の指数移動標準偏差.
+        :rtype: numpy.ndarray
+        """
+        return np.sqrt(self.__var)
+
+    @property
+    def generation(self):
+        """
+        更新回数. 取得結果が更新されたかの判定に使う.
+        :rtype: int
+        """
+        return self.__generation
+
+    @property
+    def updated_at(self):
+        """
+        最後に更新した時刻(time.monotonic() の値). 未取得の場合は None.
+        :rtype: float
+        """
+        return self.__updated_at
+
+    @property
+    def delta(self):
+        """
+        前回取得時からの人数の増減. どちらかが取得できていないサーバは 0.
+        :rtype: numpy.ndarray
+        """
+        known = (self.__current >= 0) & (self.__previous >= 0)
+        return np.where(known, self.__current - self.__previous, 0)
+
+    def update(self, cluster_servers_info):
+        """
+        クラスター情報の取得結果で人数を更新する.
+        配列は作り直して差し替えるため、更新前に取り出した配列は以前の値のまま使える.
+        :param cluster_servers_info: クラスター情報の取得結果(サーバ情報のリスト)
+        :type cluster_servers_info: list of dict
+        :return: None
+        :rtype: None
+        """
+        offset = (self.cluster_id - 1) * GRID_SIZE * GRID_SIZE
+        servers = [server for server in cluster_servers_info
+                   if server and "id" in server and server.get("player_count") is not None]
+        ids = np.fromiter((server["id"] for server in servers), dtype=np.int64, count=len(servers)) - offset - 1
+        counts = np.fromiter((server["player_count"] for server in servers), dtype=np.int32, count=len(servers))
+        valid = (0 <= ids) & (ids < GRID_SIZE * GRID_SIZE)
+        flat = np.full(GRID_SIZE * GRID_SIZE, UNKNOWN_COUNT, dtype=np.int32)
+        flat[ids[valid]] = counts[valid]
+        # サーバID順は アルファベット × 数字 のため転置して (y, x) にする
+        current = np.ascontiguousarray(flat.reshape(GRID_SIZE, GRID_SIZE).T)
+
+        known = current >= 0
+        first = known & (self.__samples == 0)
+        diff = current - self.__mean
+        mean = np.where(known, self.__mean + self.__alpha * diff, self.__mean)
+        var = np.where(known, (1 - self.__alpha) * (self.__var + self.__alpha * diff * diff), self.__var)
+        self.__mean = np.where(first, current, mean)
+        self.__var = np.where(first, 0.0, var)
+        self.__samples = self.__samples + known
+        self.__previous = self.__current
+        self.__current = current
+        self.__generation += 1
+        self.__updated_at = time.monotonic()
+
+    def count_of(self, server_name):
+        """
+        サーバの今回の人数を取得する.
+        :param server_name: サーバ名
+        :type server_name: str
+        :return: 人数. 取得できなかった場合は None.
+        :rtype: int
+        """
+        count = int(self.__current[GRID_INDEX[server_name]])
+        return count if count >= 0 else None
+
+    def deltas_from(self, last_counts):
+        """
+        ギルドの前回の人数配列からの増減を全サーバまとめて計算する.
+        前回の情報がないサーバは 0、前回の人数が不明(0人以下を含む)のサーバは -1 とする.
+        :param last_counts: 前回の人数配列
+        :type last_counts: numpy.ndarray
+        :return: 15×15 の増減配列
+        :rtype: numpy.ndarray
+        """
+        comparable = (last_counts > 0) & (self.__current >= 0)
+        return np.where(comparable, self.__current - last_counts,
+                        np.where(last_counts == NO_INFO_COUNT, 0, -1)).astype(np.int32)
+
+
+class ServersInfo(Mapping):
+    """
+    1回分の監視結果(サーバ名: サーバ情報)のビュー.
+    人数と増減は ClusterGrid の配列を参照し、サーバ情報の辞書は参照された時に作成する.
+    """
+
+    def __init__(self, counts, deltas, details):
+        """
+        コンストラクタ.
+        :param counts: 15×15 の人数配列
+        :type counts: numpy.ndarray
+        :param deltas: 15×15 の増減配列
+        :type deltas: numpy.ndarray
+        :param details: サーバ名: {"enemy_players": 敵プレイヤーのリスト, "company_players": カンパニー集結} の辞書
+        :type details: dict
+        """
+        self.__counts = counts
+        self.__deltas = deltas
+        self.__details = details
+
+    @property
+    def counts(self):
+        return self.__counts
+
+    @property
+    def deltas(self):
+        return self.__deltas
+
+    def __getitem__(self, server_name):
+        detail = self.__details[server_name]
+        index = GRID_INDEX[server_name]
+        player_count = int(self.__counts[index])
+        ret = {
+            "server_name": server_name,
+            "player_count": player_count if player_count >= 0 else None,
+            "player_sbn_count": int(self.__deltas[index])
+        }
+        ret.update(detail)
+        return ret
+
+    def __iter__(self):
+        return iter(self.__details)
+
+    def __len__(self):
+        return len(self.__details)
+
+
+# 隣接8方向の (dy, dx)
+_NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+_NEIGHBOUR_DY = np.array([dy for dy, dx in _NEIGHBOURS], dtype=np.int64)
+_NEIGHBOUR_DX = np.array([dx for dy, dx in _NEIGHBOURS], dtype=np.int64)
+# 進行方向の名称(東から反時計回りに45度毎)
+_HEADING_NAMES = ["東", "北東", "北", "北西", "西", "南西", "南", "南東"]
+# 進行方向毎の次のサーバへの (dy, dx)
+_HEADING_STEPS = [(0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1)]
+
+
+def detect_movements(delta, min_players=consts.MOVEMENT_MIN_PLAYERS):
+    """
+    隣接サーバ間の人数の移動を検出する.
+    人数が減ったサーバから隣接する人数が増えたサーバへ移動したとみなし、
+    減少数を隣接8方向で畳み込んで各サーバへの流入数と進行方向を全サーバまとめて求める.
+    :param delta: 15×15 の人数増減配列
+    :type delta: numpy.ndarray
+    :param min_players: 移動とみなす最小人数
+    :type min_players: int
+    :return: 移動先のサーバ毎の
+             {"server_name": 移動先, "players": 流入数, "from_server_name": 主な移動元, "heading": 進行方向,
+             "next_server_name": 進行方向の次のサーバ(範囲外は None)} のリスト
+    :rtype: list of dict
+    """
+    rise = np.maximum(delta, 0)
+    drop = np.maximum(-delta, 0)
+    # 範囲外を 0 で埋め、隣接8方向の減少数を (方向, y, x) に並べる. [i, y, x] は (y + dy_i, x + dx_i) の減少数.
+    padded = np.pad(drop, 1, mode="constant")
+    neighbour_drop = np.stack([padded[1 + dy:1 + dy + GRID_SIZE, 1 + dx:1 + dx + GRID_SIZE] for dy, dx in _NEIGHBOURS])
+    inflow = neighbour_drop.sum(axis=0)
+    # 移動元 (y + dy, x + dx) から (y, x) へ向かうため、進行方向は (-dy, -dx) を減少数で重み付けした和
+    heading_y = -np.tensordot(_NEIGHBOUR_DY, neighbour_drop, axes=1)
+    heading_x = -np.tensordot(_NEIGHBOUR_DX, neighbour_drop, axes=1)
+    source = neighbour_drop.argmax(axis=0)
+
+    moved = np.minimum(rise, inflow)
+    ret = []
+    for y, x in zip(*np.nonzero(moved >= max(1, min_players))):
+        # y は南向きが正のため、角度は -y で求める
+        angle = np.degrees(np.arctan2(-heading_y[y, x], heading_x[y, x])) % 360
+        octant = int(((angle + 22.5) % 360) // 45)
+        next_y = y + _HEADING_STEPS[octant][0]
+        next_x = x + _HEADING_STEPS[octant][1]
+        dy, dx = _NEIGHBOURS[source[y, x]]
+        ret.append({
+            "server_name": GRID_NAMES[y, x],
+            "players": int(moved[y, x]),
+            "from_server_name": GRID_NAMES[y + dy, x + dx],
+            "heading": _HEADING_NAMES[octant],
+            "next_server_name": GRID_NAMES[next_y, next_x]
+            if 0 <= next_y < GRID_SIZE and 0 <= next_x < GRID_SIZE else None
+        })
+    return ret
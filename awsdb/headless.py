@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+from discord import ChannelType
+
+from awsdb.pipeline import STAGE_END, TickPipeline
+
+HEADLESS_GUILD_ID = "headless"
+
+
+class HeadlessChannel:
+    """
+    Discordに接続しない監視で使う監視報告チャンネル.
+    """
+
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+        self.type = ChannelType.text
+        self.id = "{}-{}".format(server.id, name)
+
+
+class HeadlessServer:
+    """
+    Discordに接続しない監視で使うギルド. 監視サーバ毎に監視報告チャンネルを1つ持つ.
+    """
+
+    def __init__(self, server_names, guild_id=HEADLESS_GUILD_ID):
+        """
+        コンストラクタ.
+        :param server_names: 監視サーバ名のリスト
+        :type server_names: list of str
+        :param guild_id: ギルドID
+        :type guild_id: str
+        """
+        self.id = guild_id
+        self.name = guild_id
+        self.channels = [HeadlessChannel(self, server_name.upper()) for server_name in server_names]
+
+
+class HeadlessClient:
+    """
+    Discordクライアントの代わりに ASWDConfig に渡すクライアント.
+    監視エンジンが参照するギルドの一覧だけを持ち、送信は行わない(Bot用コマンドチャンネルがないため呼ばれない).
+    """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.loop = asyncio.get_event_loop()
+
+
+class NdjsonOutput:
+    """
+    監視結果を1行1件のjson(NDJSON)で出力するクラス.
+    1件毎に flush するため、パイプで他のツールに渡してもその都度読める.
+    警告は出力しながら件数と先頭の数件を覚えておき、出力を読み直さずに集計できる.
+    """
+
+    def __init__(self, stream, max_bytes=0, keep_alerts=0):
+        """
+        コンストラクタ.
+        :param stream: 出力先(テキストモードのファイル or 標準出力)
+        :type stream: io.TextIOBase
+        :param max_bytes: 出力の上限サイズ(バイト). 超える分は出力しない(警告の集計は続ける). 0 の場合は上限なし.
+        :type max_bytes: int
+        :param keep_alerts: 覚えておく警告メッセージの件数
+        :type keep_alerts: int
+        """
+        self.__stream = stream
+        self.__max_bytes = max_bytes
+        self.__keep_alerts = keep_alerts
+        self.__written = 0
+        self.__truncated = False
+        self.__alert_count = 0
+        self.__alerts = []
+        self.tick = 0
+
+    @property
+    def alert_count(self):
+        """
+        出力した警告の件数(上限サイズで出力しなかった分を含む).
+        :rtype: int
+        """
+        return self.__alert_count
+
+    @property
+    def alerts(self):
+        """
+        先頭から keep_alerts 件の警告メッセージ.
+        :rtype: list of str
+        """
+        return list(self.__alerts)
+
+    @property
+    def truncated(self):
+        """
+        上限サイズを超えたため出力しなかった結果があるか.
+        :rtype: bool
+        """
+        return self.__truncated
+
+    def write(self, record):
+        """
+        1件出力する.
+        :param record: 出力内容
+        :type record: dict
+        :return: None
+        :rtype: None
+        """
+        if record["type"] == "alert":
+            self.__alert_count += 1
+            if len(self.__alerts) < self.__keep_alerts:
+                self.__alerts.append(record["message"])
+        if self.__truncated:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if self.__max_bytes:
+            size = len(line.encode("utf-8"))
+            if self.__written + size > self.__max_bytes:
+                self.__truncated = True
+                return
+            self.__written += size
+        self.__stream.write(line)
+        self.__stream.flush()
+
+
+class HeadlessPipeline(TickPipeline):
+    """
+    Discordに送信する代わりに監視結果を NDJSON で出力するパイプライン.
+    メッセージ作成段階でサーバ毎の状態と警告を出力し、送信段階には何も渡さない.
+    """
+
+    def __init__(self, engine, guilds, output):
+        """
+        コンストラクタ.
+        :param engine: 監視エンジン
+        :type engine: awsdb.watcher.WatchEngine
+        :param guilds: 対象ギルドの設定のリスト
+        :type guilds: list of awsdb.store.GuildConfig
+        :param output: 出力先
+        :type output: NdjsonOutput
+        """
+        super().__init__(engine, guilds)
+        self.__output = output
+
+    async def render_stage(self, in_queue, out_queue):
+        output = self.__output
+        while True:
+            item = await in_queue.get()
+            if item is STAGE_END:
+                break
+            guild, server_name, channels, server_info, alerts = item
+            started = time.perf_counter()
+            record = {"type": "grid", "tick": output.tick, "t": self.now, "world": guild.watch_world,
+                      "server": server_name}
+            if server_info is None:
+                record["error"] = True
+            else:
+                record.update({
+                    "player_count": server_info["player_count"],
+                    "delta": server_info["player_sbn_count"],
+                    "enemies": server_info["enemy_players"],
+                    "companies": server_info["company_players"]
+                })
+            output.write(record)
+            for msg in alerts:
+                output.write({"type": "alert", "tick": output.tick, "t": self.now, "world": guild.watch_world,
+                              "server": server_name, "message": msg})
+            self.add_time("render", started)
+        for i in range(self.dispatch_workers):
+            await out_queue.put(STAGE_END)
+
+
+async def run_headless(engine, guild, output, ticks=0, interval=0, frames=None):
+    """
+    Discordに接続せずに監視を繰り返し、tick 毎に処理時間等を出力する.
+    :param engine: HeadlessPipeline で出力する監視エンジン
+    :type engine: awsdb.watcher.WatchEngine
+    :param guild: 監視するギルドの設定
+    :type guild: awsdb.store.GuildConfig
+    :param output: 出力先
+    :type output: NdjsonOutput
+    :param ticks: 監視回数. 0 の場合は終了しない(記録の再生時は最後まで).
+    :type ticks: int
+    :param interval: 監視間隔(秒). 記録の再生時は待たない.
+    :type interval: float
+    :param frames: 記録を再生する場合は ReplayFetcher.frames() のジェネレータ
+    :type frames: generator
+    :return: 監視回数
+    :rtype: int
+    """
+    while ticks <= 0 or output.tick < ticks:
+        if frames is not None and next(frames, None) is None:
+            break
+        output.tick += 1
+        started = time.perf_counter()
+        collected = await engine.process([guild])
+        output.write({"type": "tick", "tick": output.tick, "t": time.time(), "world": guild.watch_world,
+                      "collected": collected, "elapsed": round(time.perf_counter() - started, 6),
+                      "stage_times": dict((name, round(value, 6)) for name, value in engine.stage_times.items())})
+        if frames is None and (ticks <= 0 or output.tick < ticks):
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    return output.tick
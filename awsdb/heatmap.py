@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from awsdb import consts
+from awsdb.grid import GRID_INDEX, GRID_SIZE, ClusterGrid
+
+_CELL = consts.HEATMAP_CELL_SIZE
+_MARGIN = consts.HEATMAP_MARGIN
+_SIZE = _MARGIN + _CELL * GRID_SIZE + 1
+
+_BACKGROUND = (24, 26, 32)
+_LINE = (70, 74, 84)
+_LABEL = (200, 200, 200)
+_UNKNOWN = (60, 60, 60)
+_COLD = np.array([30, 50, 90], dtype=np.float64)
+_HOT = np.array([255, 90, 0], dtype=np.float64)
+_WATCHED = (80, 200, 255)
+_ENEMY = (255, 40, 40)
+_TEXT = (255, 255, 255)
+
+
+class HeatmapRenderer:
+    """
+    クラスター人数ヒートマップ画像作成クラス.
+    枠線やラベル等の変化しない部分は1回だけ描画して使い回す.
+    各サーバのセルは (色の段階, 人数) 毎に1回だけ描画したタイルを貼り付ける.
+    作成した画像は人数モデルの更新回数・監視サーバ・敵侵入中サーバが同じ間は使い回す.
+    Pillow での描画と PNG 圧縮はイベントループを止めないよう render_async でスレッドプールで行う.
+    """
+
+    def __init__(self):
+        self.__font = ImageFont.load_default()
+        self.__base = None
+        # (色の段階, 人数): セルのタイル画像
+        self.__tiles = {}
+        # 描画は1つずつ行う(タイルのキャッシュを複数スレッドで同時に更新しない)
+        self.__lock = threading.Lock()
+        # (クラスターID, 更新回数, 監視サーバ, 敵侵入中サーバ): PNG画像
+        self.__memo = {}
+
+    def __get_base(self):
+        """
+        変化しない部分(背景・枠線・ラベル)の画像を取得する.
+        :return: ベース画像
+        :rtype: Image.Image
+        """
+        if self.__base is None:
+            base = Image.new("RGB", (_SIZE, _SIZE), _BACKGROUND)
+            draw = ImageDraw.Draw(base)
+            for i in range(GRID_SIZE + 1):
+                pos = _MARGIN + i * _CELL
+                draw.line([(pos, _MARGIN), (pos, _SIZE - 1)], fill=_LINE)
+                draw.line([(_MARGIN, pos), (_SIZE - 1, pos)], fill=_LINE)
+            for i in range(GRID_SIZE):
+                center = _MARGIN + i * _CELL + _CELL // 2
+                draw.text((center - 3, 4), chr(ord("A") + i), fill=_LABEL, font=self.__font)
+                draw.text((4, center - 5), str(i + 1), fill=_LABEL, font=self.__font)
+            self.__base = base
+        return self.__base
+
+    def __get_tile(self, step, count):
+        """
+        セルのタイル画像を取得する.
+        :param step: 色の段階(0～HEATMAP_COLOR_STEPS). 人数が不明の場合は無視する.
+        :type step: int
+        :param count: 人数. 取得できなかったサーバは負の値.
+        :type count: int
+        :return: タイル画像
+        :rtype: Image.Image
+        """
+        key = (step, count) if count >= 0 else None
+        tile = self.__tiles.get(key)
+        if tile is not None:
+            return tile
+        if len(self.__tiles) >= consts.HEATMAP_TILE_CACHE_SIZE:
+            self.__tiles.clear()
+        if count >= 0:
+            fill = tuple(int(c) for c in (_COLD + (_HOT - _COLD) * step / consts.HEATMAP_COLOR_STEPS))
+        else:
+            fill = _UNKNOWN
+        tile = Image.new("RGB", (_CELL - 1, _CELL - 1), fill)
+        if count >= 0:
+            ImageDraw.Draw(tile).text((3, _CELL // 2 - 6), str(count), fill=_TEXT, font=self.__font)
+        self.__tiles[key] = tile
+        return tile
+
+    def render(self, cluster_grid, watched_server_names, enemy_server_names):
+        """
+        ヒートマップのPNG画像を作成する.
+        :param cluster_grid: クラスター全体の人数モデル
+        :type cluster_grid: ClusterGrid
+        :param watched_server_names: 監視サーバ名のリスト
+        :type watched_server_names: list of str
+        :param enemy_server_names: 敵侵入中サーバ名のリスト
+        :type enemy_server_names: list of str
+        :return: PNG画像のバイト列
+        :rtype: bytes
+        """
+        key = self.__key(cluster_grid, watched_server_names, enemy_server_names)
+        png = self.__memo.get(key)
+        if png is None:
+            png = self.__draw(cluster_grid.current, watched_server_names, enemy_server_names)
+            self.__remember(key, png)
+        return png
+
+    async def render_async(self, cluster_grid, watched_server_names, enemy_server_names, loop=None):
+        """
+        ヒートマップのPNG画像をスレッドプールで作成する. 作成済みの画像があればそのまま返す.
+        人数の配列は更新時に差し替えられるため、作成中に監視で更新されても作成を始めた時点の人数で描画する.
+        :param cluster_grid: クラスター全体の人数モデル
+        :type cluster_grid: ClusterGrid
+        :param watched_server_names: 監視サーバ名のリスト
+        :type watched_server_names: list of str
+        :param enemy_server_names: 敵侵入中サーバ名のリスト
+        :type enemy_server_names: list of str
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: PNG画像のバイト列
+        :rtype: bytes
+        """
+        key = self.__key(cluster_grid, watched_server_names, enemy_server_names)
+        png = self.__memo.get(key)
+        if png is None:
+            loop = loop if loop else asyncio.get_event_loop()
+            png = await loop.run_in_executor(None, self.__draw, cluster_grid.current,
+                                             list(watched_server_names), list(enemy_server_names))
+            self.__remember(key, png)
+        return png
+
+    @staticmethod
+    def __key(cluster_grid, watched_server_names, enemy_server_names):
+        return (cluster_grid.cluster_id, cluster_grid.generation,
+                frozenset(watched_server_names), frozenset(enemy_server_names))
+
+    def __remember(self, key, png):
+        # 同じクラスターの古い更新回数の画像は使われないため破棄する
+        for old_key in [old_key for old_key in self.__memo if old_key[0] == key[0] and old_key[1] != key[1]]:
+            del self.__memo[old_key]
+        self.__memo[key] = png
+
+    def __draw(self, counts, watched_server_names, enemy_server_names):
+        """
+        ヒートマップを描画してPNG画像に変換する(スレッドプールで実行).
+        :param counts: 15×15 の人数配列
+        :type counts: numpy.ndarray
+        :param watched_server_names: 監視サーバ名のリスト
+        :type watched_server_names: list of str
+        :param enemy_server_names: 敵侵入中サーバ名のリスト
+        :type enemy_server_names: list of str
+        :return: PNG画像のバイト列
+        :rtype: bytes
+        """
+        # 色は人数の最大値に対する割合を段階に丸めて全セルまとめて求める
+        steps = np.rint(np.clip(counts / max(1, int(counts.max())), 0, 1) * consts.HEATMAP_COLOR_STEPS).astype(int)
+        with self.__lock:
+            image = self.__get_base().copy()
+            for y in range(GRID_SIZE):
+                for x in range(GRID_SIZE):
+                    tile = self.__get_tile(int(steps[y, x]), int(counts[y, x]))
+                    image.paste(tile, (_MARGIN + x * _CELL + 1, _MARGIN + y * _CELL + 1))
+        draw = ImageDraw.Draw(image)
+        for server_name in watched_server_names:
+            self.__outline(draw, server_name, _WATCHED, 2)
+        for server_name in enemy_server_names:
+            self.__outline(draw, server_name, _ENEMY, 4)
+
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return buf.getvalue()
+
+    @staticmethod
+    def __outline(draw, server_name, color, width):
+        index = GRID_INDEX.get(server_name)
+        if index is None:
+            return
+        y, x = index
+        left = _MARGIN + x * _CELL
+        top = _MARGIN + y * _CELL
+        draw.rectangle([left, top, left + _CELL, top + _CELL], outline=color, width=width)
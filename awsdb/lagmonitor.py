@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+from awsdb import consts
+
+
+class LoopLagMonitor:
+    """
+    イベントループ遅延監視クラス.
+    一定間隔で sleep するタスクを常駐させ、予定時刻から実際に再開するまでの遅延を計測し続ける.
+    イベントループがブロッキング処理で止まっている間はタスクが計測できないため、
+    別スレッド(監視スレッド)がタスクの最終応答時刻を見張り、閾値を超えて止まっていたらイベントループのスレッドの
+    スタックを取得して遅延ログ(1行1件のjson)に出力する.
+    """
+
+    def __init__(self, threshold, interval=consts.LAG_PROBE_INTERVAL, sample_size=consts.LAG_SAMPLE_SIZE,
+                 log_file=consts.LAG_LOG_FILE):
+        """
+        コンストラクタ.
+        :param threshold: スタックを記録する遅延の閾値(秒)
+        :type threshold: float
+        :param interval: 遅延の計測間隔(秒)
+        :type interval: float
+        :param sample_size: 百分位数の計算に使う直近の計測数
+        :type sample_size: int
+        :param log_file: 遅延ログのファイル名
+        :type log_file: str
+        """
+        self.__threshold = threshold
+        self.__interval = interval
+        self.__samples = deque(maxlen=sample_size)
+        self.__log_file = log_file
+        self.__task = None
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.__loop_thread_id = None
+        # 計測タスクが最後に応答した時刻と、その応答で既にスタックを記録したか
+        self.__beat_at = time.monotonic()
+        self.__beat_captured = False
+        self.__stall_count = 0
+        self.__max_lag = 0.0
+
+    @property
+    def threshold(self):
+        return self.__threshold
+
+    @property
+    def is_running(self):
+        return self.__task is not None and not self.__task.done()
+
+    @property
+    def stall_count(self):
+        """
+        閾値を超えてイベントループが止まっていた回数.
+        :rtype: int
+        """
+        return self.__stall_count
+
+    @property
+    def max_lag(self):
+        """
+        起動からの最大遅延(秒).
+        :rtype: float
+        """
+        return self.__max_lag
+
+    @property
+    def sample_count(self):
+        return len(self.__samples)
+
+    def start(self, loop):
+        """
+        計測タスクと監視スレッドを起動する. イベントループのスレッドから呼び出すこと.
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: 処理結果(True: 起動, False: 既に起動済み)
+        :rtype: bool
+        """
+        if self.is_running:
+            return False
+        self.__loop_thread_id = threading.get_ident()
+        self.__beat_at = time.monotonic()
+        self.__beat_captured = False
+        self.__stopped.clear()
+        self.__task = loop.create_task(self.__probe())
+        self.__thread = threading.Thread(target=self.__watch, name="loop-lag-monitor", daemon=True)
+        self.__thread.start()
+        print("イベントループ遅延監視起動. threshold={}秒".format(self.threshold))
+        return True
+
+    def stop(self):
+        """
+        計測タスクと監視スレッドを停止する.
+        :return: None
+        :rtype: None
+        """
+        self.__stopped.set()
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def __probe(self):
+        """
+        遅延計測ループ本体.
+        :return: None
+        :rtype: None
+        """
+        while True:
+            expected = time.monotonic() + self.__interval
+            await asyncio.sleep(self.__interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.__samples.append(lag)
+            self.__max_lag = max(self.__max_lag, lag)
+            self.__beat_at = now
+            self.__beat_captured = False
+
+    def __watch(self):
+        """
+        監視スレッド本体.
+        計測タスクの応答が計測間隔＋閾値を超えて途絶えたら、止まっている間に1回だけスタックを記録する.
+        :return: None
+        :rtype: None
+        """
+        check_interval = max(0.01, self.__threshold / 2)
+        while not self.__stopped.wait(check_interval):
+            stalled = time.monotonic() - self.__beat_at - self.__interval
+            if stalled < self.__threshold or self.__beat_captured:
+                continue
+            self.__beat_captured = True
+            self.__stall_count += 1
+            try:
+                self.__record(stalled)
+            except Exception as e:
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+
+    def __record(self, stalled):
+        """
+        イベントループのスレッドのスタックを遅延ログに出力する.
+        :param stalled: 記録時点の遅延(秒)
+        :type stalled: float
+        :return: None
+        :rtype: None
+        """
+        frame = sys._current_frames().get(self.__loop_thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "event": "loop_blocked",
+            "lag": round(stalled, 3),
+            "threshold": self.__threshold,
+            "stack": [line.rstrip() for line in stack]
+        }
+        print("【WARN 】イベントループが{:.2f}秒停止. {}".format(stalled, stack[-1].strip() if stack else ""))
+        with open(self.__log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        直近の遅延の百分位数を取得する.
+        :param points: 百分位(0～100)のリスト
+        :type points: tuple of int
+        :return: 百分位: 遅延(秒) の辞書. 計測がない場合は空.
+        :rtype: dict
+        """
+        samples = sorted(self.__samples)
+        if not samples:
+            return {}
+        last = len(samples) - 1
+        return dict((point, samples[min(last, int(round(last * point / 100)))]) for point in points)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from awsdb import consts
+
+
+class EnemyMatcher:
+    """
+    敵プレイヤー判定クラス.
+    敵プレイヤー名を大文字小文字を区別しない部分一致で判定する.
+    Aho-Corasick 法のオートマトンを事前に構築し、プレイヤー名1件あたり名前の長さに比例する時間で
+    含まれている敵プレイヤー名を全て検出する.
+    プロセスプールへ送れるよう、内部状態は list と dict のみで持つ.
+    """
+
+    def __init__(self, patterns):
+        """
+        コンストラクタ.
+        :param patterns: 敵プレイヤー名のリスト
+        :type patterns: list of str
+        """
+        self.__patterns = self.normalize(patterns)
+        self.__key = self.key_of(self.__patterns)
+        self.__goto = [{}]
+        self.__fail = [0]
+        self.__out = [()]
+        self.__build()
+
+    @staticmethod
+    def normalize(patterns):
+        """
+        敵プレイヤー名を重複・空文字を除いて並べ替える.
+        :param patterns: 敵プレイヤー名のリスト
+        :type patterns: collections.abc.Iterable of str
+        :rtype: list of str
+        """
+        return sorted(set(pattern for pattern in patterns if pattern))
+
+    @staticmethod
+    def key_of(patterns):
+        """
+        正規化済みの敵プレイヤー名から識別子を求める. 判定インスタンスを作らずに同じ組み合わせか判定できる.
+        :param patterns: normalize() した敵プレイヤー名のリスト
+        :type patterns: list of str
+        :rtype: str
+        """
+        return hashlib.sha1("\n".join(patterns).encode('utf-8')).hexdigest()
+
+    @property
+    def key(self):
+        """
+        敵プレイヤー名の組み合わせから求めた識別子. 同じ敵プレイヤー名の組み合わせなら同じ値になる.
+        :rtype: str
+        """
+        return self.__key
+
+    @property
+    def patterns(self):
+        return self.__patterns
+
+    def __len__(self):
+        return len(self.__patterns)
+
+    def __build(self):
+        """
+        オートマトンを構築する.
+        :return: None
+        :rtype: None
+        """
+        goto = self.__goto
+        out = [[]]
+        for index, pattern in enumerate(self.__patterns):
+            state = 0
+            for c in pattern.upper():
+                next_state = goto[state].get(c)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][c] = next_state
+                    goto.append({})
+                    out.append([])
+                state = next_state
+            out[state].append(index)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for c, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(c, 0)
+                out[next_state].extend(out[fail[next_state]])
+        self.__fail = fail
+        self.__out = [tuple(x) for x in out]
+
+    def find(self, name):
+        """
+        プレイヤー名に含まれる敵プレイヤー名を取得する.
+        :param name: プレイヤー名
+        :type name: str
+        :return: 一致した敵プレイヤー名のリスト
+        :rtype: list of str
+        """
+        goto = self.__goto
+        fail = self.__fail
+        out = self.__out
+        found = set()
+        state = 0
+        for c in name.upper():
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                found.update(out[state])
+        return [self.__patterns[index] for index in sorted(found)]
+
+
+# ワーカー側でキャッシュしている判定インスタンス(識別子: EnemyMatcher)
+_worker_matchers = {}
+# thread モードでは全ワーカースレッドで _worker_matchers を共有するため、参照・更新はロックして行う
+_worker_lock = threading.Lock()
+
+
+def decode_and_match(text, specs):
+    """
+    プレイヤー情報jsonをデコードし、敵プレイヤーを判定する.
+    ワーカー(スレッド/プロセス)で実行される.
+    デコードしたプレイヤー毎の辞書は名前を取り出したら捨て、プレイヤー名は sys.intern した文字列のタプルで返す.
+    判定インスタンスはワーカー毎にキャッシュし、未送信の識別子のみ本体を受け取る.
+    :param text: プレイヤー情報json
+    :type text: str
+    :param specs: (判定インスタンスの識別子, 判定インスタンス or None) のリスト
+    :type specs: list of tuple
+    :return: キャッシュにない識別子があれば {"missing": 識別子のリスト}.
+             それ以外は {"roster_size": プレイヤー数, "names": プレイヤー名のタプル,
+             "matches": {識別子: [(プレイヤー名, 敵プレイヤー名)]}}.
+             プレイヤー情報が取得できなかった場合 roster_size は -1.
+    :rtype: dict
+    """
+    # 判定に使うインスタンスは先に手元に取り出し、キャッシュを空にしても判定中のものは失われないようにする
+    with _worker_lock:
+        matchers = []
+        missing = []
+        for key, matcher in specs:
+            if matcher is None:
+                matcher = _worker_matchers.get(key)
+                if matcher is None:
+                    missing.append(key)
+                    continue
+            matchers.append(matcher)
+        if missing:
+            return {"missing": missing}
+        if len(_worker_matchers) > consts.MATCH_WORKER_CACHE_SIZE:
+            _worker_matchers.clear()
+        for key, matcher in specs:
+            if matcher is not None:
+                _worker_matchers[key] = matcher
+
+    players = json.loads(text) if text else None
+    if not players or not isinstance(players, list):
+        return match_names(-1, (), matchers)
+    names = []
+    for player in players:
+        player_name = sys.intern(str(player["name"])) if player and "name" in player else ""
+        if player_name:
+            names.append(player_name)
+    return match_names(len(players), tuple(names), matchers)
+
+
+def match_names(roster_size, names, matchers):
+    """
+    デコード済みのプレイヤー名で敵プレイヤーを判定する.
+    :param roster_size: プレイヤー数. プレイヤー情報が取得できなかった場合は -1.
+    :type roster_size: int
+    :param names: プレイヤー名のタプル
+    :type names: tuple of str
+    :param matchers: 判定インスタンスのリスト
+    :type matchers: list of EnemyMatcher
+    :return: {"roster_size": プレイヤー数, "names": プレイヤー名のタプル,
+             "matches": {識別子: [(プレイヤー名, 敵プレイヤー名)]}}
+    :rtype: dict
+    """
+    matches = dict((matcher.key, []) for matcher in matchers)
+    for player_name in names:
+        for matcher in matchers:
+            for pattern in matcher.find(player_name):
+                matches[matcher.key].append((player_name, pattern))
+    return {"roster_size": roster_size, "names": names, "matches": matches}
+
+
+class MatchService:
+    """
+    プレイヤー情報のデコードと敵プレイヤー判定を実行するクラス.
+    モードにより、イベントループ上で直接実行(inline)、スレッドプール(thread)、プロセスプール(process)を切り替える.
+    プールで実行する場合、判定インスタンスは各ワーカーに1回だけ送り、敵プレイヤーが変わった場合のみ送り直す.
+    """
+
+    def __init__(self, mode=consts.MATCH_MODE_INLINE, workers=None):
+        """
+        コンストラクタ.
+        :param mode: 実行モード(inline, thread, process)
+        :type mode: str
+        :param workers: ワーカー数. 省略時は実行モードの既定値.
+        :type workers: int
+        """
+        if mode not in consts.MATCH_MODES:
+            raise ValueError("判定の実行モードは {} のいずれかを指定してください. mode:{}".format(
+                ", ".join(consts.MATCH_MODES), mode))
+        self.__mode = mode
+        self.__workers = workers
+        self.__executor = None
+        self.__sent_keys = set()
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    def __get_executor(self):
+        if self.__executor is None:
+            if self.mode == consts.MATCH_MODE_PROCESS:
+                self.__executor = ProcessPoolExecutor(self.__workers)
+            else:
+                self.__executor = ThreadPoolExecutor(self.__workers)
+        return self.__executor
+
+    async def match(self, text, matchers, loop=None):
+        """
+        プレイヤー情報jsonをデコードし、敵プレイヤーを判定する.
+        :param text: プレイヤー情報json
+        :type text: str
+        :param matchers: 判定インスタンスのリスト
+        :type matchers: list of EnemyMatcher
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: {"roster_size": プレイヤー数, "names": プレイヤー名のタプル,
+                 "matches": {識別子: [(プレイヤー名, 敵プレイヤー名)]}}
+        :rtype: dict
+        """
+        if self.mode == consts.MATCH_MODE_INLINE:
+            return decode_and_match(text, [(matcher.key, matcher) for matcher in matchers])
+
+        loop = loop if loop else asyncio.get_event_loop()
+        specs = []
+        for matcher in matchers:
+            specs.append((matcher.key, None if matcher.key in self.__sent_keys else matcher))
+            self.__sent_keys.add(matcher.key)
+        ret = await loop.run_in_executor(self.__get_executor(), decode_and_match, text, specs)
+        if "missing" in ret:
+            # キャッシュを持っていないワーカーに当たった場合は判定インスタンスを付けて再実行
+            specs = [(matcher.key, matcher) for matcher in matchers]
+            ret = await loop.run_in_executor(self.__get_executor(), decode_and_match, text, specs)
+        return ret
+
+    def shutdown(self):
+        """
+        ワーカープールを終了する.
+        :return: None
+        :rtype: None
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from awsdb import consts
+from awsdb.fetcher import AtlasFetcher
+from awsdb.matcher import match_names
+from awsdb.utils import Utils
+from awsdb.watcher import WatchEngine
+
+
+class TtlCache:
+    """
+    有効期限付きのキャッシュ.
+    同じキーの取得が同時に要求された場合は取得処理を1回だけ実行し、待っている全員に同じ結果を返す.
+    取得に失敗した場合は結果を残さず、待っている全員に例外を送出する.
+    """
+
+    def __init__(self, ttl):
+        """
+        コンストラクタ.
+        :param ttl: 取得結果を使い回す秒数
+        :type ttl: float
+        """
+        self.__ttl = ttl
+        # キー: (有効期限(time.monotonic()), 取得結果)
+        self.__entries = {}
+        # キー: 実行中の取得処理
+        self.__loading = {}
+
+    async def get(self, key, load):
+        """
+        キーに対応する値を取得する. 有効期限内の取得結果があればそれを返し、なければ load で取得する.
+        :param key: キー
+        :type key: collections.abc.Hashable
+        :param load: 値を取得するコルーチン関数(引数なし)
+        :type load: function
+        :return: 取得結果
+        :rtype: object
+        """
+        entry = self.__entries.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        future = self.__loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.__load(key, load))
+            self.__loading[key] = future
+        # 待っている要求の1つがキャンセルされても、同じ取得を待っている他の要求には影響させない
+        return await asyncio.shield(future)
+
+    async def __load(self, key, load):
+        try:
+            value = await load()
+        finally:
+            del self.__loading[key]
+        now = time.monotonic()
+        for expired in [k for k, (expires, v) in self.__entries.items() if expires <= now]:
+            del self.__entries[expired]
+        self.__entries[key] = (now + self.__ttl, value)
+        return value
+
+
+class PeekService:
+    """
+    サーバの現在の状況を即時に調べるクラス.
+    監視で取得した情報が新しい場合はそれを使い、古い場合や監視していないサーバは Atlas API から1回だけ取得する.
+    API から取得した結果は短時間キャッシュし、同じサーバへの同時の要求はまとめて1回の取得にする.
+    """
+
+    __engine: WatchEngine
+    __fetcher: AtlasFetcher
+
+    def __init__(self, engine, fetcher=None, fresh_age=consts.PEEK_FRESH_AGE, cache_ttl=consts.PEEK_CACHE_TTL):
+        """
+        コンストラクタ.
+        :param engine: 監視エンジン. 最新の監視結果と判定実行インスタンスを共有する.
+        :type engine: WatchEngine
+        :param fetcher: Atlas API 取得インスタンス. 省略時は新規作成(レスポンスは記録しない).
+                        監視プロセスを分ける場合は FeedFetcher.on_demand() の取得インスタンス.
+        :type fetcher: AtlasFetcher
+        :param fresh_age: 監視で取得した情報をそのまま使う経過秒数の上限
+        :type fresh_age: float
+        :param cache_ttl: API から取得した結果を使い回す秒数
+        :type cache_ttl: float
+        """
+        self.__engine = engine
+        self.__fetcher = fetcher if fetcher else AtlasFetcher()
+        self.__fresh_age = fresh_age
+        self.__cache = TtlCache(cache_ttl)
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    async def __fetch_counts(self, cluster_id):
+        """
+        クラスター内の全サーバの人数を取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :return: サーバID: 人数
+        :rtype: dict of (int, int)
+        """
+        cluster_servers_info = await self.__fetcher.fetch_cluster(cluster_id)
+        if not cluster_servers_info:
+            raise ValueError("サーバ情報jsonが空. cluster_id:{}".format(cluster_id))
+        return dict((server["id"], server["player_count"]) for server in cluster_servers_info
+                    if server and "id" in server and server.get("player_count") is not None)
+
+    async def __fetch_roster(self, server_id):
+        """
+        サーバのプレイヤー情報を取得してデコードする. 敵プレイヤーの判定は要求したギルド毎に行う.
+        :param server_id: サーバID
+        :type server_id: int
+        :return: (プレイヤー数, プレイヤー名のタプル)
+        :rtype: tuple
+        """
+        # 監視プロセスからデコード済みのプレイヤー名を受け取る取得クラスではデコードを省く
+        fetch_roster = getattr(self.__fetcher, "fetch_roster", None)
+        if fetch_roster is not None:
+            roster = await fetch_roster(server_id)
+            if not roster:
+                raise ValueError("プレイヤー情報が取得できません. server_id:{}".format(server_id))
+            return roster
+        players_json = await self.__fetcher.fetch_players_text(server_id)
+        if not players_json:
+            raise ValueError("プレイヤー情報jsonが空. server_id:{}".format(server_id))
+        grid = await self.engine.match_service.match(players_json, [])
+        return grid["roster_size"], grid["names"]
+
+    async def peek(self, guild, server_name):
+        """
+        ギルドの監視ワールドのサーバの人数、プレイヤー数、敵プレイヤーを取得する.
+        :param guild: ギルド設定. 監視ワールドと敵プレイヤーの判定に使う.
+        :type guild: awsdb.store.GuildConfig
+        :param server_name: サーバ名(A1-O15)
+        :type server_name: str
+        :return: {"server_name": サーバ名, "player_count": 人数(取得できなかった場合は None),
+                 "roster_size": プレイヤー数(取得できなかった場合は -1), "enemy_players": 敵プレイヤーのリスト,
+                 "age": 監視で取得した情報の経過秒数(API から取得した場合は None)}
+        :rtype: dict
+        """
+        cluster_id = guild.watch_world
+        server_id = Utils.get_server_id(cluster_id, server_name)
+        ages = []
+
+        cluster_grid = self.engine.cluster_grid(cluster_id)
+        age = None if cluster_grid.updated_at is None else time.monotonic() - cluster_grid.updated_at
+        if age is not None and age <= self.__fresh_age:
+            ages.append(age)
+            player_count = cluster_grid.count_of(server_name)
+        else:
+            counts = await self.__cache.get(("cluster", cluster_id), lambda: self.__fetch_counts(cluster_id))
+            player_count = counts.get(server_id)
+            ages.append(None)
+
+        roster_size, names = -1, ()
+        if player_count is not None:
+            roster = self.engine.latest_roster((cluster_id, server_name), self.__fresh_age)
+            if roster is not None:
+                ages.append(roster[0])
+                roster_size, names = roster[1], roster[2]
+            else:
+                roster_size, names = await self.__cache.get(("players", server_id),
+                                                            lambda: self.__fetch_roster(server_id))
+                ages.append(None)
+
+        enemy_players = []
+        if 0 <= roster_size:
+            enemy_players = self.engine.detect(guild, match_names(roster_size, names, [guild.matcher]))["enemy_players"]
+        return {
+            "server_name": server_name,
+            "player_count": player_count,
+            "roster_size": roster_size,
+            "enemy_players": enemy_players,
+            "age": None if None in ages else max(ages)
+        }
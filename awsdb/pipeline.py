@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import traceback
+from datetime import datetime
+
+from awsdb import consts
+from awsdb.detectors import DetectContext
+from awsdb.grid import GRID_INDEX, ServersInfo, counts_of
+from awsdb.matcher import match_names
+from awsdb.utils import Utils
+
+# 各段階の終了をキューで後段に伝える印
+STAGE_END = None
+
+
+class _GuildTick:
+    """
+    パイプライン実行中のギルド毎の監視結果.
+    """
+
+    __slots__ = ("servers_info", "details", "surges", "arrivals", "approaches")
+
+    def __init__(self, servers_info, details, surges, arrivals, approaches):
+        self.servers_info = servers_info
+        self.details = details
+        self.surges = surges
+        self.arrivals = arrivals
+        self.approaches = approaches
+
+
+class TickPipeline:
+    """
+    監視処理1回分のパイプライン.
+    取得→デコード→判定→メッセージ作成→送信 の段階をそれぞれ別タスクで動かし、段階の間を上限付きのキューでつなぐ.
+    あるサーバのデコード中に次のサーバを取得し、その間に前のサーバの通知を送信できる.
+    後段が詰まってキューが一杯になると前段は空きを待つため、取得だけが先行してメモリを使い続けることはない.
+    各段階は fetch_stage 等のメソッドで、サブクラスで個別に置き換えられる. 段階毎の処理時間は stage_times に残す.
+    """
+
+    def __init__(self, engine, guilds, queue_size=consts.PIPELINE_QUEUE_SIZE,
+                 dispatch_workers=consts.PIPELINE_DISPATCH_WORKERS):
+        """
+        コンストラクタ.
+        :param engine: 監視エンジン
+        :type engine: awsdb.watcher.WatchEngine
+        :param guilds: 対象ギルドの設定のリスト
+        :type guilds: list of awsdb.store.GuildConfig
+        :param queue_size: 段階間のキューの上限
+        :type queue_size: int
+        :param dispatch_workers: 送信を並列に行うタスク数
+        :type dispatch_workers: int
+        """
+        self.__engine = engine
+        self.__guilds = list(guilds)
+        self.__queue_size = queue_size
+        self.__dispatch_workers = max(1, dispatch_workers)
+        # 段階名: 処理時間(秒). キューの空き・到着待ちは含まない.
+        self.__stage_times = dict((name, 0.0) for name in consts.PIPELINE_STAGES)
+        # ギルドID: 監視結果
+        self.__ticks = {}
+        self.__collected = False
+        self.__now = time.time()
+        self.__timestr = datetime.now().strftime("%m/%d %H:%M")
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def stage_times(self):
+        return dict(self.__stage_times)
+
+    @property
+    def dispatch_workers(self):
+        return self.__dispatch_workers
+
+    @property
+    def now(self):
+        """
+        判定時刻(UNIX時間).
+        :rtype: float
+        """
+        return self.__now
+
+    def add_time(self, stage, started):
+        """
+        段階の処理時間を加算する.
+        :param stage: 段階名
+        :type stage: str
+        :param started: 処理開始時の time.perf_counter()
+        :type started: float
+        :return: None
+        :rtype: None
+        """
+        self.__stage_times[stage] += time.perf_counter() - started
+
+    async def run(self):
+        """
+        パイプラインを実行する. いずれかの段階が例外を送出した場合は他の段階を止めて送出する.
+        :return: ギルドID: 今回のサーバ情報 の辞書
+        :rtype: dict
+        """
+        decode_queue = asyncio.Queue(self.__queue_size)
+        detect_queue = asyncio.Queue(self.__queue_size)
+        render_queue = asyncio.Queue(self.__queue_size)
+        dispatch_queue = asyncio.Queue(self.__queue_size)
+        tasks = [
+            asyncio.ensure_future(self.fetch_stage(decode_queue)),
+            asyncio.ensure_future(self.decode_stage(decode_queue, detect_queue)),
+            asyncio.ensure_future(self.detect_stage(detect_queue, render_queue)),
+            asyncio.ensure_future(self.render_stage(render_queue, dispatch_queue))
+        ]
+        tasks.extend(asyncio.ensure_future(self.dispatch_stage(dispatch_queue))
+                     for i in range(self.__dispatch_workers))
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        # 判定するサーバがなかったギルドも今回の人数で前回サーバ情報を更新する
+        return dict((guild.guild_id, self.__guild_tick(guild).servers_info) for guild in self.__guilds)
+
+    @property
+    def collected(self):
+        """
+        監視対象のサーバ情報を1件以上取得できたか.
+        :rtype: bool
+        """
+        return self.__collected
+
+    async def fetch_stage(self, out_queue):
+        """
+        取得段階.
+        クラスター情報は1回だけ取得してクラスター全体の人数モデルを更新し、プレイヤー情報はサーバ毎に1回だけ取得する.
+        取得できなかったサーバは取得結果を None として後段に流す.
+        :param out_queue: デコード段階へのキュー. ((クラスターID, サーバ名), 取得結果) を入れる.
+        :type out_queue: asyncio.Queue
+        :return: None
+        :rtype: None
+        """
+        engine = self.engine
+        fetcher = engine.fetcher
+        # 監視プロセスからデコード済みのプレイヤー名を受け取る取得クラス(FeedFetcher)ではデコードを省く
+        fetch_roster = getattr(fetcher, "fetch_roster", None)
+        for cluster_id, server_names in engine.registry.grids_by_cluster().items():
+            started = time.perf_counter()
+            try:
+                print('ClusterServer情報取得開始. cluster_id={}'.format(cluster_id))
+                cluster_servers_info = await fetcher.fetch_cluster(cluster_id)
+                print("ClusterServer情報取得完了.")
+                if not cluster_servers_info:
+                    await engine.notice('【エラー】サーバ情報jsonが空. 再度実行.')
+            except Exception as e:
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+                await engine.notice('【エラー】サーバ情報取得失敗. サーバダウンかも. 再度実行.')
+                cluster_servers_info = None
+            self.add_time("fetch", started)
+            if not cluster_servers_info:
+                for server_name in server_names:
+                    await out_queue.put(((cluster_id, server_name), None))
+                continue
+            print("ClusterServer情報取得成功.")
+            cluster_grid = engine.update_cluster(cluster_id, cluster_servers_info)
+
+            for server_name in server_names:
+                key = (cluster_id, server_name)
+                if cluster_grid.count_of(server_name) is None:
+                    await out_queue.put((key, None))
+                    continue
+                started = time.perf_counter()
+                server_id = Utils.get_server_id(cluster_id, server_name)
+                try:
+                    print('ServerPlayer情報取得開始. server_name={}'.format(server_name))
+                    if fetch_roster is not None:
+                        players = await fetch_roster(server_id)
+                    else:
+                        players = await fetcher.fetch_players_text(server_id)
+                    print("ServerPlayer情報取得完了.")
+                    if not players:
+                        await engine.notice('【エラー】プレイヤー情報jsonが空. 次のサーバを処理.')
+                    else:
+                        print("ServerPlayer情報取得成功.")
+                except Exception as e:
+                    with open(consts.LOG_FILE, 'a') as f:
+                        traceback.print_exc(file=f)
+                    await engine.notice('【エラー】プレイヤー情報取得失敗. サーバダウンかも. 次のサーバを処理.')
+                    players = None
+                self.add_time("fetch", started)
+                await out_queue.put((key, (fetch_roster is not None, players) if players else None))
+        await out_queue.put(STAGE_END)
+
+    async def decode_stage(self, in_queue, out_queue):
+        """
+        デコード段階.
+        デコードと敵プレイヤー判定は購読ギルドの判定インスタンスをまとめて1回で行い、プレイヤー所在インデックスに反映する.
+        :param in_queue: 取得段階からのキュー
+        :type in_queue: asyncio.Queue
+        :param out_queue: 判定段階へのキュー. ((クラスターID, サーバ名), サーバ情報 or None) を入れる.
+        :type out_queue: asyncio.Queue
+        :return: None
+        :rtype: None
+        """
+        engine = self.engine
+        while True:
+            item = await in_queue.get()
+            if item is STAGE_END:
+                break
+            key, fetched = item
+            grid = None
+            if fetched is not None:
+                started = time.perf_counter()
+                decoded, players = fetched
+                if decoded:
+                    grid = match_names(players[0], players[1], engine.grid_matchers(key))
+                else:
+                    grid = await engine.match_service.match(players, engine.grid_matchers(key))
+                if 0 <= grid["roster_size"]:
+                    engine.player_index.update(key[0], key[1], grid["names"])
+                    engine.update_roster(key, grid["roster_size"], grid["names"])
+                self.__collected = True
+                self.add_time("decode", started)
+            await out_queue.put((key, grid))
+        await out_queue.put(STAGE_END)
+
+    def __guild_tick(self, guild):
+        """
+        ギルドの今回の監視結果を取得する. 初回はクラスター全体の配列で人数の増減と急増をまとめて計算する.
+        :param guild: ギルド設定
+        :type guild: awsdb.store.GuildConfig
+        :rtype: _GuildTick
+        """
+        guild_tick = self.__ticks.get(guild.guild_id)
+        if guild_tick is not None:
+            return guild_tick
+        cluster_grid = self.engine.cluster_grid(guild.watch_world)
+        deltas = cluster_grid.deltas_from(counts_of(guild.last_servers_info))
+        arrivals = {}
+        approaches = {}
+        for movement in self.engine.movements(guild.watch_world):
+            arrivals[movement["server_name"]] = movement
+            if movement["next_server_name"]:
+                approaches.setdefault(movement["next_server_name"], []).append(movement)
+        details = {}
+        guild_tick = _GuildTick(ServersInfo(cluster_grid.current, deltas, details), details,
+                                deltas >= guild.player_sbn_count, arrivals, approaches)
+        self.__ticks[guild.guild_id] = guild_tick
+        return guild_tick
+
+    async def detect_stage(self, in_queue, out_queue):
+        """
+        判定段階.
+        サーバを購読しているギルド毎に、ギルドの設定で敵プレイヤー・カンパニー集結を判定し、登録されている警告判定を行う.
+        :param in_queue: デコード段階からのキュー
+        :type in_queue: asyncio.Queue
+        :param out_queue: メッセージ作成段階へのキュー.
+                          (ギルド設定, サーバ名, チャンネルのリスト, サーバ情報 or None, 警告メッセージのリスト) を入れる.
+        :type out_queue: asyncio.Queue
+        :return: None
+        :rtype: None
+        """
+        engine = self.engine
+        while True:
+            item = await in_queue.get()
+            if item is STAGE_END:
+                break
+            key, grid = item
+            server_name = key[1]
+            started = time.perf_counter()
+            guild_channels = {}
+            for channel in engine.registry.channels(key):
+                guild_channels.setdefault(str(channel.server.id), (channel.server, []))[1].append(channel)
+            results = []
+            for server, channels in guild_channels.values():
+                guild = engine.config.guild(server)
+                if grid is None:
+                    results.append((guild, server_name, channels, None, []))
+                    continue
+                guild_tick = self.__guild_tick(guild)
+                if server_name not in guild_tick.details:
+                    guild_tick.details[server_name] = engine.detect(guild, grid)
+                server_info = guild_tick.servers_info[server_name]
+                context = DetectContext(guild, server_name, server_info, bool(guild_tick.surges[GRID_INDEX[server_name]]),
+                                        guild_tick.arrivals.get(server_name), guild_tick.approaches.get(server_name, []),
+                                        self.now)
+                results.append((guild, server_name, channels, server_info, engine.detectors.detect(context)))
+            self.add_time("detect", started)
+            for result in results:
+                await out_queue.put(result)
+        await out_queue.put(STAGE_END)
+
+    async def render_stage(self, in_queue, out_queue):
+        """
+        メッセージ作成段階.
+        定例メッセージ(ステータスメッセージ)の内容を作成し、チャンネル毎の送信内容にする.
+        :param in_queue: 判定段階からのキュー
+        :type in_queue: asyncio.Queue
+        :param out_queue: 送信段階へのキュー. (ギルド設定, チャンネル, 定例メッセージ, 警告メッセージのリスト) を入れる.
+        :type out_queue: asyncio.Queue
+        :return: None
+        :rtype: None
+        """
+        while True:
+            item = await in_queue.get()
+            if item is STAGE_END:
+                break
+            guild, server_name, channels, server_info, alerts = item
+            started = time.perf_counter()
+            if server_info is None:
+                body = "{}　データ取得エラー.".format(server_name)
+            else:
+                enemy_players = server_info["enemy_players"]
+                body = "{}　人数:{}　敵:{}人 {}".format(server_name, server_info["player_count"], len(enemy_players),
+                                                   enemy_players)
+            self.add_time("render", started)
+            for channel in channels:
+                await out_queue.put((guild, channel, body, alerts))
+        for i in range(self.__dispatch_workers):
+            await out_queue.put(STAGE_END)
+
+    async def dispatch_stage(self, in_queue):
+        """
+        送信段階.
+        複数のタスクで並列に動かし、1つのチャンネルへの送信は1つのタスクが順番に行う.
+        :param in_queue: メッセージ作成段階からのキュー
+        :type in_queue: asyncio.Queue
+        :return: None
+        :rtype: None
+        """
+        engine = self.engine
+        client = engine.config.client
+        while True:
+            item = await in_queue.get()
+            if item is STAGE_END:
+                break
+            guild, channel, body, alerts = item
+            started = time.perf_counter()
+            if engine.config.live_status:
+                await engine.update_status(guild, channel, body, self.__timestr)
+            else:
+                await Utils.send_message(client, channel, "{}　{}".format(self.__timestr, body))
+            for msg in alerts:
+                await Utils.send_message(client, channel, msg)
+            self.add_time("dispatch", started)
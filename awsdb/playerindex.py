@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+
+from awsdb import consts
+
+
+class PlayerRecord:
+    """
+    プレイヤー所在レコード.
+    プレイヤー数分だけ常駐するため、__slots__ でインスタンス毎の辞書を持たない.
+    """
+
+    __slots__ = ("name", "key", "seen_at")
+
+    def __init__(self, name, key, seen_at):
+        """
+        コンストラクタ.
+        :param name: プレイヤー名
+        :type name: str
+        :param key: 最後に確認した (クラスターID, サーバ名)
+        :type key: tuple
+        :param seen_at: 最終確認時刻(UNIX時間)
+        :type seen_at: float
+        """
+        self.name = name
+        self.key = key
+        self.seen_at = seen_at
+
+
+class PlayerIndex:
+    """
+    プレイヤー所在インデックス.
+    監視エンジンが取得したプレイヤー情報から、プレイヤー名 → (クラスターID, サーバ名, 最終確認時刻) を保持する.
+    プレイヤー名は大文字小文字を区別せず、n-gram の転置インデックスで部分一致検索する.
+    サーバ毎の前回のプレイヤー集合との差分だけを更新するため、取得の度に全件を作り直さない.
+    同じプレイヤーは取得の度に現れるため、プレイヤー名は sys.intern で1つの文字列を使い回す.
+    """
+
+    def __init__(self, gram_size=consts.PLAYER_INDEX_GRAM_SIZE, ttl=consts.PLAYER_INDEX_TTL):
+        """
+        コンストラクタ.
+        :param gram_size: n-gram の文字数
+        :type gram_size: int
+        :param ttl: 最終確認からインデックスに残しておく秒数
+        :type ttl: float
+        """
+        self.__gram_size = gram_size
+        self.__ttl = ttl
+        # 検索用プレイヤー名: プレイヤー所在レコード
+        self.__entries = {}
+        # (クラスターID, サーバ名): 同じ値のキーを使い回すためのキャッシュ
+        self.__keys = {}
+        # (クラスターID, サーバ名): 現在いる検索用プレイヤー名の集合
+        self.__grid_players = {}
+        # n-gram: 検索用プレイヤー名の集合
+        self.__grams = {}
+        self.__pruned_at = time.time()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter_grams(self, folded):
+        size = self.__gram_size
+        if len(folded) < size:
+            return set()
+        return set(folded[i:i + size] for i in range(len(folded) - size + 1))
+
+    def __add(self, folded, name, key, seen_at):
+        self.__entries[folded] = PlayerRecord(name, key, seen_at)
+        for gram in self.__iter_grams(folded):
+            self.__grams.setdefault(gram, set()).add(folded)
+
+    def __remove(self, folded):
+        entry = self.__entries.pop(folded, None)
+        if entry is None:
+            return
+        grid_players = self.__grid_players.get(entry.key)
+        if grid_players is not None:
+            grid_players.discard(folded)
+        for gram in self.__iter_grams(folded):
+            postings = self.__grams.get(gram)
+            if postings is None:
+                continue
+            postings.discard(folded)
+            if not postings:
+                del self.__grams[gram]
+
+    def update(self, cluster_id, server_name, names, seen_at=None):
+        """
+        サーバのプレイヤー一覧でインデックスを更新する.
+        前回から増えたプレイヤーのみ追加・移動し、いなくなったプレイヤーは最終確認時刻のまま残す.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :param server_name: サーバ名
+        :type server_name: str
+        :param names: プレイヤー名のタプル
+        :type names: tuple of str
+        :param seen_at: 確認時刻(UNIX時間). 省略時は現在時刻.
+        :type seen_at: float
+        :return: None
+        :rtype: None
+        """
+        seen_at = seen_at if seen_at is not None else time.time()
+        key = self.__keys.setdefault((cluster_id, server_name), (cluster_id, sys.intern(server_name)))
+        current = {}
+        for name in names:
+            if name:
+                current[sys.intern(name.casefold())] = sys.intern(name)
+
+        entries = self.__entries
+        for folded, name in current.items():
+            entry = entries.get(folded)
+            if entry is None:
+                self.__add(folded, name, key, seen_at)
+            else:
+                if entry.key != key:
+                    moved_from = self.__grid_players.get(entry.key)
+                    if moved_from is not None:
+                        moved_from.discard(folded)
+                entry.name = name
+                entry.key = key
+                entry.seen_at = seen_at
+        self.__grid_players[key] = set(current.keys())
+
+        if self.__ttl < seen_at - self.__pruned_at:
+            self.prune(seen_at)
+
+    def prune(self, now=None):
+        """
+        最終確認から保持期間を過ぎたプレイヤーを削除する.
+        :param now: 現在時刻(UNIX時間). 省略時は現在時刻.
+        :type now: float
+        :return: 削除した件数
+        :rtype: int
+        """
+        now = now if now is not None else time.time()
+        expired = [folded for folded, entry in self.__entries.items() if self.__ttl < now - entry.seen_at]
+        for folded in expired:
+            self.__remove(folded)
+        self.__pruned_at = now
+        return len(expired)
+
+    def search(self, query, cluster_id=None, limit=consts.PLAYER_INDEX_SEARCH_LIMIT):
+        """
+        プレイヤー名の部分一致で所在を検索する.
+        :param query: 検索文字列
+        :type query: str
+        :param cluster_id: 対象クラスターID. 省略時は全クラスター.
+        :type cluster_id: int
+        :param limit: 最大件数
+        :type limit: int
+        :return: (プレイヤー名, サーバ名, 最終確認時刻, 現在いるか) のリスト. 最終確認時刻の新しい順.
+        :rtype: list of tuple
+        """
+        folded_query = query.casefold()
+        if not folded_query:
+            return []
+        grams = self.__iter_grams(folded_query)
+        if grams:
+            postings = sorted((self.__grams.get(gram, set()) for gram in grams), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        else:
+            # n-gram より短い検索文字列は全件から探す
+            candidates = self.__entries.keys()
+
+        ret = []
+        for folded in candidates:
+            if folded_query not in folded:
+                continue
+            entry = self.__entries[folded]
+            if cluster_id is not None and entry.key[0] != cluster_id:
+                continue
+            ret.append((entry.name, entry.key[1], entry.seen_at, folded in self.__grid_players.get(entry.key, ())))
+        ret.sort(key=lambda x: x[2], reverse=True)
+        return ret[:limit]
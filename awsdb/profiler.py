@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import cProfile
+import os
+import pstats
+import time
+from datetime import datetime
+
+from awsdb import consts
+
+
+class TickProfiler:
+    """
+    監視処理(tick)のプロファイル取得クラス.
+    指定回数の tick の間だけ cProfile を有効にし、完了したら pstats ファイルを出力して集計結果を返す.
+    tick 中の await で他のタスク(コマンド処理等)に切り替わった間の処理も同じスレッドで動くため計測に含まれる.
+    """
+
+    def __init__(self, ticks, loop=None):
+        """
+        コンストラクタ.
+        :param ticks: プロファイルを取得する tick の回数
+        :type ticks: int
+        :param loop: イベントループ. 省略時は実行中のイベントループ.
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.__ticks = ticks
+        self.__remaining = ticks
+        self.__profile = cProfile.Profile()
+        self.__elapsed = 0.0
+        self.__future = (loop if loop else asyncio.get_event_loop()).create_future()
+
+    @property
+    def ticks(self):
+        return self.__ticks
+
+    @property
+    def done(self):
+        return self.__future.done()
+
+    async def run(self, tick):
+        """
+        プロファイルを有効にして tick を1回実行する. 指定回数に達したら結果を出力する.
+        :param tick: 監視処理(コルーチン関数)
+        :type tick: function
+        :return: tick の戻り値
+        """
+        started = time.perf_counter()
+        self.__profile.enable()
+        try:
+            return await tick()
+        finally:
+            self.__profile.disable()
+            self.__elapsed += time.perf_counter() - started
+            self.__remaining -= 1
+            if self.__remaining <= 0 and not self.done:
+                self.__finish()
+
+    def cancel(self):
+        """
+        プロファイル取得を中止する.
+        :return: None
+        :rtype: None
+        """
+        if not self.done:
+            self.__future.cancel()
+
+    async def wait(self):
+        """
+        プロファイル取得の完了を待つ.
+        :return: (pstats ファイル名, 集計結果の文字列)
+        :rtype: tuple
+        """
+        return await self.__future
+
+    def __finish(self):
+        """
+        pstats ファイルを出力し、関数毎の実行時間(tottime)の上位を集計する.
+        :return: None
+        :rtype: None
+        """
+        try:
+            os.makedirs(consts.LOG_FOLDER, exist_ok=True)
+            path = os.path.join(consts.LOG_FOLDER, "profile_{}.pstats".format(datetime.now().strftime("%Y%m%d_%H%M%S")))
+            stats = pstats.Stats(self.__profile)
+            stats.dump_stats(path)
+            stats.sort_stats("tottime")
+            ret = ["{}回 合計{:.3f}秒".format(self.__ticks, self.__elapsed),
+                   "{:>8} {:>8} {:>8}  {}".format("tottime", "cumtime", "ncalls", "function")]
+            for func in stats.fcn_list[:consts.PROFILE_TOP_COUNT]:
+                cc, nc, tt, ct, callers = stats.stats[func]
+                file_name, line, func_name = func
+                ret.append("{:8.3f} {:8.3f} {:>8}  {} ({}:{})".format(
+                    tt, ct, nc if nc == cc else "{}/{}".format(nc, cc), func_name, os.path.basename(file_name), line))
+            self.__future.set_result((path, "\n".join(ret)))
+        except Exception as e:
+            self.__future.set_exception(e)
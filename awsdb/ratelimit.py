@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from awsdb import consts
+
+
+class OutboundLimiter:
+    """
+    Discordへの送信(メッセージ送信・チャンネル作成等)の流量制限クラス.
+    同時実行数と1秒あたりの実行回数を制限し、並列に送信しても Discord のレート制限を超えないようにする.
+    """
+
+    def __init__(self, concurrency=consts.OUTBOUND_CONCURRENCY, rate=consts.OUTBOUND_RATE):
+        """
+        コンストラクタ.
+        :param concurrency: 同時実行数の上限
+        :type concurrency: int
+        :param rate: 1秒あたりの実行回数の上限
+        :type rate: float
+        """
+        self.__concurrency = max(1, concurrency)
+        self.__interval = 1 / rate if rate > 0 else 0
+        # セマフォは実行中のイベントループで作成するため初回実行時に作成する
+        self.__semaphore = None
+        self.__next_at = 0
+
+    async def call(self, func, *args, **kwargs):
+        """
+        流量制限の範囲内で送信処理を実行する.
+        :param func: 送信処理(コルーチン関数)
+        :type func: function
+        :return: 送信処理の戻り値
+        """
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__concurrency)
+        async with self.__semaphore:
+            # 実行時刻の枠を先に予約してから待機するため、同時に待機した処理も間隔を空けて実行される
+            now = time.monotonic()
+            wait = self.__next_at - now
+            self.__next_at = max(now, self.__next_at) + self.__interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return await func(*args, **kwargs)
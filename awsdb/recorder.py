@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from awsdb import consts
+
+
+class ResponseRecorder:
+    """
+    Atlas API レスポンス記録クラス.
+    取得したレスポンス本文を取得時刻・URLと合わせて gzip 圧縮した NDJSON(1行1レスポンス)に追記する.
+    ファイルが指定サイズを超えたら新しいファイルに切り替え、古いファイルは指定数を残して削除する.
+    取得は複数スレッドで行われるため、書き込みはロックで直列化する.
+    """
+
+    def __init__(self, folder=consts.RECORD_FOLDER, max_bytes=consts.RECORD_MAX_MB * 1024 * 1024,
+                 keep_files=consts.RECORD_KEEP_FILES):
+        """
+        コンストラクタ.
+        :param folder: 出力フォルダ
+        :type folder: str
+        :param max_bytes: 1ファイルあたりの最大バイト数(圧縮前)
+        :type max_bytes: int
+        :param keep_files: 残すファイル数
+        :type keep_files: int
+        """
+        self.__folder = folder
+        self.__max_bytes = max_bytes
+        self.__keep_files = keep_files
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__written = 0
+
+    def write(self, url, text, fetched_at=None):
+        """
+        レスポンスを1件記録する.
+        :param url: 取得したURL
+        :type url: str
+        :param text: レスポンス本文
+        :type text: str
+        :param fetched_at: 取得時刻(UNIX時間). 省略時は現在時刻.
+        :type fetched_at: float
+        :return: None
+        :rtype: None
+        """
+        line = json.dumps({"t": fetched_at if fetched_at is not None else time.time(), "url": url, "text": text},
+                          ensure_ascii=False) + "\n"
+        data = line.encode("utf-8")
+        with self.__lock:
+            if self.__file is None or self.__max_bytes <= self.__written:
+                self.__rotate()
+            self.__file.write(data)
+            # 異常終了時も途中まで読めるよう、1件毎に圧縮ブロックを区切る
+            self.__file.flush()
+            self.__written += len(data)
+
+    def close(self):
+        """
+        記録中のファイルを閉じる.
+        :return: None
+        :rtype: None
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __rotate(self):
+        if self.__file is not None:
+            self.__file.close()
+        os.makedirs(self.__folder, exist_ok=True)
+        path = os.path.join(self.__folder, "atlas_{}.ndjson.gz".format(datetime.now().strftime("%Y%m%d_%H%M%S_%f")))
+        self.__file = gzip.open(path, "wb")
+        self.__written = 0
+        for old_path in archive_paths(self.__folder)[:-self.__keep_files]:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                print("【WARN 】古い記録ファイルの削除失敗. path={}".format(old_path))
+
+
+def archive_paths(folder=consts.RECORD_FOLDER):
+    """
+    記録ファイルを古い順に取得する.
+    :param folder: 記録フォルダ
+    :type folder: str
+    :return: 記録ファイルのパスのリスト
+    :rtype: list of str
+    """
+    return sorted(glob.glob(os.path.join(folder, "atlas_*.ndjson.gz")))
+
+
+class ReplayFetcher:
+    """
+    記録ファイルから Atlas API レスポンスを再生する取得クラス.
+    AtlasFetcher と同じインタフェースで、通信の代わりに記録済みのレスポンスを返す.
+    記録ファイルは1行ずつ展開しながら読み、URL毎の最新のレスポンスのみ保持するため、
+    記録ファイルの大きさに関わらず使用メモリは一定.
+    """
+
+    def __init__(self, paths):
+        """
+        コンストラクタ.
+        :param paths: 記録ファイルのパスのリスト(古い順)
+        :type paths: list of str
+        """
+        self.__paths = paths
+        # URL: 現在のフレームまでで最新のレスポンス本文
+        self.__responses = {}
+
+    def __records(self):
+        """
+        記録ファイルを先頭から1件ずつ読み込む.
+        書き込み途中で終了したファイルは読み込めたところまでを使う.
+        :return: {"t": 取得時刻, "url": URL, "text": レスポンス本文} のジェネレータ
+        :rtype: generator
+        """
+        for path in self.__paths:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        if line.endswith("\n"):
+                            yield json.loads(line)
+            except (EOFError, OSError, ValueError) as e:
+                print("【WARN 】記録ファイルの読み込みを途中で終了. path={}".format(path))
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+
+    def frames(self):
+        """
+        記録を監視1回分(フレーム)ずつ読み進める.
+        同じクラスター情報のURLが再び現れた所を次の監視の開始とみなす.
+        ジェネレータが値を返した時点で、そのフレームまでのレスポンスを get_text で取得できる.
+        :return: フレームの開始時刻(UNIX時間)のジェネレータ
+        :rtype: generator
+        """
+        frame_urls = set()
+        started_at = None
+        for record in self.__records():
+            url = record["url"]
+            if url in frame_urls and is_cluster_url(url):
+                yield started_at
+                frame_urls = set()
+            if not frame_urls:
+                started_at = record["t"]
+            frame_urls.add(url)
+            self.__responses[url] = record["text"]
+        if frame_urls:
+            yield started_at
+
+    async def get_text(self, url):
+        return self.__responses.get(url, "")
+
+    async def fetch_cluster(self, cluster_id):
+        text = await self.get_text(consts.URL_CLUSTER_SERVER.format(cluster_id))
+        if not text:
+            return None
+        return json.loads(text)
+
+    async def fetch_players_text(self, server_id):
+        return await self.get_text(consts.URL_SERVER_PLAYER.format(server_id))
+
+    async def fetch_players(self, server_id):
+        text = await self.fetch_players_text(server_id)
+        if not text:
+            return None
+        return json.loads(text)
+
+
+def is_cluster_url(url):
+    """
+    クラスター情報のURLか.
+    :param url: URL
+    :type url: str
+    :rtype: bool
+    """
+    return url.startswith(consts.URL_CLUSTER_SERVER.split("{")[0])
+
+
+async def replay(engine, guild, fetcher, speed=consts.REPLAY_SPEED, on_frame=None):
+    """
+    記録ファイルを再生し、フレーム毎にギルドの判定を実行する.
+    フレーム間の待機時間は記録時の間隔を speed 倍速にしたもの.
+    監視報告チャンネルに送信しないよう、engine は HeadlessPipeline 等の出力先を指定して作成すること.
+    :param engine: 再生用の監視エンジン(ReplayFetcher を指定して作成したもの)
+    :type engine: awsdb.watcher.WatchEngine
+    :param guild: 再生用のギルドの設定
+    :type guild: awsdb.store.GuildConfig
+    :param fetcher: 再生用の取得インスタンス
+    :type fetcher: ReplayFetcher
+    :param speed: 再生速度(倍速)
+    :type speed: float
+    :param on_frame: フレームの判定前に呼び出す関数. 引数は (フレーム番号, フレームの開始時刻).
+    :type on_frame: function
+    :return: 再生したフレーム数
+    :rtype: int
+    """
+    count = 0
+    last_at = None
+    for started_at in fetcher.frames():
+        if last_at is not None and 0 < speed:
+            await asyncio.sleep(max(0.0, (started_at - last_at) / speed))
+        last_at = started_at
+        count += 1
+        if on_frame is not None:
+            on_frame(count, started_at)
+        await engine.process([guild])
+    return count
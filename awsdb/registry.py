@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from discord import ChannelType, Client, Server
+
+from awsdb import consts
+from awsdb.utils import Utils
+
+
+class ChannelRegistry:
+    """
+    監視報告チャンネル管理クラス.
+    Discordサーバ(ギルド)のチャンネルを走査し、(クラスターID, サーバ名) 毎に購読チャンネルをまとめる.
+    同じグリッドを複数ギルドが監視していても、取得は1回で済ませて各チャンネルへ配信する.
+    """
+
+    def __init__(self):
+        self.__subscriptions = {}
+        self.__guild_channels = {}
+        self.__cmd_channels = {}
+
+    def refresh(self, client, cluster_of, is_target=None):
+        """
+        クライアントが参加している全ギルドのチャンネルから購読情報を作り直す.
+        :param client: Discordクライアント
+        :type client: Client
+        :param cluster_of: ギルドから監視クラスターIDを返す関数
+        :type cluster_of: function
+        :param is_target: 購読対象とするギルドか判定する関数. 省略時は全ギルド.
+        :type is_target: function
+        :return: None
+        :rtype: None
+        """
+        subscriptions = {}
+        guild_channels = {}
+        cmd_channels = {}
+        if client:
+            for server in client.servers:
+                if not server:
+                    continue
+                if is_target and not is_target(server):
+                    continue
+                cluster_id = cluster_of(server)
+                for channel in server.channels:
+                    if not channel or ChannelType.text != channel.type:
+                        continue
+                    channel_name = channel.name.upper()
+                    if channel_name == consts.CMD_CHANNEL_NAME:
+                        cmd_channels[str(server.id)] = channel
+                        continue
+                    if not Utils.exists_server_name(channel_name):
+                        continue
+                    key = (cluster_id, channel_name)
+                    subscriptions.setdefault(key, []).append(channel)
+                    guild_channels.setdefault(str(server.id), []).append((key, channel))
+        self.__subscriptions = subscriptions
+        self.__guild_channels = guild_channels
+        self.__cmd_channels = cmd_channels
+
+    @property
+    def keys(self):
+        """
+        購読されている (クラスターID, サーバ名) のリスト.
+        :rtype: list of tuple
+        """
+        return list(self.__subscriptions.keys())
+
+    def grids_by_cluster(self):
+        """
+        クラスターID毎に購読されているサーバ名をまとめる.
+        :return: クラスターIDとサーバ名リストの辞書
+        :rtype: dict of (int, list of str)
+        """
+        ret = {}
+        for cluster_id, server_name in self.__subscriptions:
+            ret.setdefault(cluster_id, []).append(server_name)
+        return ret
+
+    def channels(self, key):
+        """
+        指定した (クラスターID, サーバ名) を購読しているチャンネルのリストを取得する.
+        :param key: (クラスターID, サーバ名)
+        :type key: tuple
+        :return: チャンネルのリスト
+        :rtype: list of Channel
+        """
+        return self.__subscriptions.get(key, [])
+
+    def guild_channels(self, guild_id):
+        """
+        ギルドの監視報告チャンネルを取得する.
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :return: ((クラスターID, サーバ名), チャンネル) のリスト
+        :rtype: list of tuple
+        """
+        return self.__guild_channels.get(str(guild_id), [])
+
+    def cmd_channel(self, server):
+        """
+        ギルドのBot用コマンドチャンネルを取得する.
+        :param server: Discordのサーバ(ギルド)インスタンス
+        :type server: Server
+        :return: チャンネル. 存在しない場合は None.
+        :rtype: Channel
+        """
+        return self.guild_cmd_channel(server.id)
+
+    def guild_cmd_channel(self, guild_id):
+        """
+        ギルドIDからBot用コマンドチャンネルを取得する.
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :return: チャンネル. 存在しない場合は None.
+        :rtype: Channel
+        """
+        return self.__cmd_channels.get(str(guild_id))
+
+    @property
+    def cmd_channels(self):
+        return list(self.__cmd_channels.values())
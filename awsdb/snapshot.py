@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+import time
+
+from awsdb import consts
+
+# ファイル形式
+#   ヘッダ: マジック(4byte) バージョン(u8) 保存時刻(f64) ギルド数(u16)
+#   ギルド毎: ギルドID(str) 監視ワールド(u8) 監視中フラグ(u8)
+#     前回サーバ情報: 件数(u16) + [サーバ名(str) 人数(i32)] * 件数
+#     警告状態: 件数(u16) + [サーバ名(str) 種別(str) 最終通知時刻(f64) メンバー数(u16)
+#               + [メンバー(str) 続けて確認できなかった回数(u8)] * メンバー数] * 件数
+#   str は 長さ(u16) + UTF-8 バイト列
+SNAPSHOT_MAGIC = b"ASWS"
+SNAPSHOT_VERSION = 4
+_HEADER = struct.Struct("<4sBdH")
+_GUILD_HEADER = struct.Struct("<BB")
+_COUNT = struct.Struct("<H")
+_PLAYER_COUNT = struct.Struct("<i")
+_SENT_AT = struct.Struct("<d")
+_MISSES = struct.Struct("<B")
+_STR_LEN = struct.Struct("<H")
+
+
+class WatchSnapshot:
+    """
+    監視状態のスナップショット.
+    監視エンジンのギルド毎の状態を tick 毎にバイナリで保存し、起動時に読み込んで監視を引き継ぐ.
+    ギルド毎の状態は以下のキーを持つ辞書.
+      guild_id, watch_world, is_watch_started, last_player_counts(サーバ名: 人数), alerts(AlertTracker.to_records() の値)
+    """
+
+    def __init__(self, guilds, saved_at=None):
+        """
+        コンストラクタ.
+        :param guilds: ギルド毎の監視状態のリスト
+        :type guilds: list of dict
+        :param saved_at: 保存時刻(UNIX時間). 省略時は現在時刻.
+        :type saved_at: float
+        """
+        self.guilds = guilds
+        self.saved_at = saved_at if saved_at is not None else time.time()
+
+    def is_fresh(self, max_age):
+        """
+        スナップショットが指定秒数以内に保存されたものか.
+        :param max_age: 許容する経過秒数
+        :type max_age: float
+        :return: 判定結果
+        :rtype: bool
+        """
+        return time.time() - self.saved_at <= max_age
+
+    def to_bytes(self):
+        """
+        バイト列に変換する.
+        :return: スナップショットのバイト列
+        :rtype: bytes
+        """
+        buf = bytearray()
+        buf += _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.saved_at, len(self.guilds))
+        for guild in self.guilds:
+            buf += _pack_str(str(guild["guild_id"]))
+            buf += _GUILD_HEADER.pack(guild["watch_world"], 1 if guild["is_watch_started"] else 0)
+            buf += _COUNT.pack(len(guild["last_player_counts"]))
+            for server_name, player_count in guild["last_player_counts"].items():
+                buf += _pack_str(server_name)
+                buf += _PLAYER_COUNT.pack(player_count if player_count is not None else -1)
+            buf += _COUNT.pack(len(guild["alerts"]))
+            for server_name, kind, last_sent, members in guild["alerts"]:
+                buf += _pack_str(server_name)
+                buf += _pack_str(kind)
+                buf += _SENT_AT.pack(last_sent)
+                buf += _COUNT.pack(len(members))
+                for member, misses in members:
+                    buf += _pack_str(member)
+                    buf += _MISSES.pack(min(misses, 255))
+        return bytes(buf)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        バイト列からスナップショットを復元する.
+        :param data: スナップショットのバイト列
+        :type data: bytes
+        :return: スナップショット
+        :rtype: WatchSnapshot
+        """
+        magic, version = struct.unpack_from("<4sB", data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("スナップショットの形式が不正です.")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("未対応のスナップショットバージョンです. version:{}".format(version))
+        magic, version, saved_at, guild_count = _HEADER.unpack_from(data, 0)
+        offset = _HEADER.size
+        guilds = []
+        for _ in range(guild_count):
+            guild_id, offset = _unpack_str(data, offset)
+            watch_world, started = _GUILD_HEADER.unpack_from(data, offset)
+            offset += _GUILD_HEADER.size
+            last_player_counts = {}
+            (count,) = _COUNT.unpack_from(data, offset)
+            offset += _COUNT.size
+            for _ in range(count):
+                server_name, offset = _unpack_str(data, offset)
+                (player_count,) = _PLAYER_COUNT.unpack_from(data, offset)
+                offset += _PLAYER_COUNT.size
+                last_player_counts[server_name] = player_count if player_count >= 0 else None
+            alerts = []
+            (count,) = _COUNT.unpack_from(data, offset)
+            offset += _COUNT.size
+            for _ in range(count):
+                server_name, offset = _unpack_str(data, offset)
+                kind, offset = _unpack_str(data, offset)
+                (last_sent,) = _SENT_AT.unpack_from(data, offset)
+                offset += _SENT_AT.size
+                (member_count,) = _COUNT.unpack_from(data, offset)
+                offset += _COUNT.size
+                members = []
+                for _ in range(member_count):
+                    member, offset = _unpack_str(data, offset)
+                    (misses,) = _MISSES.unpack_from(data, offset)
+                    offset += _MISSES.size
+                    members.append((member, misses))
+                alerts.append((server_name, kind, last_sent, members))
+            guilds.append({
+                "guild_id": guild_id,
+                "watch_world": watch_world,
+                "is_watch_started": started == 1,
+                "last_player_counts": last_player_counts,
+                "alerts": alerts
+            })
+        return cls(guilds, saved_at)
+
+    def save(self, path=consts.SNAPSHOT_FILE_NAME):
+        """
+        ファイルに保存する.
+        一時ファイルに書き込んでから置き換えるため、書き込み途中で落ちても前回の内容が残る.
+        :param path: 保存先ファイルパス
+        :type path: str
+        :return: None
+        :rtype: None
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=consts.SNAPSHOT_FILE_NAME):
+        """
+        ファイルから読み込む.
+        :param path: 読み込むファイルパス
+        :type path: str
+        :return: スナップショット. ファイルが存在しない場合は None.
+        :rtype: WatchSnapshot
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+def _pack_str(val):
+    data = val.encode('utf-8')
+    if len(data) > 0xFFFF:
+        # マルチバイト文字の途中で切らないよう、文字の境界で切り詰める
+        data = data[:0xFFFF].decode('utf-8', 'ignore').encode('utf-8')
+    return _STR_LEN.pack(len(data)) + data
+
+
+def _unpack_str(data, offset):
+    (length,) = _STR_LEN.unpack_from(data, offset)
+    offset += _STR_LEN.size
+    return data[offset:offset + length].decode('utf-8'), offset + length
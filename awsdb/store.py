@@ -0,0 +1,659 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+import threading
+import traceback
+
+from awsdb import consts
+from awsdb.alerts import ALERT_ENEMY, AlertTracker
+from awsdb.matcher import EnemyMatcher
+
+
+class GuildConfig:
+    """
+    Discordサーバ(ギルド)毎の設定と監視状態.
+    設定値を変更すると GuildConfigStore に変更を通知し、まとめて後から書き込む.
+    敵プレイヤーは件数が多くなり得るため、初めて参照した時にDBから読み込む.
+    ステータスメッセージ(チャンネル毎に編集し続けるメッセージ)のIDと内容も同様に初めて参照した時に読み込む.
+    """
+
+    def __init__(self, store, guild_id, watch_world, watch_interval, player_sbn_count, company_alert_count):
+        """
+        コンストラクタ.
+        :param store: ギルド設定ストア
+        :type store: GuildConfigStore
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :param watch_world: 監視ワールド
+        :type watch_world: int
+        :param watch_interval: 監視間隔(秒)
+        :type watch_interval: int
+        :param player_sbn_count: 通知対象プレイヤー増加数
+        :type player_sbn_count: int
+        :param company_alert_count: 通知対象カンパニー集結人数(0: 通知しない)
+        :type company_alert_count: int
+        """
+        self.__store = store
+        self.__guild_id = guild_id
+        self.__watch_world = watch_world
+        self.__watch_interval = watch_interval
+        self.__player_sbn_count = player_sbn_count
+        self.__company_alert_count = company_alert_count
+        self.__enemy_list = None
+        self.__enemy_changes = {}
+        self.__status_messages = None
+        self.__status_changes = {}
+        self.__is_watch_started = False
+        self.__last_servers_info = {}
+        self.__alerts = AlertTracker()
+        self.__next_due = 0.0
+        self.__matcher = None
+        self.__matcher_shared = None
+        self.__enemies = None
+        self.__companies = None
+
+    @property
+    def guild_id(self):
+        return self.__guild_id
+
+    @property
+    def watch_world(self):
+        return self.__watch_world
+
+    @watch_world.setter
+    def watch_world(self, watch_world):
+        self.__watch_world = watch_world
+        self.__store.mark_dirty(self)
+
+    @property
+    def watch_interval(self):
+        return self.__watch_interval
+
+    @watch_interval.setter
+    def watch_interval(self, watch_interval):
+        self.__watch_interval = watch_interval
+        self.__store.mark_dirty(self)
+
+    @property
+    def player_sbn_count(self):
+        return self.__player_sbn_count
+
+    @player_sbn_count.setter
+    def player_sbn_count(self, player_sbn_count):
+        self.__player_sbn_count = player_sbn_count if player_sbn_count >= 3 else 3
+        self.__store.mark_dirty(self)
+
+    @property
+    def company_alert_count(self):
+        return self.__company_alert_count
+
+    @company_alert_count.setter
+    def company_alert_count(self, company_alert_count):
+        self.__company_alert_count = company_alert_count if company_alert_count <= 0 or 2 <= company_alert_count else 2
+        self.__store.mark_dirty(self)
+
+    @property
+    def enemy_list(self):
+        """
+        ギルド独自の敵プレイヤー(プレイヤー名: カンパニー名).
+        :rtype: dict
+        """
+        if self.__enemy_list is None:
+            self.__enemy_list = self.__store.load_enemies(self.guild_id)
+        return self.__enemy_list
+
+    @property
+    def shared_enemy_list(self):
+        """
+        settings.ini で全ギルド共通に設定された敵プレイヤー.
+        :rtype: dict
+        """
+        return self.__store.shared_enemy_list
+
+    @property
+    def enemies(self):
+        """
+        監視に使用する敵プレイヤー(共通 + ギルド独自).
+        :rtype: dict
+        """
+        self.__refresh_index()
+        return self.__enemies
+
+    @property
+    def matcher(self):
+        """
+        監視に使用する敵プレイヤーの判定インスタンス.
+        敵プレイヤーが変更されるまで構築済みのものを使い回す.
+        :rtype: EnemyMatcher
+        """
+        self.__refresh_index()
+        return self.__matcher
+
+    @property
+    def companies(self):
+        """
+        カンパニー名から所属する敵プレイヤー名を引く逆引きインデックス.
+        カンパニー名のない敵プレイヤーは含まない.
+        :rtype: dict of (str, list of str)
+        """
+        self.__refresh_index()
+        return self.__companies
+
+    def __refresh_index(self):
+        """
+        敵プレイヤーが変更されていれば、監視用の敵プレイヤー・判定インスタンス・カンパニー逆引きを作り直す.
+        共通の敵プレイヤーが変わってもこのギルドの敵プレイヤー名の組み合わせが変わらない場合(カンパニー名のみの変更、
+        ギルド独自の敵プレイヤーと重複する名前の追加・削除)は判定インスタンスを使い続ける.
+        :return: None
+        :rtype: None
+        """
+        if self.__matcher is not None and self.__matcher_shared is self.shared_enemy_list:
+            return
+        self.__matcher_shared = self.shared_enemy_list
+        enemies = dict(self.shared_enemy_list)
+        enemies.update(self.enemy_list)
+        companies = {}
+        for name, company in enemies.items():
+            if company:
+                companies.setdefault(company, []).append(name)
+        if self.__matcher is None or self.__enemies is None or enemies.keys() != self.__enemies.keys():
+            self.__matcher = self.__store.matcher_for(enemies.keys())
+        self.__enemies = enemies
+        self.__companies = companies
+
+    def add_enemy(self, name, company):
+        """
+        敵プレイヤーを追加する.
+        :param name: プレイヤー名(Steam名)
+        :type name: str
+        :param company: カンパニー名
+        :type company: str
+        :return: 処理結果(True: 追加成功, False: 既に存在するプレイヤー名がある等で追加失敗)
+        :rtype: bool
+        """
+        if name in self.enemy_list:
+            return False
+        self.enemy_list[name] = company.strip() if company else ""
+        self.__enemy_changes[name] = self.enemy_list[name]
+        self.__matcher = None
+        self.__store.mark_dirty(self)
+        return True
+
+    def del_enemy(self, name):
+        """
+        敵プレイヤーを削除する.
+        :param name: プレイヤー名(Steam名)
+        :type name: str
+        :return: 処理結果(True: 削除成功, False: 存在しないプレイヤー名等で削除失敗)
+        :rtype: bool
+        """
+        if name not in self.enemy_list:
+            return False
+        self.enemy_list.pop(name)
+        self.__enemy_changes[name] = None
+        self.__matcher = None
+        self.__store.mark_dirty(self)
+        return True
+
+    def apply_import(self, enemies):
+        """
+        DBに一括登録済みの敵プレイヤーをメモリに反映する.
+        判定インスタンスは一括変更につき1回だけ作り直す.
+        :param enemies: 登録した敵プレイヤー(プレイヤー名: カンパニー名)
+        :type enemies: dict
+        :return: None
+        :rtype: None
+        """
+        self.enemy_list.update(enemies)
+        for name in enemies:
+            self.__enemy_changes.pop(name, None)
+        self.__matcher = None
+
+    def take_enemy_changes(self):
+        """
+        未書き込みの敵プレイヤーの変更を取り出す.
+        :return: プレイヤー名: カンパニー名(削除の場合は None)
+        :rtype: dict
+        """
+        ret = self.__enemy_changes
+        self.__enemy_changes = {}
+        return ret
+
+    def list_enemy(self):
+        """
+        敵プレイヤー一覧をカンパニー毎にまとめた文字列で取得する.
+        :return: 敵プレイヤー一覧
+        :rtype: str
+        """
+        ret = []
+        companies = self.companies
+        for company in sorted(companies):
+            ret.append("[{}] {}".format(company, ", ".join(sorted(companies[company]))))
+        no_company = sorted(name for name, company in self.enemies.items() if not company)
+        if no_company:
+            ret.append("[カンパニーなし] {}".format(", ".join(no_company)))
+        return "\n".join(ret)
+
+    @property
+    def status_messages(self):
+        """
+        チャンネルID: [ステータスメッセージID, 内容].
+        :rtype: dict
+        """
+        if self.__status_messages is None:
+            self.__status_messages = self.__store.load_status_messages(self.guild_id)
+        return self.__status_messages
+
+    def status_message(self, channel_id):
+        """
+        チャンネルのステータスメッセージを取得する.
+        :param channel_id: チャンネルID
+        :type channel_id: str
+        :return: (ステータスメッセージID, 内容). 作成していない場合は None.
+        :rtype: tuple
+        """
+        record = self.status_messages.get(str(channel_id))
+        return tuple(record) if record else None
+
+    def set_status_message(self, channel_id, message_id, content):
+        """
+        チャンネルのステータスメッセージを記録する.
+        :param channel_id: チャンネルID
+        :type channel_id: str
+        :param message_id: ステータスメッセージID
+        :type message_id: str
+        :param content: 内容
+        :type content: str
+        :return: None
+        :rtype: None
+        """
+        record = [str(message_id), content]
+        self.status_messages[str(channel_id)] = record
+        self.__status_changes[str(channel_id)] = record
+        self.__store.mark_dirty(self)
+
+    def take_status_changes(self):
+        """
+        未書き込みのステータスメッセージの変更を取り出す.
+        :return: チャンネルID: [ステータスメッセージID, 内容]
+        :rtype: dict
+        """
+        ret = self.__status_changes
+        self.__status_changes = {}
+        return ret
+
+    def restore_changes(self, enemy_changes, status_changes):
+        """
+        書き込みに失敗した変更を未書き込みに戻す. 取り出した後に行われた変更があればそちらを優先する.
+        :param enemy_changes: take_enemy_changes() で取り出した変更
+        :type enemy_changes: dict
+        :param status_changes: take_status_changes() で取り出した変更
+        :type status_changes: dict
+        :return: None
+        :rtype: None
+        """
+        for name, company in enemy_changes.items():
+            self.__enemy_changes.setdefault(name, company)
+        for channel_id, record in status_changes.items():
+            self.__status_changes.setdefault(channel_id, record)
+
+    @property
+    def is_watch_started(self):
+        return self.__is_watch_started
+
+    @is_watch_started.setter
+    def is_watch_started(self, val):
+        self.__is_watch_started = val
+
+    @property
+    def last_servers_info(self):
+        return self.__last_servers_info
+
+    @last_servers_info.setter
+    def last_servers_info(self, val):
+        self.__last_servers_info = val
+
+    @property
+    def alerts(self):
+        """
+        サーバ・警告の種別毎の警告状態.
+        :rtype: AlertTracker
+        """
+        return self.__alerts
+
+    @property
+    def enemy_notice_server_names(self):
+        """
+        ブラックリストの侵入を通知済みのサーバ名のリスト.
+        :rtype: list of str
+        """
+        return self.__alerts.active_server_names(ALERT_ENEMY)
+
+    @property
+    def next_due(self):
+        """
+        次回監視予定時刻(time.monotonic() の値).
+        :rtype: float
+        """
+        return self.__next_due
+
+    @next_due.setter
+    def next_due(self, val):
+        self.__next_due = val
+
+    def clear_state(self):
+        """
+        監視状態を初期化する.
+        :return: None
+        :rtype: None
+        """
+        self.__last_servers_info = {}
+        self.__alerts.clear()
+        self.__next_due = 0.0
+
+    def to_row(self):
+        """
+        DB書き込み用の行データに変換する.
+        :return: 行データ
+        :rtype: tuple
+        """
+        return self.guild_id, self.watch_world, self.watch_interval, self.player_sbn_count, self.company_alert_count
+
+
+class GuildConfigStore:
+    """
+    ギルド設定ストア.
+    SQLite に保存し、読み込んだ設定はメモリにキャッシュする(リードスルー).
+    変更は変更済みとして記録するだけで、flush() でまとめて書き込む(ライトビハインド).
+    敵プレイヤーは (ギルドID, プレイヤー名) を主キーとした専用テーブルに1件1行で保存する.
+    """
+
+    def __init__(self, defaults, path=consts.GUILD_DB_FILE_NAME):
+        """
+        コンストラクタ.
+        :param defaults: 新規ギルドの初期値と共通の敵プレイヤーを提供するコンフィグ管理インスタンス
+        :type defaults: ASWDConfig
+        :param path: DBファイルパス
+        :type path: str
+        """
+        self.__defaults = defaults
+        self.__cache = {}
+        # 識別子: 判定インスタンス
+        self.__matchers = {}
+        self.__dirty = {}
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute(
+                    "CREATE TABLE IF NOT EXISTS guilds ("
+                    " guild_id TEXT PRIMARY KEY,"
+                    " watch_world INTEGER NOT NULL,"
+                    " watch_interval INTEGER NOT NULL,"
+                    " player_sbn_count INTEGER NOT NULL,"
+                    " company_alert_count INTEGER NOT NULL DEFAULT {})".format(consts.COMPANY_ALERT_COUNT))
+                self.__conn.execute(
+                    "CREATE TABLE IF NOT EXISTS enemies ("
+                    " guild_id TEXT NOT NULL,"
+                    " name TEXT NOT NULL,"
+                    " company TEXT NOT NULL,"
+                    " PRIMARY KEY (guild_id, name)) WITHOUT ROWID")
+                self.__conn.execute(
+                    "CREATE TABLE IF NOT EXISTS status_messages ("
+                    " guild_id TEXT NOT NULL,"
+                    " channel_id TEXT NOT NULL,"
+                    " message_id TEXT NOT NULL,"
+                    " content TEXT NOT NULL,"
+                    " PRIMARY KEY (guild_id, channel_id)) WITHOUT ROWID")
+
+    @property
+    def shared_enemy_list(self):
+        return self.__defaults.enemy_list
+
+    def matcher_for(self, patterns):
+        """
+        敵プレイヤー名の組み合わせに対応する判定インスタンスを取得する.
+        同じ組み合わせのギルド(ギルド独自の敵プレイヤーがないギルド等)では構築済みのものを共有し、
+        共通の敵プレイヤーが変わった時の作り直しを組み合わせ毎に1回で済ませる.
+        :param patterns: 敵プレイヤー名のリスト
+        :type patterns: collections.abc.Iterable of str
+        :return: 判定インスタンス
+        :rtype: EnemyMatcher
+        """
+        patterns = EnemyMatcher.normalize(patterns)
+        key = EnemyMatcher.key_of(patterns)
+        matcher = self.__matchers.get(key)
+        if matcher is None:
+            if len(self.__matchers) >= consts.ENEMY_MATCHER_CACHE_SIZE:
+                self.__matchers.clear()
+            matcher = EnemyMatcher(patterns)
+            self.__matchers[key] = matcher
+        return matcher
+
+    def get(self, server):
+        """
+        ギルドの設定を取得する.
+        :param server: Discordのサーバ(ギルド)インスタンス
+        :type server: Server
+        :return: ギルド設定
+        :rtype: GuildConfig
+        """
+        return self.get_by_id(server.id)
+
+    def get_by_id(self, guild_id):
+        """
+        ギルドIDから設定を取得する.
+        キャッシュになければDBから読み込み、DBにもなければ settings.ini の値で作成する.
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :return: ギルド設定
+        :rtype: GuildConfig
+        """
+        guild_id = str(guild_id)
+        guild = self.__cache.get(guild_id)
+        if guild:
+            return guild
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT watch_world, watch_interval, player_sbn_count, company_alert_count"
+                " FROM guilds WHERE guild_id = ?", (guild_id,)).fetchone()
+        if row:
+            guild = GuildConfig(self, guild_id, row[0], row[1], row[2], row[3])
+        else:
+            guild = GuildConfig(self, guild_id, self.__defaults.watch_world, self.__defaults.watch_interval,
+                                self.__defaults.player_sbn_count, self.__defaults.company_alert_count)
+            self.mark_dirty(guild)
+        self.__cache[guild_id] = guild
+        return guild
+
+    def load_enemies(self, guild_id):
+        """
+        ギルドの敵プレイヤーをDBから読み込む.
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :return: 敵プレイヤー(プレイヤー名: カンパニー名)
+        :rtype: dict
+        """
+        with self.__lock:
+            return dict(self.__conn.execute(
+                "SELECT name, company FROM enemies WHERE guild_id = ?", (guild_id,)).fetchall())
+
+    def load_status_messages(self, guild_id):
+        """
+        ギルドのステータスメッセージをDBから読み込む.
+        :param guild_id: ギルドID
+        :type guild_id: str
+        :return: チャンネルID: [ステータスメッセージID, 内容]
+        :rtype: dict
+        """
+        with self.__lock:
+            return dict((channel_id, [message_id, content]) for channel_id, message_id, content in self.__conn.execute(
+                "SELECT channel_id, message_id, content FROM status_messages WHERE guild_id = ?",
+                (guild_id,)).fetchall())
+
+    async def import_enemies(self, guild, entries, loop=None):
+        """
+        敵プレイヤーを一括登録する.
+        重複はプレイヤー名で除き(後勝ち)、1トランザクションで書き込んでからメモリに反映する.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :param entries: (プレイヤー名, カンパニー名) のリスト
+        :type entries: list of tuple
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: 登録した件数
+        :rtype: int
+        """
+        enemies = {}
+        for name, company in entries:
+            if name:
+                enemies[name] = company.strip() if company else ""
+        if not enemies:
+            return 0
+        rows = [(guild.guild_id, name, company) for name, company in enemies.items()]
+        loop = loop if loop else asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.__write, [], rows, [])
+        guild.apply_import(enemies)
+        return len(enemies)
+
+    @property
+    def cached(self):
+        """
+        キャッシュ済みのギルド設定のリスト.
+        :rtype: list of GuildConfig
+        """
+        return list(self.__cache.values())
+
+    def started(self):
+        """
+        監視中のギルド設定のリストを取得する.
+        :return: ギルド設定のリスト
+        :rtype: list of GuildConfig
+        """
+        return [guild for guild in self.__cache.values() if guild.is_watch_started]
+
+    def mark_dirty(self, guild):
+        """
+        ギルド設定を変更済みとして記録する.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :return: None
+        :rtype: None
+        """
+        self.__dirty[guild.guild_id] = guild
+
+    def __take_dirty(self):
+        """
+        変更済みのギルド設定と未書き込みの変更を取り出す.
+        :return: (ギルド設定, 敵プレイヤーの変更, ステータスメッセージの変更) のリスト
+        :rtype: list of tuple
+        """
+        taken = [(guild, guild.take_enemy_changes(), guild.take_status_changes()) for guild in self.__dirty.values()]
+        self.__dirty = {}
+        return taken
+
+    def __restore_dirty(self, taken):
+        """
+        書き込みに失敗した変更を変更済みに戻し、次回の書き込みで再度書き込む.
+        :param taken: __take_dirty() で取り出した変更
+        :type taken: list of tuple
+        :return: None
+        :rtype: None
+        """
+        for guild, enemy_changes, status_changes in taken:
+            guild.restore_changes(enemy_changes, status_changes)
+            self.__dirty.setdefault(guild.guild_id, guild)
+
+    @staticmethod
+    def __to_rows(taken):
+        """
+        取り出した変更を書き込み用の行データに変換する.
+        :param taken: __take_dirty() で取り出した変更
+        :type taken: list of tuple
+        :return: (ギルド設定の行, 敵プレイヤー登録の行, 敵プレイヤー削除の行, ステータスメッセージの行)
+        :rtype: tuple
+        """
+        settings_rows = []
+        upsert_rows = []
+        delete_rows = []
+        status_rows = []
+        for guild, enemy_changes, status_changes in taken:
+            settings_rows.append(guild.to_row())
+            for name, company in enemy_changes.items():
+                if company is None:
+                    delete_rows.append((guild.guild_id, name))
+                else:
+                    upsert_rows.append((guild.guild_id, name, company))
+            for channel_id, record in status_changes.items():
+                status_rows.append((guild.guild_id, channel_id, record[0], record[1]))
+        return settings_rows, upsert_rows, delete_rows, status_rows
+
+    def flush(self):
+        """
+        変更済みのギルド設定を1トランザクションで書き込む.
+        書き込みに失敗した場合は変更済みに戻してから例外を送出する.
+        :return: 書き込んだギルド数
+        :rtype: int
+        """
+        if not self.__dirty:
+            return 0
+        taken = self.__take_dirty()
+        try:
+            self.__write(*self.__to_rows(taken))
+        except Exception:
+            self.__restore_dirty(taken)
+            raise
+        return len(taken)
+
+    async def flush_async(self, loop=None):
+        """
+        変更済みのギルド設定をスレッドプールで書き込む.
+        行データへの変換はイベントループ側で行い、書き込み中の変更は次回に回す.
+        書き込みに失敗した場合は変更済みに戻してから例外を送出する.
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: 書き込んだギルド数
+        :rtype: int
+        """
+        if not self.__dirty:
+            return 0
+        taken = self.__take_dirty()
+        loop = loop if loop else asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.__write, *self.__to_rows(taken))
+        except Exception:
+            self.__restore_dirty(taken)
+            raise
+        return len(taken)
+
+    async def run_flusher(self, loop=None):
+        """
+        一定間隔で変更済みのギルド設定を書き込み続ける.
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: None
+        :rtype: None
+        """
+        while True:
+            await asyncio.sleep(consts.GUILD_FLUSH_INTERVAL)
+            try:
+                await self.flush_async(loop)
+            except Exception as e:
+                print("【エラー】ギルド設定の書き込み失敗.")
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+
+    def __write(self, settings_rows, upsert_rows, delete_rows, status_rows=()):
+        with self.__lock:
+            with self.__conn:
+                self.__conn.executemany(
+                    "INSERT OR REPLACE INTO guilds"
+                    " (guild_id, watch_world, watch_interval, player_sbn_count, company_alert_count)"
+                    " VALUES (?, ?, ?, ?, ?)", settings_rows)
+                self.__conn.executemany(
+                    "INSERT OR REPLACE INTO enemies (guild_id, name, company) VALUES (?, ?, ?)", upsert_rows)
+                self.__conn.executemany(
+                    "DELETE FROM enemies WHERE guild_id = ? AND name = ?", delete_rows)
+                self.__conn.executemany(
+                    "INSERT OR REPLACE INTO status_messages (guild_id, channel_id, message_id, content)"
+                    " VALUES (?, ?, ?, ?)", status_rows)
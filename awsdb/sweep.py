@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from awsdb import consts
+from awsdb.fetcher import AtlasFetcher
+from awsdb.matcher import match_names
+from awsdb.utils import ASWDConfig, Utils
+from awsdb.watcher import WatchEngine
+
+
+class BlacklistSweeper:
+    """
+    全サーバ巡回クラス.
+    監視報告チャンネルのないサーバも含め、監視ワールドの全サーバ(A1～O15)を順番に巡回して敵プレイヤーを探す.
+    1分間の取得回数を sweep_budget 以下に抑え、監視ループとは別タスク・別スレッドで取得するため監視の tick を遅らせない.
+    発見した敵プレイヤーは監視中ギルドのBot用コマンドチャンネルに通知する.
+    """
+
+    __config: ASWDConfig
+    __engine: WatchEngine
+    __fetcher: AtlasFetcher
+    __task: asyncio.Task
+
+    def __init__(self, config, engine, fetcher=None):
+        """
+        コンストラクタ.
+        :param config: コンフィグ管理インスタンス.
+        :type config: ASWDConfig
+        :param engine: 監視エンジン. 判定実行インスタンスとプレイヤー所在インデックスを共有する.
+        :type engine: WatchEngine
+        :param fetcher: Atlas API 取得インスタンス. 省略時は巡回専用のスレッドで取得するインスタンスを新規作成.
+                        監視プロセスを分ける場合は FeedFetcher.on_demand() の取得インスタンス.
+        :type fetcher: AtlasFetcher
+        """
+        self.__config = config
+        self.__engine = engine
+        self.__fetcher = fetcher if fetcher else AtlasFetcher(executor=ThreadPoolExecutor(1))
+        self.__task = None
+        self.__cursors = {}
+        self.__cluster_index = 0
+        # ギルドID: {サーバ名: 前回巡回時に発見したプレイヤー名の集合}
+        self.__sightings = {}
+
+    @property
+    def config(self):
+        return self.__config
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def is_running(self):
+        return self.__task is not None and not self.__task.done()
+
+    def start(self):
+        """
+        巡回タスクを起動する.
+        settings.ini の sweep_enabled が False の場合は何もしない.
+        :return: 処理結果(True: 起動, False: 無効または既に起動済み)
+        :rtype: bool
+        """
+        if not self.config.sweep_enabled or self.is_running:
+            return False
+        self.__task = self.config.client.loop.create_task(self.__sweep())
+        print("巡回タスク起動.")
+        return True
+
+    async def stop(self):
+        """
+        巡回タスクを停止する.
+        :return: 処理結果(True: 停止, False: 起動していない)
+        :rtype: bool
+        """
+        if not self.is_running:
+            return False
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+        self.__sightings = {}
+        print("巡回タスク停止.")
+        return True
+
+    async def __sweep(self):
+        """
+        巡回ループ本体.
+        1サーバ取得する毎に、取得回数の上限から求めた間隔が経過するまで待機する.
+        取得回数の上限は settings.ini の再読み込みで変わるため毎回読み直す.
+        :return: None
+        :rtype: None
+        """
+        while self.config.is_watch_started:
+            started_at = time.monotonic()
+            key = self.next_key()
+            if key is not None:
+                try:
+                    await self.sweep_grid(key[0], key[1])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("【WARN 】巡回失敗. server_name={}".format(key[1]))
+                    with open(consts.LOG_FILE, 'a') as f:
+                        traceback.print_exc(file=f)
+            await asyncio.sleep(max(0, 60 / self.config.sweep_budget - (time.monotonic() - started_at)))
+
+    def next_key(self):
+        """
+        次に巡回する (クラスターID, サーバ名) を取得する.
+        監視中ギルドの監視ワールドを順番に切り替え、監視報告チャンネルで監視済みのサーバは飛ばす.
+        :return: (クラスターID, サーバ名). 巡回対象がない場合は None.
+        :rtype: tuple
+        """
+        clusters = sorted(set(guild.watch_world for guild in self.config.guilds.started()))
+        if not clusters:
+            return None
+        self.__cluster_index = (self.__cluster_index + 1) % len(clusters)
+        cluster_id = clusters[self.__cluster_index]
+        watched = set(self.engine.registry.keys)
+        cursor = self.__cursors.get(cluster_id, 0)
+        for _ in range(len(consts.SERVER_NAMES)):
+            server_name = consts.SERVER_NAMES[cursor]["name"]
+            cursor = (cursor + 1) % len(consts.SERVER_NAMES)
+            if (cluster_id, server_name) not in watched:
+                self.__cursors[cluster_id] = cursor
+                return cluster_id, server_name
+        self.__cursors[cluster_id] = cursor
+        return None
+
+    async def sweep_grid(self, cluster_id, server_name):
+        """
+        サーバのプレイヤー情報を取得し、監視ワールドが一致するギルド毎に敵プレイヤーを判定して通知する.
+        同じサーバで前回の巡回から続けて確認されたプレイヤーは再通知しない.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :param server_name: サーバ名
+        :type server_name: str
+        :return: None
+        :rtype: None
+        """
+        guilds = [guild for guild in self.config.guilds.started() if guild.watch_world == cluster_id]
+        if not guilds:
+            return
+        server_id = Utils.get_server_id(cluster_id, server_name)
+        matchers = list(dict((guild.matcher.key, guild.matcher) for guild in guilds).values())
+        # 監視プロセスからデコード済みのプレイヤー名を受け取る取得クラスではデコードを省く
+        fetch_roster = getattr(self.__fetcher, "fetch_roster", None)
+        if fetch_roster is not None:
+            roster = await fetch_roster(server_id)
+            if not roster:
+                return
+            grid = match_names(roster[0], roster[1], matchers)
+        else:
+            players_json = await self.__fetcher.fetch_players_text(server_id)
+            if not players_json:
+                return
+            grid = await self.engine.match_service.match(players_json, matchers)
+        if grid["roster_size"] < 0:
+            return
+        self.engine.player_index.update(cluster_id, server_name, grid["names"])
+        self.engine.update_roster((cluster_id, server_name), grid["roster_size"], grid["names"])
+
+        cmd_channels = None
+        for guild in guilds:
+            enemies = guild.enemies
+            found = {}
+            for player_name, enemy in grid["matches"].get(guild.matcher.key, []):
+                found[player_name] = enemies.get(enemy, "")
+            sightings = self.__sightings.setdefault(guild.guild_id, {})
+            new_players = [player_name for player_name in sorted(found)
+                           if player_name not in sightings.get(server_name, ())]
+            sightings[server_name] = set(found)
+            if not new_players:
+                continue
+            if cmd_channels is None:
+                cmd_channels = dict((str(channel.server.id), channel)
+                                    for channel in Utils.get_cmd_channels(self.config.client))
+            channel = cmd_channels.get(guild.guild_id)
+            if channel is None:
+                continue
+            msg = "【巡回】{} でブラックリストの {} を発見.".format(
+                server_name, ", ".join("{}({})".format(player_name, found[player_name]) for player_name in new_players))
+            await Utils.send_message(self.config.client, channel, Utils.truncate(msg))
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import configparser
+import csv
+import io
 import json
+import os
+import traceback
 
 from discord import ChannelType, Client, Server
 
 from awsdb import consts
+from awsdb.ratelimit import OutboundLimiter
+from awsdb.snapshot import WatchSnapshot
+from awsdb.store import GuildConfig, GuildConfigStore
 
 
 class ASWDConfig:
@@ -12,23 +20,212 @@ class ASWDConfig:
     atlas-server-watch-discord-bot コンフィグ管理クラス.
     """
 
-    def __init__(self, client_val):
+    def __init__(self, client_val, guild_db_path=consts.GUILD_DB_FILE_NAME, load_state=True):
+        """
+        コンストラクタ.
+        :param client_val: Discordクライアントインスタンス. Discordに接続しない場合は HeadlessClient.
+        :type client_val: Client
+        :param guild_db_path: ギルド設定DBのファイルパス. ":memory:" の場合は保存しない.
+        :type guild_db_path: str
+        :param load_state: 監視状態スナップショットを読み込むか. Discordに接続しない監視や記録の再生では False.
+        :type load_state: bool
+        """
         self.__config = configparser.ConfigParser()
         self.__config.read(consts.CONFIG_FILE_NAME, encoding='utf-8')
-        self.__token = self.config.get(consts.SECTION_NAME, consts.KEY_TOKEN)
-        self.__watch_world = int(self.config.get(consts.SECTION_NAME, consts.KEY_WATCH_WORLD))
-        self.__watch_interval = int(self.config.get(consts.SECTION_NAME, consts.KEY_WATCH_INTERVAL))
-        self.__player_sbn_count = int(self.config.get(consts.SECTION_NAME, consts.KEY_PLAYER_SBN_COUNT))
-        self.__enemy_list = json.loads(self.config.get(consts.SECTION_NAME, consts.KEY_ENEMY_LIST))
-        self.__is_watch_started = False
-        self.__last_servers_info = {}
-        self.__enemy_notice_server_names = []
+        self.__apply(self.__parse(self.__config))
+        self.__mtime = self.__stat()
         self.__client = client_val
+        self.__guilds = GuildConfigStore(self, guild_db_path)
+        self.__save_lock = None
+        if load_state:
+            self.load_state()
 
     @property
     def config(self):
         return self.__config
 
+    @classmethod
+    def load_settings(cls, path=consts.CONFIG_FILE_NAME):
+        """
+        settings.ini を読み込んで検証した値だけを取得する.
+        ギルド設定DBや監視状態スナップショットには触れないため、Discordに接続しない監視プロセスで使う.
+        :param path: settings.ini のパス
+        :type path: str
+        :return: 設定キー(consts.KEY_*): 値 の辞書
+        :rtype: dict
+        """
+        parser = configparser.ConfigParser()
+        if not parser.read(path, encoding='utf-8'):
+            raise OSError("settings.ini を読み込めません. path:{}".format(path))
+        return cls.__parse(parser)
+
+    @classmethod
+    def __parse(cls, parser):
+        """
+        settings.ini の内容を検証して値を取り出す.
+        :param parser: settings.ini を読み込んだ ConfigParser
+        :type parser: configparser.ConfigParser
+        :return: 設定キー: 値 の辞書
+        :rtype: dict
+        """
+        section = consts.SECTION_NAME
+        enemy_list = json.loads(parser.get(section, consts.KEY_ENEMY_LIST))
+        if not isinstance(enemy_list, dict):
+            raise ValueError("enemy_list は {\"プレイヤー名\": \"カンパニー名\"} の形式で指定してください.")
+        match_mode = parser.get(section, consts.KEY_MATCH_MODE, fallback=consts.MATCH_MODE_INLINE)
+        if match_mode not in consts.MATCH_MODES:
+            raise ValueError("match_mode は {} のいずれかを指定してください. match_mode:{}".format(
+                ", ".join(consts.MATCH_MODES), match_mode))
+        return {
+            consts.KEY_TOKEN: parser.get(section, consts.KEY_TOKEN),
+            consts.KEY_WATCH_WORLD: int(parser.get(section, consts.KEY_WATCH_WORLD)),
+            consts.KEY_WATCH_INTERVAL: int(parser.get(section, consts.KEY_WATCH_INTERVAL)),
+            consts.KEY_PLAYER_SBN_COUNT: int(parser.get(section, consts.KEY_PLAYER_SBN_COUNT)),
+            consts.KEY_ENEMY_LIST: enemy_list,
+            consts.KEY_COMPANY_ALERT_COUNT: parser.getint(section, consts.KEY_COMPANY_ALERT_COUNT,
+                                                          fallback=consts.COMPANY_ALERT_COUNT),
+            consts.KEY_AUTO_START: parser.getboolean(section, consts.KEY_AUTO_START, fallback=True),
+            consts.KEY_MATCH_MODE: match_mode,
+            consts.KEY_MATCH_WORKERS: parser.getint(section, consts.KEY_MATCH_WORKERS, fallback=0),
+            consts.KEY_DASHBOARD: parser.getboolean(section, consts.KEY_DASHBOARD, fallback=False),
+            consts.KEY_LIVE_STATUS: parser.getboolean(section, consts.KEY_LIVE_STATUS, fallback=False),
+            consts.KEY_SWEEP_ENABLED: parser.getboolean(section, consts.KEY_SWEEP_ENABLED, fallback=False),
+            consts.KEY_SWEEP_BUDGET: max(1, parser.getint(section, consts.KEY_SWEEP_BUDGET,
+                                                          fallback=consts.SWEEP_BUDGET)),
+            consts.KEY_LAG_THRESHOLD_MS: max(1, parser.getint(section, consts.KEY_LAG_THRESHOLD_MS,
+                                                              fallback=consts.LAG_THRESHOLD_MS)),
+            consts.KEY_RECORD: parser.getboolean(section, consts.KEY_RECORD, fallback=False),
+            consts.KEY_RECORD_MAX_MB: max(1, parser.getint(section, consts.KEY_RECORD_MAX_MB,
+                                                           fallback=consts.RECORD_MAX_MB)),
+            consts.KEY_FEED_ADDRESS: parser.get(section, consts.KEY_FEED_ADDRESS, fallback="").strip()
+        }
+
+    def __apply(self, values):
+        """
+        __parse で取り出した値をまとめて反映する. 途中で他の処理に切り替わらないよう await を挟まないこと.
+        :param values: 設定キー: 値 の辞書
+        :type values: dict
+        :return: None
+        :rtype: None
+        """
+        self.__token = values[consts.KEY_TOKEN]
+        self.__watch_world = values[consts.KEY_WATCH_WORLD]
+        self.__watch_interval = values[consts.KEY_WATCH_INTERVAL]
+        self.__player_sbn_count = values[consts.KEY_PLAYER_SBN_COUNT]
+        self.__enemy_list = values[consts.KEY_ENEMY_LIST]
+        self.__company_alert_count = values[consts.KEY_COMPANY_ALERT_COUNT]
+        self.__auto_start = values[consts.KEY_AUTO_START]
+        self.__match_mode = values[consts.KEY_MATCH_MODE]
+        self.__match_workers = values[consts.KEY_MATCH_WORKERS]
+        self.__dashboard = values[consts.KEY_DASHBOARD]
+        self.__live_status = values[consts.KEY_LIVE_STATUS]
+        self.__sweep_enabled = values[consts.KEY_SWEEP_ENABLED]
+        self.__sweep_budget = values[consts.KEY_SWEEP_BUDGET]
+        self.__lag_threshold_ms = values[consts.KEY_LAG_THRESHOLD_MS]
+        self.__record = values[consts.KEY_RECORD]
+        self.__record_max_mb = values[consts.KEY_RECORD_MAX_MB]
+        self.__feed_address = values[consts.KEY_FEED_ADDRESS]
+
+    def __values(self):
+        """
+        現在の設定値を取得する.
+        :return: 設定キー: 値 の辞書
+        :rtype: dict
+        """
+        return {
+            consts.KEY_TOKEN: self.token,
+            consts.KEY_WATCH_WORLD: self.watch_world,
+            consts.KEY_WATCH_INTERVAL: self.watch_interval,
+            consts.KEY_PLAYER_SBN_COUNT: self.player_sbn_count,
+            consts.KEY_ENEMY_LIST: self.enemy_list,
+            consts.KEY_COMPANY_ALERT_COUNT: self.company_alert_count,
+            consts.KEY_AUTO_START: self.auto_start,
+            consts.KEY_MATCH_MODE: self.match_mode,
+            consts.KEY_MATCH_WORKERS: self.match_workers,
+            consts.KEY_DASHBOARD: self.dashboard,
+            consts.KEY_LIVE_STATUS: self.live_status,
+            consts.KEY_SWEEP_ENABLED: self.sweep_enabled,
+            consts.KEY_SWEEP_BUDGET: self.sweep_budget,
+            consts.KEY_LAG_THRESHOLD_MS: self.lag_threshold_ms,
+            consts.KEY_RECORD: self.record,
+            consts.KEY_RECORD_MAX_MB: self.record_max_mb,
+            consts.KEY_FEED_ADDRESS: self.feed_address
+        }
+
+    @staticmethod
+    def __stat():
+        """
+        settings.ini の更新を判定するための値を取得する.
+        :return: (更新日時(ナノ秒), サイズ). ファイルがない場合は None.
+        :rtype: tuple
+        """
+        try:
+            stat = os.stat(consts.CONFIG_FILE_NAME)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """
+        settings.ini が更新されていれば読み込み直し、変更された値をまとめて反映する.
+        読み込めない・値が不正な場合は反映せず、最後に読み込めた設定のまま動作を続ける.
+        全ギルド共通の敵プレイヤーが変わった場合は辞書を差し替え、各ギルドの判定インスタンスを次の判定時に作り直させる.
+        :return: 変更された設定キーのリスト. 更新がない・反映しなかった場合は空.
+        :rtype: list of str
+        """
+        stat = self.__stat()
+        if stat is None or stat == self.__mtime:
+            return []
+        self.__mtime = stat
+        parser = configparser.ConfigParser()
+        try:
+            if not parser.read(consts.CONFIG_FILE_NAME, encoding='utf-8'):
+                raise OSError("settings.ini を読み込めません.")
+            values = self.__parse(parser)
+        except Exception as e:
+            print("【WARN 】settings.ini が不正なため反映しません. 前回の設定で動作を続けます. {}".format(repr(e)))
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            return []
+
+        current = self.__values()
+        changed = [key for key, value in values.items() if current[key] != value]
+        if not changed:
+            return []
+        if consts.KEY_ENEMY_LIST in changed:
+            added = values[consts.KEY_ENEMY_LIST].keys() - current[consts.KEY_ENEMY_LIST].keys()
+            removed = current[consts.KEY_ENEMY_LIST].keys() - values[consts.KEY_ENEMY_LIST].keys()
+            print("共通の敵プレイヤーを更新. 追加:{}人 削除:{}人".format(len(added), len(removed)))
+        else:
+            # 変わっていなければ同じ辞書を使い続け、判定インスタンスを作り直させない
+            values[consts.KEY_ENEMY_LIST] = current[consts.KEY_ENEMY_LIST]
+        self.__config = parser
+        self.__apply(values)
+        print("settings.ini の変更を反映. {}".format(", ".join(key.lower() for key in changed)))
+        restart_keys = [key.lower() for key in changed if key in consts.RESTART_REQUIRED_KEYS]
+        if restart_keys:
+            print("【WARN 】{} は再起動後に反映されます.".format(", ".join(restart_keys)))
+        return changed
+
+    async def run_reloader(self, on_change=None):
+        """
+        一定間隔で settings.ini の更新を確認し続ける.
+        :param on_change: 設定を反映した時に呼び出すコルーチン関数. 引数は変更された設定キーのリスト.
+        :type on_change: function
+        :return: None
+        :rtype: None
+        """
+        while True:
+            await asyncio.sleep(consts.CONFIG_RELOAD_INTERVAL)
+            try:
+                changed = self.reload()
+                if changed and on_change is not None:
+                    await on_change(changed)
+            except Exception as e:
+                print("【エラー】settings.ini の再読み込み失敗.")
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+
     @property
     def token(self):
         return self.__token
@@ -37,118 +234,210 @@ class ASWDConfig:
     def watch_world(self):
         return self.__watch_world
 
-    @watch_world.setter
-    def watch_world(self, watch_world):
-        self.__watch_world = watch_world
-        self.write()
-
     @property
     def watch_interval(self):
         return self.__watch_interval
 
-    @watch_interval.setter
-    def watch_interval(self, watch_interval):
-        self.__watch_interval = watch_interval
-        self.write()
-
     @property
     def player_sbn_count(self):
         return self.__player_sbn_count
 
-    @player_sbn_count.setter
-    def player_sbn_count(self, player_sbn_count):
-        self.__player_sbn_count = player_sbn_count if player_sbn_count >= 3 else 3
-        self.write()
-
     @property
     def enemy_list(self):
         return self.__enemy_list
 
-    def add_enemy(self, name, company):
+    @property
+    def company_alert_count(self):
+        return self.__company_alert_count
+
+    @property
+    def is_watch_started(self):
+        """
+        いずれかのギルドが監視中か.
+        :rtype: bool
+        """
+        return len(self.guilds.started()) > 0
+
+    @property
+    def auto_start(self):
+        return self.__auto_start
+
+    @property
+    def match_mode(self):
+        return self.__match_mode
+
+    @property
+    def match_workers(self):
+        """
+        判定ワーカー数. 0 の場合は実行モードの既定値.
+        :rtype: int
+        """
+        return self.__match_workers
+
+    @property
+    def live_status(self):
         """
-        敵対プレイヤーを追加する.
-        :param name: プレイヤー名(Steam名)
-        :type name: str
-        :param company: カンパニー名
-        :type company: str
-        :return: 処理結果(True: 追加成功, False: 既に存在するプレイヤー名がある等で追加失敗)
+        定例メッセージを毎回送信せず、チャンネル毎に1つのステータスメッセージを編集して更新するか.
         :rtype: bool
         """
-        for enemy in self.enemy_list:
-            if enemy == name:
-                return False
-        self.enemy_list[name] = company.strip() if company else ""
-        self.write()
-        return True
+        return self.__live_status
 
-    def del_enemy(self, name):
+    @property
+    def dashboard(self):
         """
-        敵対プレイヤーを削除する.
-        :param name: プレイヤー名(Steam名)
-        :type name: str
-        :return: 処理結果(True: 削除成功, False: 存在しないプレイヤー名等で削除失敗)
+        Bot用コマンドチャンネルに全監視サーバをまとめたダッシュボードを表示するか.
         :rtype: bool
         """
-        for enemy in self.enemy_list:
-            if enemy == name:
-                self.enemy_list.pop(name)
-                self.write()
-                return True
-        return False
+        return self.__dashboard
+
+    @property
+    def sweep_enabled(self):
+        return self.__sweep_enabled
 
-    def list_enemy(self):
+    @property
+    def sweep_budget(self):
         """
-        敵プレイヤー一覧を文字列で取得する.
-        :return: 敵プレイヤー一覧
-        :rtype: str
+        全サーバ巡回で1分間に行うプレイヤー情報取得の上限回数.
+        :rtype: int
         """
-        ret = []
-        for enemy in self.enemy_list:
-            ret.append("{}({})".format(enemy, self.enemy_list[enemy]))
-        return ", ".join(ret)
+        return self.__sweep_budget
 
     @property
-    def is_watch_started(self):
-        return self.__is_watch_started
+    def lag_threshold_ms(self):
+        """
+        イベントループの停止をブロッキング処理として記録する閾値(ミリ秒).
+        :rtype: int
+        """
+        return self.__lag_threshold_ms
 
-    @is_watch_started.setter
-    def is_watch_started(self, val):
-        self.__is_watch_started = val
+    @property
+    def record(self):
+        """
+        監視で取得した Atlas API のレスポンスを記録するか.
+        :rtype: bool
+        """
+        return self.__record
 
     @property
-    def last_servers_info(self):
-        return self.__last_servers_info
+    def record_max_mb(self):
+        """
+        レスポンス記録ファイル1つあたりの最大サイズ(圧縮前、MB).
+        :rtype: int
+        """
+        return self.__record_max_mb
 
-    @last_servers_info.setter
-    def last_servers_info(self, val):
-        self.__last_servers_info = val
+    @property
+    def feed_address(self):
+        """
+        監視プロセスと通知プロセスを分ける場合の接続先("ホスト:ポート" または "unix:ソケットのパス").
+        空の場合は1つのプロセスで取得から通知まで行う.
+        :rtype: str
+        """
+        return self.__feed_address
 
     @property
-    def enemy_notice_server_names(self):
-        return self.__enemy_notice_server_names
+    def guilds(self):
+        """
+        ギルド毎の設定ストア.
+        :rtype: GuildConfigStore
+        """
+        return self.__guilds
+
+    def guild(self, server):
+        """
+        ギルドの設定を取得する.
+        :param server: Discordのサーバ(ギルド)インスタンス
+        :type server: Server
+        :return: ギルド設定
+        :rtype: GuildConfig
+        """
+        return self.guilds.get(server)
 
     @property
     def client(self):
         return self.__client
 
-    def write(self):
+    def load_state(self):
         """
-        コンフィグを書き込む.
+        監視状態スナップショットを読み込み、前回終了時のギルド毎の監視状態を復元する.
+        監視ワールドが変わっているギルドや、監視間隔に比べて古すぎる場合は前回サーバ情報を復元しない.
         :return: None
         :rtype: None
         """
-        configw = configparser.ConfigParser()
-        configw.add_section(consts.SECTION_NAME)
-        configw.set(consts.SECTION_NAME, consts.KEY_TOKEN, self.token)
-        configw.set(consts.SECTION_NAME, consts.KEY_WATCH_WORLD, str(self.watch_world))
-        configw.set(consts.SECTION_NAME, consts.KEY_WATCH_INTERVAL, str(self.watch_interval))
-        configw.set(consts.SECTION_NAME, consts.KEY_PLAYER_SBN_COUNT, str(self.player_sbn_count))
-        configw.set(consts.SECTION_NAME, consts.KEY_ENEMY_LIST, json.dumps(self.enemy_list))
-        with open(consts.CONFIG_FILE_NAME, 'w', encoding='utf-8') as configfile:
-            configw.write(configfile)
+        try:
+            snapshot = WatchSnapshot.load()
+        except Exception as e:
+            print("【WARN 】監視状態スナップショットの読み込み失敗. 初期状態で起動.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+            return
+        if not snapshot:
+            return
+        for state in snapshot.guilds:
+            guild = self.guilds.get_by_id(state["guild_id"])
+            guild.is_watch_started = state["is_watch_started"]
+            if state["watch_world"] != guild.watch_world:
+                continue
+            guild.alerts.load_records(state["alerts"])
+            if not snapshot.is_fresh(guild.watch_interval * consts.SNAPSHOT_MAX_AGE_INTERVALS):
+                continue
+            last_servers_info = {}
+            for server_name, player_count in state["last_player_counts"].items():
+                last_servers_info[server_name] = {"server_name": server_name, "player_count": player_count}
+            guild.last_servers_info = last_servers_info
+
+    def __snapshot(self):
+        """
+        ギルド毎の監視状態スナップショットを作成する.
+        :return: スナップショット
+        :rtype: WatchSnapshot
+        """
+        guilds = []
+        for guild in self.guilds.cached:
+            if not guild.is_watch_started and not guild.alerts:
+                continue
+            last_player_counts = {}
+            for server_name, server_info in guild.last_servers_info.items():
+                last_player_counts[server_name] = server_info["player_count"]
+            guilds.append({
+                "guild_id": guild.guild_id,
+                "watch_world": guild.watch_world,
+                "is_watch_started": guild.is_watch_started,
+                "last_player_counts": last_player_counts,
+                "alerts": guild.alerts.to_records()
+            })
+        return WatchSnapshot(guilds)
+
+    def save_state(self):
+        """
+        ギルド毎の監視状態スナップショットを書き込む.
+        :return: None
+        :rtype: None
+        """
+        self.__snapshot().save()
+
+    async def save_state_async(self, loop=None):
+        """
+        ギルド毎の監視状態スナップショットをスレッドプールで書き込む.
+        状態の取り出しはイベントループ側で行い、ファイルへの書き込みと fsync でイベントループを止めない.
+        書き込みは呼び出し順に1つずつ行う.
+        :param loop: イベントループ
+        :type loop: asyncio.AbstractEventLoop
+        :return: None
+        :rtype: None
+        """
+        snapshot = self.__snapshot()
+        if self.__save_lock is None:
+            self.__save_lock = asyncio.Lock()
+        loop = loop if loop else asyncio.get_event_loop()
+        async with self.__save_lock:
+            await loop.run_in_executor(None, snapshot.save)
 
 
 class Utils:
+    # Discordへの送信の流量制限. 送信は全てこのインスタンスを経由する.
+    outbound = OutboundLimiter()
+
     @classmethod
     async def send_message(cls, client, channel, msg):
         """
@@ -162,7 +451,134 @@ class Utils:
         :return: None
         :rtype: None
         """
-        await client.send_message(channel, msg)
+        await cls.outbound.call(client.send_message, channel, msg)
+
+    @classmethod
+    async def send_file(cls, client, channel, data, filename, msg=None):
+        """
+        Discordにファイルを送信する.
+        :param client: Discordクライアントインスタンス
+        :type client: Client
+        :param channel: ファイルを送信するチャンネルインスタンス
+        :type channel: Channel
+        :param data: ファイルの内容
+        :type data: bytes
+        :param filename: ファイル名
+        :type filename: str
+        :param msg: ファイルと一緒に送信するメッセージ
+        :type msg: str
+        :return: None
+        :rtype: None
+        """
+        await cls.outbound.call(client.send_file, channel, io.BytesIO(data), filename=filename, content=msg)
+
+    @classmethod
+    async def create_channel(cls, client, server, channel_name):
+        """
+        Discordにテキストチャンネルを作成する.
+        :param client: Discordクライアントインスタンス
+        :type client: Client
+        :param server: チャンネルを作成するサーバ(ギルド)インスタンス
+        :type server: Server
+        :param channel_name: チャンネル名
+        :type channel_name: str
+        :return: 作成したチャンネル
+        :rtype: Channel
+        """
+        return await cls.outbound.call(client.create_channel, server, channel_name, type=ChannelType.text)
+
+    @classmethod
+    async def download_text(cls, url, max_bytes=consts.IMPORT_MAX_BYTES):
+        """
+        添付ファイル等をテキストとしてダウンロードする.
+        :param url: URL
+        :type url: str
+        :param max_bytes: 許容する最大バイト数
+        :type max_bytes: int
+        :return: ダウンロードしたテキスト
+        :rtype: str
+        """
+        loop = asyncio.get_event_loop()
+        content = await loop.run_in_executor(None, cls.__download, url, max_bytes)
+        return content.decode('utf-8-sig')
+
+    @staticmethod
+    def __download(url, max_bytes):
+        """
+        少しずつダウンロードし、最大バイト数を超えた時点で中断する(スレッドプールで実行).
+        :param url: URL
+        :type url: str
+        :param max_bytes: 許容する最大バイト数
+        :type max_bytes: int
+        :return: ダウンロードした内容
+        :rtype: bytes
+        """
+        import requests
+        with requests.get(url, timeout=consts.API_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise ValueError("ファイルサイズが大きすぎます. size:{}".format(length))
+            buf = bytearray()
+            for chunk in response.iter_content(chunk_size=consts.IMPORT_CHUNK_BYTES):
+                buf.extend(chunk)
+                if len(buf) > max_bytes:
+                    raise ValueError("ファイルサイズが大きすぎます. size:{}バイト超".format(max_bytes))
+            return bytes(buf)
+
+    @classmethod
+    def parse_enemy_csv(cls, text):
+        """
+        敵プレイヤーのCSV(プレイヤー名,カンパニー名)を読み込む.
+        カンパニー名は省略可能. 空行と見出し行(name,company)は読み飛ばす.
+        :param text: CSVテキスト
+        :type text: str
+        :return: (プレイヤー名, カンパニー名) のリスト
+        :rtype: list of tuple
+        """
+        ret = []
+        for row in csv.reader(io.StringIO(text)):
+            if not row or not row[0].strip():
+                continue
+            name = row[0].strip()
+            company = row[1].strip() if len(row) >= 2 else ""
+            if not ret and name.lower() == "name" and company.lower() == "company":
+                continue
+            ret.append((name, company))
+        return ret
+
+    @classmethod
+    def format_enemy_csv(cls, enemies):
+        """
+        敵プレイヤーをCSV(プレイヤー名,カンパニー名)に変換する.
+        :param enemies: 敵プレイヤー(プレイヤー名: カンパニー名)
+        :type enemies: dict
+        :return: CSVテキスト
+        :rtype: str
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["name", "company"])
+        for name in sorted(enemies):
+            writer.writerow([name, enemies[name]])
+        return buf.getvalue()
+
+    @classmethod
+    def truncate(cls, msg, max_length=consts.MESSAGE_MAX_LENGTH, suffix="..."):
+        """
+        Discordの文字数制限に収まるようメッセージを切り詰める.
+        :param msg: メッセージ
+        :type msg: str
+        :param max_length: 最大文字数
+        :type max_length: int
+        :param suffix: 切り詰めた場合に末尾に付ける文字列
+        :type suffix: str
+        :return: 切り詰めたメッセージ
+        :rtype: str
+        """
+        if len(msg) <= max_length:
+            return msg
+        return msg[:max_length - len(suffix)] + suffix
 
     @classmethod
     def get_channels(cls, client):
@@ -0,0 +1,620 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import traceback
+from datetime import datetime
+
+from discord import Channel, HTTPException, NotFound, Server
+
+from awsdb import consts
+from awsdb.detectors import DetectorRegistry
+from awsdb.fetcher import AtlasFetcher
+from awsdb.grid import ClusterGrid, ServersInfo, detect_movements
+from awsdb.matcher import MatchService
+from awsdb.pipeline import TickPipeline
+from awsdb.playerindex import PlayerIndex
+from awsdb.profiler import TickProfiler
+from awsdb.registry import ChannelRegistry
+from awsdb.store import GuildConfig
+from awsdb.utils import ASWDConfig, Utils
+
+# ダッシュボードの行テンプレート(書式文字列の解析を毎回行わないよう、format をあらかじめ取り出しておく)
+_DASHBOARD_HEADER = consts.DASHBOARD_HEADER.format
+_DASHBOARD_ROW = consts.DASHBOARD_ROW.format
+_DASHBOARD_STALE_ROW = consts.DASHBOARD_STALE_ROW.format
+# サーバ名: 並び順
+_SERVER_ORDER = dict((server["name"], server["id"]) for server in consts.SERVER_NAMES)
+
+
+class WatchEngine:
+    """
+    サーバ監視エンジン.
+    1回分の監視処理(サーバ情報取得→判定→通知)を tick() で実行する.
+    取得は (クラスターID, サーバ名) 毎に1回だけ行い、判定と通知はギルド毎の設定で行う.
+    """
+
+    __config: ASWDConfig
+    __fetcher: AtlasFetcher
+    __registry: ChannelRegistry
+    __match_service: MatchService
+    __player_index: PlayerIndex
+    __detectors: DetectorRegistry
+
+    def __init__(self, config, fetcher=None, registry=None, match_service=None, player_index=None, detectors=None,
+                 pipeline_factory=None):
+        """
+        コンストラクタ.
+        :param config: コンフィグ管理インスタンス.
+        :type config: ASWDConfig
+        :param fetcher: Atlas API 取得インスタンス. 省略時は新規作成.
+        :type fetcher: AtlasFetcher
+        :param registry: 監視報告チャンネル管理インスタンス. 省略時は新規作成.
+        :type registry: ChannelRegistry
+        :param match_service: 敵プレイヤー判定実行インスタンス. 省略時はコンフィグの実行モードで新規作成.
+        :type match_service: MatchService
+        :param player_index: プレイヤー所在インデックス. 省略時は新規作成.
+        :type player_index: PlayerIndex
+        :param detectors: 警告判定の登録先. 省略時は標準の判定.
+        :type detectors: DetectorRegistry
+        :param pipeline_factory: 監視処理1回分のパイプラインを作成する関数. 引数は (監視エンジン, 対象ギルドのリスト).
+                                 省略時は TickPipeline.
+        :type pipeline_factory: function
+        """
+        self.__config = config
+        self.__fetcher = fetcher if fetcher else AtlasFetcher()
+        self.__registry = registry if registry else ChannelRegistry()
+        self.__match_service = match_service if match_service else MatchService(
+            config.match_mode, config.match_workers if config.match_workers > 0 else None)
+        self.__player_index = player_index if player_index is not None else PlayerIndex()
+        self.__detectors = detectors if detectors is not None else DetectorRegistry()
+        self.__pipeline_factory = pipeline_factory if pipeline_factory else TickPipeline
+        # チャンネルID: 編集用に保持しているステータスメッセージ
+        self.__status_messages = {}
+        # クラスターID: クラスター全体の人数モデル
+        self.__cluster_grids = {}
+        # クラスターID: 今回の tick で検出した隣接サーバ間の移動
+        self.__movements = {}
+        # 段階名: 前回の監視処理の段階毎の処理時間(秒)
+        self.__stage_times = {}
+        # (クラスターID, サーバ名): (取得時刻(time.monotonic()), プレイヤー数, プレイヤー名のタプル)
+        self.__rosters = {}
+
+    @property
+    def config(self):
+        return self.__config
+
+    @property
+    def fetcher(self):
+        return self.__fetcher
+
+    @property
+    def registry(self):
+        return self.__registry
+
+    @property
+    def match_service(self):
+        return self.__match_service
+
+    @property
+    def player_index(self):
+        return self.__player_index
+
+    @property
+    def detectors(self):
+        return self.__detectors
+
+    @property
+    def stage_times(self):
+        return dict(self.__stage_times)
+
+    def cluster_grid(self, cluster_id):
+        """
+        クラスター全体の人数モデルを取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :return: 人数モデル
+        :rtype: ClusterGrid
+        """
+        cluster_grid = self.__cluster_grids.get(cluster_id)
+        if cluster_grid is None:
+            cluster_grid = ClusterGrid(cluster_id)
+            self.__cluster_grids[cluster_id] = cluster_grid
+        return cluster_grid
+
+    def cluster_of(self, server):
+        """
+        ギルドの監視クラスターIDを取得する.
+        :param server: Discordのサーバ(ギルド)インスタンス
+        :type server: Server
+        :return: クラスターID
+        :rtype: int
+        """
+        return self.config.guild(server).watch_world
+
+    def next_delay(self):
+        """
+        次に監視予定のギルドまでの待機秒数を取得する.
+        :return: 待機秒数
+        :rtype: float
+        """
+        started = self.config.guilds.started()
+        if not started:
+            return 0
+        return max(0, min(guild.next_due for guild in started) - time.monotonic())
+
+    async def notice(self, msg):
+        """
+        監視中のギルドのBot用コマンドチャンネルにメッセージを送信する.
+        :param msg: 送信するメッセージ
+        :type msg: str
+        :return: None
+        :rtype: None
+        """
+        print(msg)
+        started_ids = set(guild.guild_id for guild in self.config.guilds.started())
+        for channel in Utils.get_cmd_channels(self.config.client):
+            if str(channel.server.id) not in started_ids:
+                continue
+            await Utils.send_message(self.config.client, channel, msg)
+
+    async def tick(self):
+        """
+        監視処理を1回実行する.
+        監視間隔が経過したギルドのみを対象とする.
+        サーバ情報取得失敗等の想定内のエラーは通知して処理を続ける.
+        想定外の例外は呼び出し元(WatchSupervisor)に送出する.
+        :return: 処理結果(True: 通知まで完了, False: 監視対象のサーバ情報が1件も取得できなかった)
+        :rtype: bool
+        """
+        now = time.monotonic()
+        due_guilds = {}
+        for guild in self.config.guilds.started():
+            if guild.next_due <= now:
+                due_guilds[guild.guild_id] = guild
+        if not due_guilds:
+            return True
+
+        collected = await self.process(due_guilds.values())
+        for guild in due_guilds.values():
+            guild.next_due = now + guild.watch_interval
+
+        # 今回取得したサーバ情報を再起動時に引き継げるよう保存
+        try:
+            await self.config.save_state_async()
+        except Exception as e:
+            print("【WARN 】監視状態スナップショットの保存失敗.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+        return collected
+
+    async def process(self, guilds):
+        """
+        指定ギルドの監視サーバの情報を取得し、ギルド毎に判定して通知する.
+        取得から送信までは TickPipeline で段階毎に並行して行う.
+        :param guilds: 対象ギルドの設定のリスト
+        :type guilds: list of GuildConfig
+        :return: 処理結果(True: 監視対象のサーバ情報を1件以上取得できた, False: 1件も取得できなかった)
+        :rtype: bool
+        """
+        guilds = list(guilds)
+        guild_ids = set(guild.guild_id for guild in guilds)
+        self.registry.refresh(self.config.client, self.cluster_of, lambda server: str(server.id) in guild_ids)
+        self.__movements = {}
+        pipeline = self.__pipeline_factory(self, guilds)
+        try:
+            servers_infos = await pipeline.run()
+        finally:
+            self.__stage_times = pipeline.stage_times
+
+        # ダッシュボードはギルド毎に独立しているため並列に更新する(同時実行数は Utils.outbound で制限)
+        async def finish(guild):
+            servers_info = servers_infos[guild.guild_id]
+            if self.config.dashboard:
+                await self.update_dashboard(guild, servers_info)
+            guild.last_servers_info = servers_info
+
+        await asyncio.gather(*[finish(guild) for guild in guilds])
+        return pipeline.collected
+
+    def update_cluster(self, cluster_id, cluster_servers_info):
+        """
+        クラスター情報の取得結果でクラスター全体の人数モデルを更新し、隣接サーバ間の移動を検出する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :param cluster_servers_info: クラスター情報の取得結果(サーバ情報のリスト)
+        :type cluster_servers_info: list of dict
+        :return: 更新した人数モデル
+        :rtype: ClusterGrid
+        """
+        cluster_grid = self.cluster_grid(cluster_id)
+        cluster_grid.update(cluster_servers_info)
+        self.__movements[cluster_id] = detect_movements(cluster_grid.delta)
+        return cluster_grid
+
+    def movements(self, cluster_id):
+        """
+        今回の監視で検出した隣接サーバ間の移動を取得する.
+        :param cluster_id: クラスターID
+        :type cluster_id: int
+        :rtype: list of dict
+        """
+        return self.__movements.get(cluster_id, [])
+
+    def update_roster(self, key, roster_size, names):
+        """
+        監視で取得したサーバのプレイヤー情報を最新の情報として保持する.
+        :param key: (クラスターID, サーバ名)
+        :type key: tuple
+        :param roster_size: プレイヤー数
+        :type roster_size: int
+        :param names: プレイヤー名のタプル
+        :type names: tuple of str
+        :return: None
+        :rtype: None
+        """
+        self.__rosters[key] = (time.monotonic(), roster_size, names)
+
+    def latest_roster(self, key, max_age):
+        """
+        監視で取得した最新のプレイヤー情報を取得する.
+        :param key: (クラスターID, サーバ名)
+        :type key: tuple
+        :param max_age: 取得からの経過秒数の上限
+        :type max_age: float
+        :return: (取得からの経過秒数, プレイヤー数, プレイヤー名のタプル). 未取得か上限より古い場合は None.
+        :rtype: tuple
+        """
+        roster = self.__rosters.get(key)
+        if roster is None:
+            return None
+        age = time.monotonic() - roster[0]
+        if max_age < age:
+            return None
+        return age, roster[1], roster[2]
+
+    def grid_matchers(self, key):
+        """
+        サーバを購読しているギルドの敵プレイヤー判定インスタンスを重複なく取得する.
+        :param key: (クラスターID, サーバ名)
+        :type key: tuple
+        :return: 判定インスタンスのリスト
+        :rtype: list of EnemyMatcher
+        """
+        matchers = {}
+        for channel in self.registry.channels(key):
+            matcher = self.config.guild(channel.server).matcher
+            matchers[matcher.key] = matcher
+        return list(matchers.values())
+
+    def detect(self, guild, grid):
+        """
+        ギルドの設定でサーバの敵プレイヤーを判定する.
+        人数の増減は dispatch() で全サーバまとめて計算する.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :param grid: {"roster_size": プレイヤー数, "matches": 判定インスタンス毎の一致結果}
+        :type grid: dict
+        :return: {"enemy_players": 敵プレイヤーのリスト, "enemy_names": プレイヤー名: 敵プレイヤーの表示名,
+                  "company_players": カンパニー名: 集結しているプレイヤー名のリスト}
+        :rtype: dict
+        """
+        enemy_players = []
+        enemy_names = {}
+        company_players = {}
+        if grid["roster_size"] < 0:
+            print("【WARN 】プレイヤー情報なし.")
+        else:
+            # 敵プレイヤーの判定結果を1回走査し、カンパニー毎の在席人数も合わせて数える
+            enemies = guild.enemies
+            present = {}
+            for player_name, enemy in grid["matches"].get(guild.matcher.key, []):
+                company = enemies.get(enemy, "")
+                enemy_names[player_name] = "{}({})".format(player_name, company)
+                enemy_players.append(enemy_names[player_name])
+                if company:
+                    present.setdefault(company, set()).add(player_name)
+            if 0 < guild.company_alert_count:
+                for company, player_names in present.items():
+                    if guild.company_alert_count <= len(player_names):
+                        company_players[company] = sorted(player_names)
+
+        return {
+            "enemy_players": enemy_players,
+            "enemy_names": enemy_names,
+            "company_players": company_players
+        }
+
+    def render_dashboard(self, guild, servers_info):
+        """
+        ギルドの監視サーバをまとめたダッシュボードの内容を作成する.
+        取得できなかったサーバは前回の人数に未更新の印を付けて表示する.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :param servers_info: サーバ名をキーとした今回のサーバ情報の辞書
+        :type servers_info: ServersInfo
+        :return: 時刻を除いたダッシュボードの内容
+        :rtype: str
+        """
+        server_names = sorted(set(key[1] for key, channel in self.registry.guild_channels(guild.guild_id)),
+                              key=_SERVER_ORDER.get)
+        rows = []
+        enemy_server_count = 0
+        for server_name in server_names:
+            server_info = servers_info.get(server_name)
+            if server_info is None:
+                last_server_info = guild.last_servers_info.get(server_name)
+                rows.append(_DASHBOARD_STALE_ROW(
+                    server_name, last_server_info["player_count"] if last_server_info else "-"))
+                continue
+            player_sbn_count = server_info["player_sbn_count"]
+            enemy_count = len(server_info["enemy_players"])
+            if enemy_count > 0:
+                enemy_server_count += 1
+            rows.append(_DASHBOARD_ROW(server_name, server_info["player_count"],
+                                       "{:+d}".format(player_sbn_count) if player_sbn_count != -1 else "-",
+                                       enemy_count))
+        header = _DASHBOARD_HEADER(Utils.get_value("id", guild.watch_world, "name", consts.CLUSTERS),
+                                   len(server_names), enemy_server_count)
+        return "\n".join([header] + rows)
+
+    async def update_dashboard(self, guild, servers_info):
+        """
+        Bot用コマンドチャンネルのダッシュボードを更新する.
+        ダッシュボードはステータスメッセージとして1つのメッセージを編集し続ける.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :param servers_info: サーバ名をキーとした今回のサーバ情報の辞書
+        :type servers_info: ServersInfo
+        :return: None
+        :rtype: None
+        """
+        channel = self.registry.guild_cmd_channel(guild.guild_id)
+        if channel is None:
+            return
+        await self.update_status(guild, channel, self.render_dashboard(guild, servers_info),
+                                 datetime.now().strftime("%m/%d %H:%M"))
+
+    async def update_status(self, guild, channel, body, timestr):
+        """
+        チャンネルのステータスメッセージを編集して最新の状態にする.
+        内容が前回と同じ場合は何もしない. ステータスメッセージがない(削除された)場合は新規に送信してピン留めする.
+        :param guild: ギルド設定
+        :type guild: GuildConfig
+        :param channel: チャンネル
+        :type channel: Channel
+        :param body: 時刻を除いたメッセージ内容
+        :type body: str
+        :param timestr: 更新時刻の文字列
+        :type timestr: str
+        :return: 処理結果(True: 送信または編集した, False: 内容に変更なし)
+        :rtype: bool
+        """
+        record = guild.status_message(channel.id)
+        if record is not None and record[1] == body:
+            return False
+        client = self.config.client
+        msg = Utils.truncate("{}　{}".format(timestr, body))
+        if record is not None:
+            message = self.__status_messages.get(channel.id)
+            try:
+                if message is None or message.id != record[0]:
+                    message = await Utils.outbound.call(client.get_message, channel, record[0])
+                message = await Utils.outbound.call(client.edit_message, message, msg)
+                self.__status_messages[channel.id] = message
+                guild.set_status_message(channel.id, message.id, body)
+                return True
+            except NotFound:
+                print("【WARN 】ステータスメッセージが見つからないため再作成. channel={}".format(channel.name))
+
+        message = await Utils.outbound.call(client.send_message, channel, msg)
+        self.__status_messages[channel.id] = message
+        guild.set_status_message(channel.id, message.id, body)
+        try:
+            await Utils.outbound.call(client.pin_message, message)
+        except HTTPException as e:
+            print("【WARN 】ステータスメッセージのピン留め失敗. channel={}".format(channel.name))
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+        return True
+
+
+class WatchSupervisor:
+    """
+    監視エンジンを常駐タスクとして管理するクラス.
+    いずれかのギルドで /start されたらタスクを起動し、全ギルドが /stop したら即時キャンセルする.
+    tick が例外で落ちた場合はバックオフを挟んで自動再起動する.
+    全サーバ巡回が指定された場合は、監視タスクと合わせて巡回タスクも起動・停止する.
+    profile() で指定回数の tick のプロファイルを取得する. 取得していない間は tick をそのまま呼び出す.
+    """
+
+    __config: ASWDConfig
+    __engine: WatchEngine
+    __task: asyncio.Task
+    __wake: asyncio.Event
+
+    def __init__(self, config, engine, sweeper=None):
+        """
+        コンストラクタ.
+        :param config: コンフィグ管理インスタンス.
+        :type config: ASWDConfig
+        :param engine: 監視エンジン.
+        :type engine: WatchEngine
+        :param sweeper: 全サーバ巡回インスタンス. 省略時は巡回しない.
+        :type sweeper: awsdb.sweep.BlacklistSweeper
+        """
+        self.__config = config
+        self.__engine = engine
+        self.__sweeper = sweeper
+        self.__task = None
+        self.__wake = None
+        self.__profiler = None
+
+    @property
+    def config(self):
+        return self.__config
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def is_running(self):
+        return self.__task is not None and not self.__task.done()
+
+    @property
+    def is_profiling(self):
+        return self.__profiler is not None
+
+    def start(self):
+        """
+        監視タスクを起動する.
+        既に起動済みの場合は待機中の監視ループを起こし、新たに監視を開始したギルドをすぐに処理させる.
+        :return: 処理結果(True: 起動, False: 既に起動済み)
+        :rtype: bool
+        """
+        if self.__sweeper is not None:
+            self.__sweeper.start()
+        if self.is_running:
+            self.wake()
+            return False
+        self.__task = self.config.client.loop.create_task(self.__supervise())
+        self.__task.add_done_callback(self.__on_done)
+        print("監視タスク起動.")
+        return True
+
+    async def stop(self):
+        """
+        監視タスクを停止する.
+        実行中の tick や待機中の sleep もその場でキャンセルする.
+        :return: 処理結果(True: 停止, False: 起動していない)
+        :rtype: bool
+        """
+        if self.__sweeper is not None:
+            await self.__sweeper.stop()
+        if self.__profiler is not None:
+            self.__profiler.cancel()
+            self.__profiler = None
+        if not self.is_running:
+            return False
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+        print("監視タスク停止.")
+        return True
+
+    async def apply_settings(self, changed):
+        """
+        settings.ini の再読み込みで変更された設定を、起動中のタスクに反映する.
+        sweep_enabled の変更で全サーバ巡回を起動・停止する. sweep_budget は巡回ループが毎回読み直す.
+        :param changed: 変更された設定キーのリスト
+        :type changed: list of str
+        :return: None
+        :rtype: None
+        """
+        if self.__sweeper is None or consts.KEY_SWEEP_ENABLED not in changed:
+            return
+        if not self.config.sweep_enabled:
+            await self.__sweeper.stop()
+        elif self.is_running:
+            self.__sweeper.start()
+
+    def profile(self, ticks):
+        """
+        次の tick から指定回数分のプロファイル取得を開始する.
+        :param ticks: プロファイルを取得する tick の回数
+        :type ticks: int
+        :return: プロファイル取得インスタンス. 監視していない、または取得中の場合は None.
+        :rtype: TickProfiler
+        """
+        if not self.is_running or self.__profiler is not None:
+            return None
+        self.__profiler = TickProfiler(ticks, self.config.client.loop)
+        return self.__profiler
+
+    def wake(self):
+        """
+        待機中の監視ループを起こす.
+        :return: None
+        :rtype: None
+        """
+        if self.__wake:
+            self.__wake.set()
+
+    async def __supervise(self):
+        """
+        監視ループ本体.
+        tick が例外を送出した場合はログ出力後、バックオフ秒待機して再開する.
+        バックオフは失敗が続くたびに倍増し、tick が成功したら初期値に戻す.
+        :return: None
+        :rtype: None
+        """
+        self.__wake = asyncio.Event()
+        backoff = consts.WATCH_RESTART_BACKOFF_MIN
+        while self.config.is_watch_started:
+            try:
+                profiler = self.__profiler
+                if profiler is None:
+                    await self.engine.tick()
+                else:
+                    try:
+                        await profiler.run(self.engine.tick)
+                    finally:
+                        if profiler.done and self.__profiler is profiler:
+                            self.__profiler = None
+                backoff = consts.WATCH_RESTART_BACKOFF_MIN
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                with open(consts.LOG_FILE, 'a') as f:
+                    traceback.print_exc(file=f)
+                await self.__notice_safe('【エラー】監視処理が異常終了. {}秒後に再起動します.'.format(backoff))
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, consts.WATCH_RESTART_BACKOFF_MAX)
+                continue
+            await self.__sleep(self.engine.next_delay())
+
+    async def __sleep(self, delay):
+        """
+        次の監視まで待機する. wake() が呼ばれた場合は途中で切り上げる.
+        :param delay: 待機秒数
+        :type delay: float
+        :return: None
+        :rtype: None
+        """
+        self.__wake.clear()
+        try:
+            await asyncio.wait_for(self.__wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def __notice_safe(self, msg):
+        """
+        エラー通知を行う. 通知自体の失敗で監視ループを止めないよう例外は握りつぶす.
+        :param msg: 送信するメッセージ
+        :type msg: str
+        :return: None
+        :rtype: None
+        """
+        try:
+            await self.engine.notice(msg)
+        except Exception as e:
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exc(file=f)
+
+    def __on_done(self, task):
+        """
+        監視タスク終了時のコールバック.
+        キャンセル以外で終了した場合はログに残す.
+        :param task: 終了したタスク
+        :type task: asyncio.Task
+        :return: None
+        :rtype: None
+        """
+        if task.cancelled():
+            return
+        if task.exception():
+            print("【エラー】監視タスクが想定外に終了.")
+            with open(consts.LOG_FILE, 'a') as f:
+                traceback.print_exception(type(task.exception()), task.exception(), None, file=f)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+プレイヤー情報のメモリ使用量ベンチマーク.
+225サーバ × 100人のプレイヤー情報を tick 毎にデコードして保持し続けた場合の定常状態のメモリ使用量を比較する.
+  before: デコードしたプレイヤー毎の辞書を保持し、所在をリストのレコードで持ち、プレイヤー名を intern しない(変更前の保持方法)
+  after : decode_and_match でプレイヤー名のみを取り出し、PlayerIndex の __slots__ レコードと intern した名前で保持する
+部分一致検索用の n-gram インデックスは両者で共通のため、比較から除く(n-gram を作らない設定で計測する).
+実行方法: python bench/memory_bench.py [--ticks N] [--grids N] [--players N]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from awsdb.matcher import EnemyMatcher, decode_and_match  # noqa: E402
+from awsdb.playerindex import PlayerIndex  # noqa: E402
+
+
+def make_rosters(grids, players, seed):
+    """
+    サーバ毎のプレイヤー名を作成する.
+    """
+    rnd = random.Random(seed)
+    names = ["".join(rnd.choice(string.ascii_letters) for _ in range(rnd.randint(4, 16)))
+             for _ in range(grids * players)]
+    return [names[i * players:(i + 1) * players] for i in range(grids)]
+
+
+def tick_texts(rosters, rnd):
+    """
+    1回分のAPIレスポンス(プレイヤー情報json)を作成する. 一部のプレイヤーは隣のサーバへ移動させる.
+    """
+    for i in range(len(rosters) - 1):
+        if rnd.random() < 0.3:
+            rosters[i + 1].append(rosters[i].pop())
+    return [json.dumps([{"name": name, "id": index} for index, name in enumerate(roster)]) for roster in rosters]
+
+
+def run_before(rosters, ticks, rnd):
+    """
+    変更前の保持方法: デコードしたプレイヤー毎の辞書を tick 間保持し、所在は [名前, キー, 時刻] のリストで持つ.
+    """
+    entries = {}
+    grid_players = {}
+    held = None
+    for _ in range(ticks):
+        held = []
+        now = time.time()
+        for grid, text in enumerate(tick_texts(rosters, rnd)):
+            players = json.loads(text)
+            held.append(players)
+            key = (1, "G{}".format(grid))
+            current = {}
+            for player in players:
+                name = str(player["name"])
+                current[name.casefold()] = name
+            for folded, name in current.items():
+                entry = entries.get(folded)
+                if entry is None:
+                    entries[folded] = [name, key, now]
+                else:
+                    entry[0] = name
+                    entry[1] = key
+                    entry[2] = now
+            grid_players[key] = set(current.keys())
+    return entries, grid_players, held
+
+
+def run_after(rosters, ticks, rnd):
+    """
+    変更後の保持方法.
+    """
+    index = PlayerIndex(gram_size=1024)
+    matcher = EnemyMatcher(["enemy"])
+    held = None
+    for _ in range(ticks):
+        held = []
+        for grid, text in enumerate(tick_texts(rosters, rnd)):
+            result = decode_and_match(text, [(matcher.key, matcher)])
+            held.append(result)
+            index.update(1, "G{}".format(grid), result["names"])
+    return index, held
+
+
+def rss():
+    """
+    現在の常駐メモリ(RSS)をバイトで取得する. 取得できない環境では None.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def measure(label, func, rosters, ticks):
+    gc.collect()
+    rss_before = rss()
+    tracemalloc.start()
+    started = time.perf_counter()
+    kept = func([list(roster) for roster in rosters], ticks, random.Random(1))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss()
+    rss_msg = "{:8.1f} MiB".format((rss_after - rss_before) / 1048576) if rss_before is not None else "     n/a"
+    print("{:<7} 定常: {:8.1f} MiB  ピーク: {:8.1f} MiB  RSS増加: {}  時間: {:6.2f} 秒".format(
+        label, current / 1048576, peak / 1048576, rss_msg, elapsed))
+    del kept
+    gc.collect()
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プレイヤー情報のメモリ使用量ベンチマーク")
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--grids", type=int, default=225)
+    parser.add_argument("--players", type=int, default=100)
+    args = parser.parse_args()
+
+    rosters = make_rosters(args.grids, args.players, 0)
+    print("{}サーバ × {}人, {} tick".format(args.grids, args.players, args.ticks))
+    before = measure("before", run_before, rosters, args.ticks)
+    after = measure("after", run_after, rosters, args.ticks)
+    print("削減率: {:.1f}%".format((1 - after / before) * 100 if before else 0))
+
+
+if __name__ == "__main__":
+    main()
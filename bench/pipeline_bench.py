@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+監視処理パイプラインのベンチマーク.
+監視サーバ数を変えて1回分の監視処理(engine.process)を実行し、全体の所要時間と段階毎の処理時間を表示する.
+段階毎の処理時間の合計が全体の所要時間を上回った分が、段階を並行に動かしたことで重なった時間.
+Atlas API と Discord への通信は指定した遅延で応答する偽物に置き換え、デコードは thread モードで行う.
+実行方法: python bench/pipeline_bench.py [--grids 5 30] [--players 100] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SETTINGS = """[Settings]
+bot_token = TokenHere
+watch_world = 1
+watch_interval = 150
+send_message_player_count_sbn = 10
+enemy_list = {"enemy": "company"}
+match_mode = thread
+"""
+
+
+class FakeServer:
+    def __init__(self, server_id, channels):
+        self.id = str(server_id)
+        self.name = "guild{}".format(server_id)
+        self.channels = [FakeChannel(self, channel_name) for channel_name in channels]
+
+
+class FakeChannel:
+    def __init__(self, server, name):
+        from discord import ChannelType
+        self.server = server
+        self.name = name
+        self.type = ChannelType.text
+        self.id = "{}-{}".format(server.id, name)
+
+
+class FakeClient:
+    def __init__(self, servers, latency):
+        self.servers = servers
+        self.latency = latency
+
+    async def send_message(self, channel, content):
+        await asyncio.sleep(self.latency)
+
+
+class FakeFetcher:
+    def __init__(self, players, latency):
+        self.latency = latency
+        self.cluster = [{"id": i, "player_count": players} for i in range(1, 226)]
+        self.players_text = json.dumps([{"name": "player{}".format(i), "tribe": "tribe{}".format(i % 7)}
+                                        for i in range(players)])
+
+    async def fetch_cluster(self, cluster_id):
+        await asyncio.sleep(self.latency)
+        return self.cluster
+
+    async def fetch_players_text(self, server_id):
+        await asyncio.sleep(self.latency)
+        return self.players_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="監視処理パイプラインのベンチマーク")
+    parser.add_argument("--grids", type=int, nargs="+", default=[5, 30])
+    parser.add_argument("--players", type=int, default=100, help="サーバ毎のプレイヤー数")
+    parser.add_argument("--latency", type=float, default=0.05, help="Discord/Atlas API の応答遅延(秒)")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="aswdb-bench-"))
+    with open("settings.ini", "w", encoding="utf-8") as f:
+        f.write(SETTINGS)
+    sys.path.insert(0, ROOT)
+    from awsdb import consts
+    from awsdb.utils import ASWDConfig
+    from awsdb.watcher import WatchEngine
+
+    loop = asyncio.get_event_loop()
+    print("応答遅延 {:.0f}ms  プレイヤー数 {}".format(args.latency * 1000, args.players))
+    for grids in args.grids:
+        server = FakeServer(grids, [server["name"] for server in consts.SERVER_NAMES[:grids]])
+        config = ASWDConfig(FakeClient([server], args.latency))
+        engine = WatchEngine(config, FakeFetcher(args.players, args.latency))
+        guild = config.guild(server)
+        loop.run_until_complete(engine.process([guild]))
+        started = time.perf_counter()
+        loop.run_until_complete(engine.process([guild]))
+        elapsed = time.perf_counter() - started
+        stage_times = engine.stage_times
+        print("{:>4}サーバ  全体: {:6.3f} 秒  段階合計: {:6.3f} 秒  ({})".format(
+            grids, elapsed, sum(stage_times.values()),
+            "  ".join("{}: {:.3f}".format(name, stage_times[name]) for name in consts.PIPELINE_STAGES)))
+        engine.match_service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
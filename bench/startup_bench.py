@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+起動時間ベンチマーク.
+プロセス起動から初回の監視処理(tick)完了までの時間を、ギルド数 1 と 100 で計測する.
+Discord と Atlas API への通信は指定した遅延で応答する偽物に置き換え、作業フォルダは一時フォルダを使う.
+  - 全ギルドが監視中の状態から自動再開し、Bot用コマンドチャンネルのないギルドではチャンネルを作成する.
+  - ギルド毎に監視報告チャンネル(A1)を1つ持つ.
+実行方法: python bench/startup_bench.py [--guilds 1 100] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BOT_SCRIPT = os.path.join(ROOT, "atlas-watch-server-discord-bot.py")
+SETTINGS = """[Settings]
+bot_token = TokenHere
+watch_world = 1
+watch_interval = 150
+send_message_player_count_sbn = 10
+enemy_list = {"enemy": "company"}
+auto_start = True
+"""
+
+
+class FakeUser:
+    id = "0"
+    name = "bench"
+
+
+class FakeServer:
+    def __init__(self, server_id, channels):
+        self.id = str(server_id)
+        self.name = "guild{}".format(server_id)
+        self.channels = []
+        for channel_name in channels:
+            self.channels.append(FakeChannel(self, channel_name))
+
+
+class FakeChannel:
+    def __init__(self, server, name):
+        from discord import ChannelType
+        self.server = server
+        self.name = name
+        self.type = ChannelType.text
+        self.id = "{}-{}".format(server.id, name)
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.id = str(id(self))
+        self.channel = channel
+        self.server = channel.server
+        self.content = content
+
+
+def fake_client_class(base, servers, latency):
+    """
+    Discord への通信を遅延付きの偽物に置き換えたクライアントクラスを作成する.
+    """
+
+    class BenchClient(base):
+        user = FakeUser()
+
+        @property
+        def servers(self):
+            return servers
+
+        @servers.setter
+        def servers(self, value):
+            pass
+
+        async def create_channel(self, server, name, type=None):
+            await asyncio.sleep(latency)
+            channel = FakeChannel(server, name)
+            server.channels.append(channel)
+            return channel
+
+        async def send_message(self, channel, content):
+            await asyncio.sleep(latency)
+            return FakeMessage(channel, content)
+
+        async def edit_message(self, message, content):
+            await asyncio.sleep(latency)
+            message.content = content
+            return message
+
+        async def pin_message(self, message):
+            await asyncio.sleep(latency)
+
+    return BenchClient
+
+
+def run_child(guilds, latency, started_at):
+    """
+    一時フォルダで Bot を読み込み、on_ready から初回の tick 完了までを実行する.
+    """
+    os.chdir(tempfile.mkdtemp(prefix="aswdb-bench-"))
+    with open("settings.ini", "w", encoding="utf-8") as f:
+        f.write(SETTINGS)
+    sys.path.insert(0, ROOT)
+
+    import discord
+    from awsdb.fetcher import AtlasFetcher
+    from awsdb.watcher import WatchEngine
+
+    cluster_text = json.dumps([{"id": i, "player_count": 10} for i in range(1, 226)])
+    players_text = json.dumps([{"name": "player{}".format(i)} for i in range(10)])
+
+    async def get_text(self, url):
+        await asyncio.sleep(latency)
+        return cluster_text if "cluster" in url else players_text
+
+    AtlasFetcher.get_text = get_text
+
+    loop = asyncio.get_event_loop()
+    first_tick = loop.create_future()
+    tick = WatchEngine.tick
+
+    async def timed_tick(self):
+        ret = await tick(self)
+        if not first_tick.done():
+            first_tick.set_result(time.time())
+        return ret
+
+    WatchEngine.tick = timed_tick
+
+    # 半分のギルドは Bot用コマンドチャンネルがない状態から起動する
+    servers = [FakeServer(i, ["A1"] if i % 2 else ["A1", "cmd_aswdb"]) for i in range(1, guilds + 1)]
+    discord.Client = fake_client_class(discord.Client, servers, latency)
+    spec = importlib.util.spec_from_file_location("bot", BOT_SCRIPT)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    imported_at = time.time()
+    for server in servers:
+        bot.config.guild(server).is_watch_started = True
+
+    loop.run_until_complete(bot.on_ready())
+    ready_at = time.time()
+    tick_at = loop.run_until_complete(first_tick)
+    print(json.dumps({"imported": imported_at - started_at, "ready": ready_at - started_at,
+                      "first_tick": tick_at - started_at}))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間ベンチマーク")
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1, 100])
+    parser.add_argument("--latency", type=float, default=0.05, help="Discord/Atlas API の応答遅延(秒)")
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.guilds[0], args.latency, args.child)
+        return
+
+    print("応答遅延 {:.0f}ms".format(args.latency * 1000))
+    for guilds in args.guilds:
+        started_at = time.time()
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--guilds", str(guilds),
+                                       "--latency", str(args.latency), "--child", repr(started_at)])
+        result = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+        print("{:>4}ギルド  読み込み: {:6.3f} 秒  on_ready完了: {:6.3f} 秒  初回tick完了: {:6.3f} 秒".format(
+            guilds, result["imported"], result["ready"], result["first_tick"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from awsdb.alerts import ALERT_ENEMY, AlertTracker
+
+
+def test_observe_enters_after_enter_ticks():
+    alerts = AlertTracker(enter_ticks=2, exit_ticks=2)
+    assert alerts.observe("B7", ALERT_ENEMY, ["evil"], now=0) == ([], [], False)
+    assert alerts.observe("B7", ALERT_ENEMY, ["evil"], now=1) == (["evil"], [], False)
+    assert alerts.observe("B7", ALERT_ENEMY, ["evil"], now=2) == ([], [], True)
+
+
+def test_observe_ignores_a_single_noisy_sample():
+    alerts = AlertTracker(enter_ticks=2, exit_ticks=2)
+    alerts.observe("B7", ALERT_ENEMY, ["evil"], now=0)
+    alerts.observe("B7", ALERT_ENEMY, [], now=1)
+    # 続けて確認できなかったため数え直す
+    assert alerts.observe("B7", ALERT_ENEMY, ["evil"], now=2) == ([], [], False)
+    assert alerts.members("B7", ALERT_ENEMY) == set()
+
+
+def test_observe_exits_after_exit_ticks():
+    alerts = AlertTracker(enter_ticks=1, exit_ticks=2)
+    alerts.observe("B7", ALERT_ENEMY, ["evil"], now=0)
+    assert alerts.observe("B7", ALERT_ENEMY, [], now=1) == ([], [], True)
+    assert alerts.observe("B7", ALERT_ENEMY, [], now=2) == ([], ["evil"], True)
+    assert alerts.active_server_names(ALERT_ENEMY) == []
+
+
+def test_blacklist_keys_on_player_name():
+    from types import SimpleNamespace
+    from awsdb.detectors import BlacklistDetector, DetectContext
+
+    guild = SimpleNamespace(alerts=AlertTracker(enter_ticks=1, exit_ticks=2))
+    detector = BlacklistDetector()
+
+    def detect(company, now):
+        server_info = {"enemy_names": {"evil": "evil({})".format(company)}}
+        return detector.detect(DetectContext(guild, "B7", server_info, False, None, [], now))
+
+    assert detect("Corp", 0) == ["@everyone ブラックリストの evil(Corp) がやってきたぞ."]
+    # カンパニー名が変わっても新たに現れたとはみなさない
+    assert detect("NewCorp", 1) == []
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from types import SimpleNamespace
+
+from awsdb import consts
+from awsdb.feed import MSG_SUBSCRIBE, MSG_TICK, FeedFetcher
+from awsdb.grid import ClusterGrid
+from awsdb.matcher import EnemyMatcher
+from awsdb.peek import PeekService
+
+
+class _Watcher:
+    """
+    購読される度に指定した取得結果を1回だけ配信する監視プロセスの代わり.
+    """
+
+    def __init__(self, interval, clusters=None, servers=None):
+        self.interval = interval
+        self.clusters = clusters or {}
+        self.servers = servers or {}
+        self.subscriptions = []
+        self.address = None
+
+    async def start(self):
+        server = await asyncio.start_server(self.__handle, "127.0.0.1", 0)
+        self.address = "127.0.0.1:{}".format(server.sockets[0].getsockname()[1])
+        return server
+
+    async def __handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            msg = json.loads(line.decode("utf-8"))
+            if msg["type"] != MSG_SUBSCRIBE:
+                continue
+            self.subscriptions.append(msg)
+            writer.write((json.dumps({
+                "type": MSG_TICK, "t": 0, "interval": self.interval,
+                "clusters": dict((cluster_id, self.clusters[cluster_id]) for cluster_id in msg["clusters"]),
+                "servers": dict((server_id, self.servers[server_id]) for server_id in msg["servers"])
+            }) + "\n").encode("utf-8"))
+        writer.close()
+
+
+async def _close(feed, server):
+    feed.stop()
+    server.close()
+    # 切断を監視プロセス側の接続毎の処理に伝える
+    await asyncio.sleep(0.05)
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_frame_older_than_stale_intervals_is_rejected(monkeypatch):
+    monkeypatch.setattr(consts, "FEED_WAIT_TIMEOUT", 0.2)
+
+    async def main():
+        watcher = _Watcher(interval=0.2, clusters={1: [[1, 5]]})
+        server = await watcher.start()
+        feed = FeedFetcher(watcher.address)
+        try:
+            fresh = await feed.fetch_cluster(1)
+            # 監視間隔の FEED_STALE_INTERVALS 倍(0.3秒)を過ぎても次の配信がない
+            await asyncio.sleep(0.2 * consts.FEED_STALE_INTERVALS + 0.1)
+            stale = await feed.fetch_cluster(1)
+        finally:
+            await _close(feed, server)
+        return fresh, stale
+
+    fresh, stale = _run(main())
+    assert fresh == [{"id": 1, "player_count": 5}]
+    assert stale is None
+
+
+def test_peek_fallback_fetches_through_the_feed():
+    server_id = 1
+
+    async def main():
+        watcher = _Watcher(interval=60, clusters={1: [[server_id, 2]]}, servers={server_id: [2, ["evil", "friend"]]})
+        server = await watcher.start()
+        feed = FeedFetcher(watcher.address)
+        # 監視していないクラスターのため、監視結果ではなく取得インスタンスから取得する
+        engine = SimpleNamespace(
+            cluster_grid=lambda cluster_id: ClusterGrid(cluster_id),
+            latest_roster=lambda key, max_age: None,
+            detect=lambda guild, grid: {"enemy_players": [player_name for player_name, enemy
+                                                          in grid["matches"].get(guild.matcher.key, [])]})
+        guild = SimpleNamespace(watch_world=1, matcher=EnemyMatcher(EnemyMatcher.normalize(["evil"])))
+        try:
+            result = await PeekService(engine, feed.on_demand()).peek(guild, "A1")
+        finally:
+            await _close(feed, server)
+        return watcher.subscriptions, result
+
+    subscriptions, result = _run(main())
+    assert subscriptions[-1] == {"type": MSG_SUBSCRIBE, "clusters": [1], "servers": [server_id]}
+    assert result["player_count"] == 2
+    assert result["roster_size"] == 2
+    assert result["enemy_players"] == ["evil"]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from awsdb.grid import GRID_INDEX, GRID_SIZE, detect_movements
+
+
+def _delta(changes):
+    delta = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int32)
+    for server_name, count in changes.items():
+        delta[GRID_INDEX[server_name]] = count
+    return delta
+
+
+def test_detect_movements_to_neighbour():
+    # B7 から東隣へ5人移動
+    source = GRID_INDEX["B7"]
+    target = next(name for name, index in GRID_INDEX.items() if index == (source[0], source[1] + 1))
+    movements = detect_movements(_delta({"B7": -5, target: 5}), min_players=3)
+    assert len(movements) == 1
+    movement = movements[0]
+    assert movement["server_name"] == target
+    assert movement["players"] == 5
+    assert movement["from_server_name"] == "B7"
+    assert movement["heading"] == "東"
+
+
+def test_detect_movements_on_edge():
+    # 端のサーバでも範囲外を 0 で埋めて判定できる
+    movements = detect_movements(_delta({"A1": 4}), min_players=1)
+    assert movements == []
+
+
+def test_detect_movements_below_min_players():
+    source = GRID_INDEX["B7"]
+    target = next(name for name, index in GRID_INDEX.items() if index == (source[0], source[1] + 1))
+    assert detect_movements(_delta({"B7": -2, target: 2}), min_players=3) == []
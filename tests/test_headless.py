@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import io
+
+from awsdb.headless import NdjsonOutput
+
+
+def test_ndjson_output_counts_alerts_past_the_size_limit():
+    stream = io.StringIO()
+    output = NdjsonOutput(stream, max_bytes=200, keep_alerts=2)
+    for i in range(10):
+        output.write({"type": "alert", "tick": i, "message": "警告{}".format(i)})
+    assert output.alert_count == 10
+    assert output.alerts == ["警告0", "警告1"]
+    assert output.truncated
+    assert len(stream.getvalue().encode("utf-8")) <= 200
+    assert stream.getvalue().endswith("\n")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+
+from PIL import Image
+
+from awsdb import consts
+from awsdb.grid import ClusterGrid
+from awsdb.heatmap import HeatmapRenderer
+
+
+def _grid():
+    grid = ClusterGrid(1)
+    grid.update([{"id": 1, "player_count": 10}, {"id": 2, "player_count": 3}])
+    return grid
+
+
+def test_render_async_matches_render():
+    grid = _grid()
+    png = HeatmapRenderer().render(grid, ["A1"], [])
+    loop = asyncio.new_event_loop()
+    try:
+        png_async = loop.run_until_complete(HeatmapRenderer().render_async(grid, ["A1"], [], loop=loop))
+    finally:
+        loop.close()
+    assert png == png_async
+    image = Image.open(io.BytesIO(png))
+    size = consts.HEATMAP_MARGIN + consts.HEATMAP_CELL_SIZE * 15 + 1
+    assert image.size == (size, size)
+
+
+def test_render_output_follows_cells():
+    renderer = HeatmapRenderer()
+    grid = _grid()
+    png = renderer.render(grid, [], [])
+    # 更新回数が変わっても同じ人数なら、作成済みのセルから同じ画像になる
+    grid.update([{"id": 1, "player_count": 10}, {"id": 2, "player_count": 3}])
+    assert renderer.render(grid, [], []) == png
+    grid.update([{"id": 1, "player_count": 10}, {"id": 2, "player_count": 4}])
+    assert renderer.render(grid, [], []) != png
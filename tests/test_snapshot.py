@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from awsdb.snapshot import WatchSnapshot
+
+
+def test_round_trip_keeps_long_multibyte_names():
+    name = "敵" * 100
+    snapshot = WatchSnapshot([{
+        "guild_id": "1",
+        "watch_world": 2,
+        "is_watch_started": True,
+        "last_player_counts": {"B7": 3, "A1": None},
+        "alerts": [("B7", "enemy", 1.5, [(name, 2)])]
+    }], saved_at=10.0)
+    restored = WatchSnapshot.from_bytes(snapshot.to_bytes())
+    assert restored.saved_at == 10.0
+    assert restored.guilds == snapshot.guilds
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from awsdb.store import GuildConfigStore
+
+
+def _defaults():
+    return SimpleNamespace(watch_world=1, watch_interval=150, player_sbn_count=3, company_alert_count=3,
+                           enemy_list={})
+
+
+def _fail_inserts(path, condition="1"):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TRIGGER fail_insert BEFORE INSERT ON enemies WHEN {}"
+                     " BEGIN SELECT RAISE(ABORT, 'fail'); END".format(condition))
+    return conn
+
+
+def _allow_inserts(conn):
+    with conn:
+        conn.execute("DROP TRIGGER fail_insert")
+    conn.close()
+
+
+def test_read_through_and_write_behind(tmp_path):
+    path = str(tmp_path / "guilds.db")
+    store = GuildConfigStore(_defaults(), path)
+    guild = store.get_by_id("1")
+    assert store.get_by_id("1") is guild
+    guild.watch_interval = 300
+    guild.add_enemy("evil", "Corp")
+    # flush するまでは書き込まない
+    assert GuildConfigStore(_defaults(), path).load_enemies("1") == {}
+    assert store.flush() == 1
+    assert store.flush() == 0
+
+    reopened = GuildConfigStore(_defaults(), path).get_by_id("1")
+    assert reopened.watch_interval == 300
+    assert reopened.enemy_list == {"evil": "Corp"}
+
+
+def test_flush_failure_keeps_changes_dirty(tmp_path):
+    path = str(tmp_path / "guilds.db")
+    store = GuildConfigStore(_defaults(), path)
+    guild = store.get_by_id("1")
+    guild.add_enemy("evil", "Corp")
+    conn = _fail_inserts(path)
+    with pytest.raises(sqlite3.DatabaseError):
+        store.flush()
+    _allow_inserts(conn)
+
+    assert store.flush() == 1
+    assert GuildConfigStore(_defaults(), path).load_enemies("1") == {"evil": "Corp"}
+
+
+def test_flush_async_failure_keeps_changes_dirty(tmp_path):
+    path = str(tmp_path / "guilds.db")
+    store = GuildConfigStore(_defaults(), path)
+    guild = store.get_by_id("1")
+    guild.add_enemy("evil", "Corp")
+    loop = asyncio.new_event_loop()
+    try:
+        conn = _fail_inserts(path)
+        with pytest.raises(sqlite3.DatabaseError):
+            loop.run_until_complete(store.flush_async(loop))
+        # 失敗中の変更より後の変更も合わせて書き込む
+        guild.add_enemy("bad", "")
+        _allow_inserts(conn)
+        assert loop.run_until_complete(store.flush_async(loop)) == 1
+    finally:
+        loop.close()
+    assert GuildConfigStore(_defaults(), path).load_enemies("1") == {"evil": "Corp", "bad": ""}
+
+
+def test_import_enemies_is_one_transaction(tmp_path):
+    path = str(tmp_path / "guilds.db")
+    store = GuildConfigStore(_defaults(), path)
+    guild = store.get_by_id("1")
+    entries = [("evil{}".format(i), "Corp") for i in range(100)] + [("bad", "")]
+    loop = asyncio.new_event_loop()
+    try:
+        # 最後の1件で失敗させ、それまでの行も書き込まれないこと
+        conn = _fail_inserts(path, "NEW.name = 'bad'")
+        with pytest.raises(sqlite3.DatabaseError):
+            loop.run_until_complete(store.import_enemies(guild, entries, loop))
+        assert store.load_enemies("1") == {}
+        assert guild.enemy_list == {}
+        _allow_inserts(conn)
+        assert loop.run_until_complete(store.import_enemies(guild, entries, loop)) == 101
+    finally:
+        loop.close()
+    assert len(GuildConfigStore(_defaults(), path).load_enemies("1")) == 101
+    assert guild.enemy_list["bad"] == ""